@@ -13,6 +13,7 @@
 import Ice
 import logging
 import threading
+import time
 import uuid
 
 import omero
@@ -314,3 +315,264 @@ class CmdCallbackI(omero.cmd.CmdCallback):
         self.adapter.remove(self.id)  # OK ADAPTER USAGE
         if closeHandle:
             self.handle.close()
+
+
+FIRST_COMPLETED = "FIRST_COMPLETED"
+ALL_COMPLETED = "ALL_COMPLETED"
+
+
+class CmdFuture(object):
+    """
+    Handle for a command tracked by a CmdCallbackManager. The
+    interface follows that of concurrent.futures.Future: result()
+    blocks until the server has notified the manager of completion and
+    either returns the omero.cmd.Response or raises omero.CmdError.
+
+    The most recent step notification is available as "steps", a
+    (complete, total) tuple.
+    """
+
+    def __init__(self, manager, handle, id):
+        self.manager = manager
+        self.handle = handle
+        self.id = id
+        self.steps = (0, 0)
+        self.state = (None, None)  # (Response, Status)
+        self.callbacks = []
+
+    def done(self):
+        return self.state[0] is not None
+
+    def running(self):
+        return not self.done()
+
+    def cancel(self):
+        """
+        Requests cancellation of the command on the server. Returns
+        whether the server accepted the request.
+        """
+        if self.done():
+            return False
+        return self.handle.cancel()
+
+    def cancelled(self):
+        status = self.state[1]
+        return status is not None and \
+            omero.cmd.State.CANCELLED in status.flags
+
+    def getResponse(self):
+        return self.state[0]
+
+    def getStatus(self):
+        return self.state[1]
+
+    def wait(self, timeout=None):
+        """
+        Waits for completion for at most timeout seconds and returns
+        whether the command has completed.
+        """
+        self.manager.wait([self], timeout=timeout)
+        return self.done()
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise omero.LockTimeout(
+                None, None, "Command unfinished after %s seconds" % timeout,
+                5000L, int(timeout))
+        rsp = self.state[0]
+        if isinstance(rsp, omero.cmd.ERR):
+            raise omero.CmdError(rsp)
+        return rsp
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout)
+        except omero.CmdError, ce:
+            return ce
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(future) once the command has completed, immediately
+        if that is already the case.
+        """
+        with self.manager.condition:
+            if not self.done():
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def close(self, closeHandle=True):
+        self.manager.release(self, closeHandle)
+
+
+class CmdCallbackManager(omero.cmd.CmdCallback):
+    """
+    Single CmdCallback servant which tracks many command handles at
+    once. Each handle is registered under its own identity on the shared
+    adapter and the identity of the incoming call is used to find the
+    matching CmdFuture. Waiters block on one condition variable which is
+    notified on every finished() call, so no thread or polling loop
+    is needed per outstanding command.
+
+    Example usage::
+
+        manager = CmdCallbackManager(client)
+        try:
+            futures = [manager.submit(req) for req in requests]
+            for future in manager.as_completed(futures):
+                print future.result()
+        finally:
+            manager.close()
+    """
+
+    def __init__(self, adapter_or_client, category=None):
+        if adapter_or_client is None:
+            raise omero.ClientError("Null client")
+        self.client = None
+        if not isinstance(adapter_or_client, Ice.ObjectAdapter):
+            self.client = adapter_or_client
+        self.adapter, self.category = \
+            adapter_and_category(adapter_or_client, category)
+        self.condition = threading.Condition()
+        self.futures = {}
+
+    def submit(self, req, ctx=None):
+        """
+        Submits the request via the client's session and returns a
+        CmdFuture for it.
+        """
+        if self.client is None:
+            raise omero.ClientError("No client available")
+        handle = self.client.getSession().submit(req, ctx)
+        return self.track(handle)
+
+    def track(self, handle):
+        """
+        Registers for notifications from an already submitted handle and
+        returns a CmdFuture for it.
+        """
+        if handle is None:
+            raise omero.ClientError("Null handle")
+        id = Ice.Identity(str(uuid.uuid4()), self.category)
+        future = CmdFuture(self, handle, id)
+        with self.condition:
+            self.futures[id.name] = future
+        prx = self.adapter.add(self, id)  # OK ADAPTER USAGE
+        prx = omero.cmd.CmdCallbackPrx.uncheckedCast(prx)
+        handle.addCallback(prx)
+        # See CmdCallbackI.initialPoll for the race this prevents
+        try:
+            rsp = handle.getResponse()
+            if rsp is not None:
+                self._finish(future, rsp, handle.getStatus())
+        except Ice.ObjectNotExistException:
+            CMD_LOG.debug("Handle already closed: %s", id.name)
+        return future
+
+    def wait(self, futures=None, timeout=None, return_when=ALL_COMPLETED):
+        """
+        Blocks until all (or with FIRST_COMPLETED, any) of the futures
+        have completed or until timeout seconds have passed. Returns a
+        (done, not_done) tuple of sets like concurrent.futures.wait.
+        """
+        if futures is None:
+            futures = self.futures.values()
+        futures = set(futures)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                done = set(f for f in futures if f.done())
+                not_done = futures - done
+                if not not_done:
+                    break
+                if return_when == FIRST_COMPLETED and done:
+                    break
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+        return done, not_done
+
+    def as_completed(self, futures=None, timeout=None):
+        """
+        Yields the futures as they complete. If timeout is given and not
+        all futures have completed in time, omero.LockTimeout is raised.
+        """
+        if futures is None:
+            futures = self.futures.values()
+        pending = set(futures)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while pending:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            done, pending = self.wait(pending, remaining, FIRST_COMPLETED)
+            if not done:
+                raise omero.LockTimeout(
+                    None, None, "%s commands unfinished after %s seconds"
+                    % (len(pending), timeout), 5000L, int(timeout))
+            for future in done:
+                yield future
+
+    def release(self, future, closeHandle=True):
+        """
+        Stops tracking the future and optionally closes its handle.
+        """
+        with self.condition:
+            self.futures.pop(future.id.name, None)
+        try:
+            self.adapter.remove(future.id)  # OK ADAPTER USAGE
+        except Ice.NotRegisteredException:
+            pass
+        if closeHandle:
+            future.handle.close()
+
+    def close(self, closeHandles=True):
+        """
+        Releases all tracked futures.
+        """
+        for future in list(self.futures.values()):
+            try:
+                self.release(future, closeHandles)
+            except Exception, e:
+                CMD_LOG.warn("Error closing %s: %s", future.id.name, e)
+
+    def _lookup(self, current):
+        with self.condition:
+            return self.futures.get(current.id.name)
+
+    def _finish(self, future, rsp, status):
+        with self.condition:
+            if future.done():
+                return
+            future.state = (rsp, status)
+            callbacks = future.callbacks
+            future.callbacks = []
+            self.condition.notify_all()
+        for fn in callbacks:
+            try:
+                fn(future)
+            except Exception:
+                CMD_LOG.exception("Error in done callback")
+
+    #
+    # Remote invocations
+    #
+
+    def step(self, complete, total, current=None):
+        future = self._lookup(current)
+        if future is not None:
+            future.steps = (complete, total)
+
+    def finished(self, rsp, status, current=None):
+        future = self._lookup(current)
+        if future is not None:
+            self._finish(future, rsp, status)
@@ -1949,6 +1949,14 @@ class GraphControl(CmdControl):
             "--ordered", action="store_true",
             help=("Pass multiple objects to commands strictly in the order "
                   "given, otherwise group into as few commands as possible."))
+        parser.add_argument(
+            "--batch-size", type=int, metavar="N",
+            help=("Split the targets into separate commands of at most N "
+                  "objects each. --wait then applies to each batch"))
+        parser.add_argument(
+            "--parallel", type=int, default=1, metavar="N",
+            help=("Number of batches to run concurrently when --batch-size "
+                  "is set (default: 1)"))
         parser.add_argument(
             "--list", action="store_true",
             help="Print a list of all available graph specs")
@@ -2050,6 +2058,11 @@ class GraphControl(CmdControl):
                 req.request.childOptions = req.childOptions
                 req.request.dryRun = req.dryRun
 
+        if args.ordered and args.parallel > 1:
+            self.ctx.die(441, "--ordered cannot be used with --parallel")
+        if args.batch_size is not None and args.batch_size < 1:
+            self.ctx.die(441, "--batch-size must be positive")
+
         if not args.ordered and len(commands) > 1:
             commands = self.combine_commands(commands)
 
@@ -2063,6 +2076,159 @@ class GraphControl(CmdControl):
 
         self._process_request(cmd, args, client)
 
+    def _process_request(self, req, args, client):
+        """
+        Runs the request as a single command unless --batch-size was
+        given, in which case it is split via split_request() and the
+        batches are passed to process_batches().
+        """
+        if getattr(args, "batch_size", None) is None:
+            return super(GraphControl, self)._process_request(
+                req, args, client)
+        batches = self.split_request(req, args.batch_size)
+        self.process_batches(batches, args, client)
+
+    def split_request(self, req, batch_size):
+        """
+        Splits a request or DoAll into a list of requests which target
+        at most batch_size objects of a single type. All other fields
+        of the requests are kept. Target users (as used by Chown2) are
+        moved into a batch of their own so that they are only processed once.
+        """
+        import copy
+        rv = []
+        for request in self.as_doall(req).requests:
+            targets = request.targetObjects or {}
+            users = getattr(request, "targetUsers", None)
+            if users:
+                batch = copy.copy(request)
+                batch.targetObjects = {}
+                rv.append(batch)
+            for type, ids in sorted(targets.items()):
+                for i in range(0, len(ids), batch_size):
+                    batch = copy.copy(request)
+                    batch.targetObjects = {type: ids[i:i + batch_size]}
+                    if users:
+                        batch.targetUsers = []
+                    if isinstance(request, omero.cmd.SkipHead):
+                        batch.request = copy.copy(request.request)
+                        batch.request.targetObjects = batch.targetObjects
+                    rv.append(batch)
+        return rv
+
+    def process_batches(self, batches, args, client):
+        """
+        Submits the batches with at most args.parallel of them running at
+        once. A single CmdCallbackManager receives the notifications for
+        all batches; steps reported by the server are aggregated and
+        printed to stderr periodically. Once all batches have completed,
+        the failed ones are listed and a non-zero return code is set.
+        With "--wait 0" all batches are submitted without waiting and
+        on Ctrl-C the running batches are cancelled.
+        """
+        import time
+        import omero.callbacks
+
+        parallel = max(1, args.parallel)
+        timeout = None
+        if args.wait is not None and args.wait > 0:
+            timeout = args.wait
+        queue = list(reversed(batches))
+        running = {}
+        failed = []
+        finished = 0
+
+        def report(force=False):
+            now = time.time()
+            if not force and now - report.last < 5:
+                return
+            report.last = now
+            steps = [f.steps for f in running]
+            self.ctx.err("Batches: %s/%s finished, steps: %s/%s" % (
+                finished, len(batches),
+                sum(x[0] for x in steps), sum(x[1] for x in steps)))
+        report.last = time.time()
+
+        manager = omero.callbacks.CmdCallbackManager(client)
+        if args.wait == 0:
+            try:
+                for batch in batches:
+                    manager.submit(batch)
+            finally:
+                # Leave the commands running on the server
+                manager.close(False)
+            self.ctx.out("Exiting immediately")
+            return
+
+        interrupted = False
+        try:
+            while queue or running:
+                while queue and len(running) < parallel:
+                    batch = queue.pop()
+                    try:
+                        future = manager.submit(batch)
+                    except Exception, e:
+                        self.ctx.out(self.print_request_description(batch),
+                                     newline=False)
+                        self.ctx.err("failed: %s" % e)
+                        failed.append(batch)
+                        finished += 1
+                        continue
+                    running[future] = (batch, time.time())
+                if not running:
+                    continue
+
+                done, not_done = manager.wait(
+                    running.keys(), timeout=5,
+                    return_when=omero.callbacks.FIRST_COMPLETED)
+                for future in not_done:
+                    batch, started = running[future]
+                    if timeout is not None and \
+                            time.time() - started > timeout:
+                        self.ctx.out(self.print_request_description(batch),
+                                     newline=False)
+                        self.ctx.err("failed: unfinished after %s seconds"
+                                     % timeout)
+                        future.cancel()
+                        failed.append(batch)
+                        done.add(future)
+                for future in done:
+                    batch, started = running.pop(future)
+                    finished += 1
+                    if future.done():
+                        rsp = future.getResponse()
+                        self.print_report(
+                            batch, rsp, future.getStatus(), args.report)
+                        if self.get_error(rsp):
+                            failed.append(batch)
+                    future.close(True)  # Close handle
+                report()
+
+        # If user uses Ctrl-C, then cancel
+        except KeyboardInterrupt:
+            interrupted = True
+            self.ctx.out("Attempting cancel...")
+            for future, (batch, started) in running.items():
+                self.ctx.out(self.print_request_description(batch),
+                             newline=False)
+                if future.cancel():
+                    self.ctx.out("Cancelled")
+                else:
+                    self.ctx.out("Failed to cancel")
+        finally:
+            manager.close(True)
+
+        report(force=True)
+        if interrupted:
+            self.ctx.die(443, "Interrupted: %s of %s batches unfinished" % (
+                len(batches) - finished, len(batches)))
+        if failed:
+            self.ctx.err("%s of %s batches failed:" % (
+                len(failed), len(batches)))
+            for batch in failed:
+                self.ctx.err("  %s" % self.print_request_description(batch))
+            self.ctx.die(442, "Batches failed")
+
     def _check_command(self, command_check):
         query = self.ctx.get_client().sf.getQueryService()
         ec = self.ctx.get_event_context()
@@ -83,6 +83,13 @@ class AbstractColumn(object):
         """
         self.__table = tbl
 
+    def prepare(self, tbl):
+        """
+        Called by tables.py before arrays() when appending or updating
+        rows. By default, does nothing.
+        """
+        pass
+
     def append(self, tbl):
         """
         Called by tables.py to give columns. By default, does nothing.
@@ -237,24 +244,112 @@ class LongColumnI(AbstractColumn, omero.grid.LongColumn):
 
 class StringColumnI(AbstractColumn, omero.grid.StringColumn):
 
+    """
+    Strings are stored in one of three encodings:
+
+    * FIXED: padded to the column size in the main table (default)
+    * VLEN: in a separate variable-length array, with the row holding the
+      index of its string. Requested via the "vlen_columns" storage option.
+    * DICTIONARY: as integer codes into a separate lookup array of the
+      distinct values. Requested via the "dictionary_columns" storage
+      option.
+
+    See omero.hdfstorageV2.STORAGE_OPTIONS. The size of encoded columns
+    is ignored, FIXED columns must have a size greater than 0.
+    """
+
+    FIXED = "fixed"
+    VLEN = "vlen"
+    DICTIONARY = "dictionary"
+
     def __init__(self, name="Unknown", *args):
         omero.grid.StringColumn.__init__(self, name, *args)
+        self.encoding = None
+        self._tbl = None
+        self._new = []
         AbstractColumn.__init__(self)
 
+    def _encoding(self):
+        return self.encoding or self.FIXED
+
     def settable(self, tbl):
         AbstractColumn.settable(self, tbl)
-        self.size = getattr(tbl.cols, self.name).dtype.itemsize
+        self._tbl = tbl
+        dtype = getattr(tbl.cols, self.name).dtype
+        if dtype.kind == "S":
+            self.encoding = self.FIXED
+            self.size = dtype.itemsize
+        else:
+            # Encoded columns report no maximum size to clients
+            self.encoding = dtype == numpy.int64 and \
+                self.VLEN or self.DICTIONARY
+            self.size = 0
+
+    def prepare(self, tbl):
+        self.settable(tbl)
 
     def arrays(self):
         """
-        Check for strings longer than the initialised column width
+        Check for strings longer than the initialised column width and
+        encode the values for VLEN and DICTIONARY columns
         """
-        for v in self.values:
-            if len(v) > self.size:
-                raise omero.ValidationException(
-                    None, None, "Maximum string length in column %s is %d" %
-                    (self.name, self.size))
-        return [self.values]
+        encoding = self._encoding()
+        values = self.values or []
+        if encoding == self.FIXED:
+            if values:
+                lengths = numpy.char.str_len(numpy.asarray(values))
+                longest = lengths.argmax()
+                if lengths[longest] > self.size:
+                    raise omero.ValidationException(
+                        None, None, "Maximum string length in column %s "
+                        "is %d" % (self.name, self.size))
+            return [values]
+
+        if encoding == self.VLEN:
+            base = _strings(self._tbl, self.name, "strings").nrows
+            self._new = values
+            return [numpy.arange(base, base + len(values), dtype=numpy.int64)]
+
+        lookup = string_lookup(self._tbl, self.name)
+        uniq, inverse = numpy.unique(numpy.asarray(values, dtype=object),
+                                     return_inverse=True)
+        self._new = []
+        codes = numpy.empty(len(uniq), dtype=numpy.int32)
+        for i, value in enumerate(uniq):
+            code = lookup.get(value)
+            if code is None:
+                code = len(lookup)
+                lookup[value] = code
+                self._new.append(value)
+            codes[i] = code
+        return [codes[inverse]]
+
+    def append(self, tbl):
+        if self._encoding() == self.VLEN:
+            strings = _strings(tbl, self.name, "strings")
+        elif self._encoding() == self.DICTIONARY:
+            strings = _strings(tbl, self.name, "dictionary")
+        else:
+            return
+        for value in self._new:
+            strings.append(value)
+        self._new = []
+
+    def encode(self, tbl):
+        """
+        Returns the stored representation of the current values, appending
+        any new strings to the encoded column. Used by HdfStorage.update()
+        """
+        self.prepare(tbl)
+        values = self.arrays()[0]
+        self.append(tbl)
+        return values
+
+    def fromrows(self, rows):
+        if self._tbl is None or self.encoding in (None, self.FIXED):
+            return AbstractColumn.fromrows(self, rows)
+        decoded = decode_strings(self._tbl, self.name, rows[self.name])
+        self.values = decoded.tolist()
 
     def dtypes(self):
         """
@@ -262,6 +357,11 @@ class StringColumnI(AbstractColumn, omero.grid.StringColumn):
         (Testing suggests this may not be necessary, the size appears to be
         correctly set at initialisation)
         """
+        encoding = self._encoding()
+        if encoding == self.VLEN:
+            return [(self.name, "i8")]
+        elif encoding == self.DICTIONARY:
+            return [(self.name, "i4")]
         return [(self.name, "S", self.size)]
 
     def descriptor(self, pos):
@@ -269,6 +369,11 @@ class StringColumnI(AbstractColumn, omero.grid.StringColumn):
         # to prevent exceptions we temporarily assume size 1
         if pos is None:
             return tables.StringCol(pos=pos, itemsize=1)
+        encoding = self._encoding()
+        if encoding == self.VLEN:
+            return tables.Int64Col(pos=pos)
+        elif encoding == self.DICTIONARY:
+            return tables.Int32Col(pos=pos)
         if self.size < 1:
             raise omero.ApiUsageException(
                 None, None, "String size must be > 0 (Column: %s)"
@@ -276,6 +381,68 @@ class StringColumnI(AbstractColumn, omero.grid.StringColumn):
         return tables.StringCol(pos=pos, itemsize=self.size)
 
 
+def _strings(tbl, name, kind, create=True):
+    """
+    Returns the variable-length array holding the strings of an encoded
+    column, kind is either "strings" (VLEN) or "dictionary" (DICTIONARY)
+    """
+    p = tbl._v_parent
+    node = "%s_%s_%s" % (tbl._v_name, name, kind)
+    try:
+        return getattr(p, node)
+    except tables.NoSuchNodeError:
+        if not create:
+            return None
+        return tbl._v_file.create_vlarray(p, node, tables.VLStringAtom())
+
+
+def string_lookup(tbl, name):
+    """
+    Returns a dict from string to code for a DICTIONARY column
+    """
+    strings = _strings(tbl, name, "dictionary")
+    return dict((v, i) for i, v in enumerate(strings.read()))
+
+
+def string_encoding(tbl, name):
+    """
+    Returns StringColumnI.VLEN or StringColumnI.DICTIONARY if the given
+    column of tbl is an encoded string column, otherwise None
+    """
+    if _strings(tbl, name, "strings", create=False) is not None:
+        return StringColumnI.VLEN
+    if _strings(tbl, name, "dictionary", create=False) is not None:
+        return StringColumnI.DICTIONARY
+    return None
+
+
+def decode_strings(tbl, name, stored):
+    """
+    Converts the stored indexes or codes of an encoded string column into a
+    numpy object array of strings. Returns None for FIXED columns.
+    """
+    stored = numpy.asarray(stored, dtype=numpy.int64)
+    vlen = _strings(tbl, name, "strings", create=False)
+    if vlen is not None:
+        strings = numpy.empty(len(stored), dtype=object)
+        if len(stored) == 0:
+            return strings
+        first, last = stored.min(), stored.max() + 1
+        if last - first > 2 * len(stored):
+            # Sparse after updates, read the strings one by one
+            strings[:] = [vlen[i] for i in stored]
+            return strings
+        block = numpy.empty(last - first, dtype=object)
+        block[:] = vlen.read(first, last)
+        return block[stored - first]
+    dictionary = _strings(tbl, name, "dictionary", create=False)
+    if dictionary is not None:
+        strings = numpy.empty(dictionary.nrows, dtype=object)
+        strings[:] = dictionary.read()
+        return strings[stored]
+    return None
+
+
 class AbstractArrayColumn(AbstractColumn):
     """
     Additional base logic for array columns
@@ -23,6 +23,27 @@
 Conversion utilities for changing between units.
 """
 
+import threading
+
+from fractions import Fraction
+
+
+class NonLinear(Exception):
+    """
+    Raised by Conversion.linear() if the conversion cannot be
+    expressed as factor * x + offset
+    """
+    pass
+
+
+def _linear(x):
+    """
+    Returns the exact (factor, offset) pair for a Conversion or a constant
+    """
+    if isinstance(x, Conversion):
+        return x.linear()
+    return (Fraction(0), Fraction(x))
+
 
 class Conversion(object):
     """
@@ -40,6 +61,13 @@ class Conversion(object):
     def __call__(self, original):
         raise NotImplemented()
 
+    def linear(self):
+        """
+        Returns the exact rational (factor, offset) of this conversion
+        such that the result is factor * x + offset, or raises NonLinear.
+        """
+        raise NonLinear(str(self))
+
     def join(self, sym):
         sb = sym.join([str(x) for x in self.conversions])
         return "(%s)" % sb
@@ -57,6 +85,14 @@ class Add(Conversion):
             rv += c(original)
         return rv
 
+    def linear(self):
+        factor, offset = Fraction(0), Fraction(0)
+        for c in self.conversions:
+            f, o = _linear(c)
+            factor += f
+            offset += o
+        return factor, offset
+
     def __str__(self):
         return self.join(" + ")
 
@@ -68,6 +104,7 @@ class Int(Conversion):
     """
 
     def __init__(self, i):
+        self.raw = i
         if isinstance(i, int):
             self.i = i
         else:
@@ -76,6 +113,9 @@ class Int(Conversion):
     def __call__(self, original):
         return self.i
 
+    def linear(self):
+        return Fraction(0), Fraction(self.raw)
+
     def __str__(self):
         return str(self.i)
 
@@ -92,6 +132,15 @@ class Mul(Conversion):
             rv *= c(original)
         return rv
 
+    def linear(self):
+        factor, offset = Fraction(0), Fraction(1)
+        for c in self.conversions:
+            f, o = _linear(c)
+            if factor and f:
+                raise NonLinear(str(self))
+            factor, offset = factor * o + offset * f, offset * o
+        return factor, offset
+
     def __str__(self):
         return self.join(" * ")
 
@@ -109,6 +158,13 @@ class Pow(Conversion):
     def __call__(self, original):
         return self.base ** self.exp
 
+    def linear(self):
+        bf, base = _linear(self.base)
+        ef, exp = _linear(self.exp)
+        if bf or ef or exp.denominator != 1:
+            raise NonLinear(str(self))
+        return Fraction(0), base ** exp.numerator
+
     def __str__(self):
         return "(%s ** %s)" % (self.base, self.exp)
 
@@ -134,6 +190,13 @@ class Rat(Conversion):
         d = self.unwrap(self.d, original)
         return float(n) / d
 
+    def linear(self):
+        nf, n = _linear(self.n)
+        df, d = _linear(self.d)
+        if df or not d:
+            raise NonLinear(str(self))
+        return nf / d, n / d
+
     def __str__(self):
         return "(%s / %s)" % (self.n, self.d)
 
@@ -153,3 +216,128 @@ class Sym(Conversion):
 
     def __str__(self):
         return "x"
+
+    def linear(self):
+        return Fraction(1), Fraction(0)
+
+
+class Compiled(object):
+    """
+    A Conversion reduced to a single multiplication and addition. The
+    exact rational factor and offset are kept for values which cannot be
+    represented as floats.
+    """
+
+    def __init__(self, factor, offset):
+        self.exact_factor = factor
+        self.exact_offset = offset
+        try:
+            self.factor = float(factor)
+            self.offset = float(offset)
+        except OverflowError:
+            self.factor = self.offset = None
+
+    def __call__(self, original):
+        if self.factor is None:
+            return float(Fraction(original) * self.exact_factor +
+                         self.exact_offset)
+        return float(original) * self.factor + self.offset
+
+    def array(self, values):
+        """
+        Converts a sequence or numpy array of values in one operation
+        and returns a new float64 array
+        """
+        import numpy
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if self.factor is None:
+            return numpy.array([self(v) for v in values.flat],
+                               dtype=numpy.float64).reshape(values.shape)
+        rv = values * self.factor
+        if self.offset:
+            rv += self.offset
+        return rv
+
+
+class Evaluated(object):
+    """
+    Fallback for conversions which are not linear, evaluating the
+    expression tree for each value
+    """
+
+    def __init__(self, conversion):
+        self.conversion = conversion
+
+    def __call__(self, original):
+        return self.conversion(original)
+
+    def array(self, values):
+        import numpy
+        values = numpy.asarray(values, dtype=numpy.float64)
+        return numpy.array([self(v) for v in values.flat],
+                           dtype=numpy.float64).reshape(values.shape)
+
+
+def compile_conversion(conversion):
+    """
+    Returns a Compiled instance for linear conversions, otherwise an
+    Evaluated instance wrapping the expression tree
+    """
+    try:
+        return Compiled(*conversion.linear())
+    except NonLinear:
+        return Evaluated(conversion)
+
+
+class ConversionTable(object):
+    """
+    Lazily built map from source unit to target unit to Conversion. The
+    builder is only called on first access so that importing the unit
+    classes does not construct every expression tree. compiled() caches
+    the result of compile_conversion() for each pair of units.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._table = None
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._builder()
+        return self._table
+
+    def get(self, source, default=None):
+        return self._load().get(source, default)
+
+    def __getitem__(self, source):
+        return self._load()[source]
+
+    def __contains__(self, source):
+        return source in self._load()
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def keys(self):
+        return self._load().keys()
+
+    def items(self):
+        return self._load().items()
+
+    def compiled(self, source, target):
+        """
+        Returns the compiled conversion from source to target or None
+        """
+        key = (source, target)
+        try:
+            return self._compiled[key]
+        except KeyError:
+            c = self._load().get(source, {}).get(target)
+            if c is not None:
+                c = compile_conversion(c)
+            self._compiled[key] = c
+            return c
@@ -39,6 +39,8 @@ import omero.scripts as scripts
 import Ice
 import Glacier2
 
+import sys
+import threading
 import traceback
 import time
 import array
@@ -3717,85 +3719,22 @@ class _BlitzGateway (object):
                                 source image (if specified). E.g. [0,2]
         :return: The new OMERO image: omero.model.ImageI
         """
-        queryService = self.getQueryService()
         pixelsService = self.getPixelsService()
         # Make sure we don't get an existing rpStore
         rawPixelsStore = self.c.sf.createRawPixelsStore()
-        containerService = self.getContainerService()
         updateService = self.getUpdateService()
-
-        import numpy
+        from omero.util.tiles import big_endian
 
         def createImage(firstPlane, channelList):
             """ Create our new Image once we have the first plane in hand """
-            convertToType = None
             sizeY, sizeX = firstPlane.shape
-            if sourceImageId is not None:
-                if channelList is None:
-                    channelList = range(sizeC)
-                iId = pixelsService.copyAndResizeImage(
-                    sourceImageId, rint(sizeX), rint(sizeY), rint(sizeZ),
-                    rint(sizeT), channelList, None, False, self.SERVICE_OPTS)
-                # need to ensure that the plane dtype matches the pixels type
-                # of our new image
-                img = self.getObject("Image", iId.getValue())
-                newPtype = img.getPrimaryPixels().getPixelsType().getValue()
-                omeroToNumpy = {PixelsTypeint8: 'int8',
-                                PixelsTypeuint8: 'uint8',
-                                PixelsTypeint16: 'int16',
-                                PixelsTypeuint16: 'uint16',
-                                PixelsTypeint32: 'int32',
-                                PixelsTypeuint32: 'uint32',
-                                PixelsTypefloat: 'float32',
-                                PixelsTypedouble: 'double'}
-                if omeroToNumpy[newPtype] != firstPlane.dtype.name:
-                    convertToType = getattr(numpy, omeroToNumpy[newPtype])
-                img._obj.setName(rstring(imageName))
-                img._obj.setSeries(rint(0))
-                updateService.saveObject(img._obj, self.SERVICE_OPTS)
-            else:
-                # need to map numpy pixel types to omero - don't handle: bool_,
-                # character, int_, int64, object_
-                pTypes = {'int8': PixelsTypeint8,
-                          'int16': PixelsTypeint16,
-                          'uint16': PixelsTypeuint16,
-                          'int32': PixelsTypeint32,
-                          'float_': PixelsTypefloat,
-                          'float8': PixelsTypefloat,
-                          'float16': PixelsTypefloat,
-                          'float32': PixelsTypefloat,
-                          'float64': PixelsTypedouble,
-                          'complex_': PixelsTypecomplex,
-                          'complex64': PixelsTypecomplex}
-                dType = firstPlane.dtype.name
-                if dType not in pTypes:  # try to look up any not named above
-                    pType = dType
-                else:
-                    pType = pTypes[dType]
-                # omero::model::PixelsType
-                pixelsType = queryService.findByQuery(
-                    "from PixelsType as p where p.value='%s'" % pType, None)
-                if pixelsType is None:
-                    raise Exception(
-                        "Cannot create an image in omero from numpy array "
-                        "with dtype: %s" % dType)
-                channelList = range(sizeC)
-                iId = pixelsService.createImage(
-                    sizeX, sizeY, sizeZ, sizeT, channelList, pixelsType,
-                    imageName, description, self.SERVICE_OPTS)
-
-            imageId = iId.getValue()
-            return (containerService.getImages(
-                "Image", [imageId], None, self.SERVICE_OPTS)[0], convertToType)
+            return self._createImageForArray(
+                sizeX, sizeY, sizeZ, sizeC, sizeT, firstPlane.dtype,
+                imageName, description, sourceImageId, channelList)
 
         def uploadPlane(plane, z, c, t, convertToType):
             # if we're given a numpy dtype, need to convert plane to that dtype
-            if convertToType is not None:
-                p = numpy.zeros(plane.shape, dtype=convertToType)
-                p += plane
-                plane = p
-            byteSwappedPlane = plane.byteswap()
-            convertedPlane = byteSwappedPlane.tostring()
+            convertedPlane = big_endian(plane, convertToType)
             rawPixelsStore.setPlane(convertedPlane, z, c, t, self.SERVICE_OPTS)
 
         image = None
@@ -3861,6 +3800,157 @@ class _BlitzGateway (object):
 
         return ImageWrapper(self, image)
 
+    def _createImageForArray(self, sizeX, sizeY, sizeZ, sizeC, sizeT, dtype,
+                             imageName, description=None,
+                             sourceImageId=None, channelList=None):
+        """
+        Creates the Image which createImageFromNumpySeq and
+        createImageFromNumpyArray fill with pixel data. Returns the
+        image and the numpy type which the data must be converted to
+        (None if the data type can be used as is).
+        """
+        import numpy
+        queryService = self.getQueryService()
+        pixelsService = self.getPixelsService()
+        containerService = self.getContainerService()
+        updateService = self.getUpdateService()
+        dtype = numpy.dtype(dtype)
+        convertToType = None
+        if sourceImageId is not None:
+            if channelList is None:
+                channelList = range(sizeC)
+            iId = pixelsService.copyAndResizeImage(
+                sourceImageId, rint(sizeX), rint(sizeY), rint(sizeZ),
+                rint(sizeT), channelList, None, False, self.SERVICE_OPTS)
+            # need to ensure that the plane dtype matches the pixels type
+            # of our new image
+            img = self.getObject("Image", iId.getValue())
+            newPtype = img.getPrimaryPixels().getPixelsType().getValue()
+            omeroToNumpy = {PixelsTypeint8: 'int8',
+                            PixelsTypeuint8: 'uint8',
+                            PixelsTypeint16: 'int16',
+                            PixelsTypeuint16: 'uint16',
+                            PixelsTypeint32: 'int32',
+                            PixelsTypeuint32: 'uint32',
+                            PixelsTypefloat: 'float32',
+                            PixelsTypedouble: 'double'}
+            if omeroToNumpy[newPtype] != dtype.name:
+                convertToType = getattr(numpy, omeroToNumpy[newPtype])
+            img._obj.setName(rstring(imageName))
+            img._obj.setSeries(rint(0))
+            updateService.saveObject(img._obj, self.SERVICE_OPTS)
+        else:
+            # need to map numpy pixel types to omero - don't handle: bool_,
+            # character, int_, int64, object_
+            pTypes = {'int8': PixelsTypeint8,
+                      'int16': PixelsTypeint16,
+                      'uint16': PixelsTypeuint16,
+                      'int32': PixelsTypeint32,
+                      'float_': PixelsTypefloat,
+                      'float8': PixelsTypefloat,
+                      'float16': PixelsTypefloat,
+                      'float32': PixelsTypefloat,
+                      'float64': PixelsTypedouble,
+                      'complex_': PixelsTypecomplex,
+                      'complex64': PixelsTypecomplex}
+            dType = dtype.name
+            if dType not in pTypes:  # try to look up any not named above
+                pType = dType
+            else:
+                pType = pTypes[dType]
+            # omero::model::PixelsType
+            pixelsType = queryService.findByQuery(
+                "from PixelsType as p where p.value='%s'" % pType, None)
+            if pixelsType is None:
+                raise Exception(
+                    "Cannot create an image in omero from numpy array "
+                    "with dtype: %s" % dType)
+            channelList = range(sizeC)
+            iId = pixelsService.createImage(
+                sizeX, sizeY, sizeZ, sizeT, channelList, pixelsType,
+                imageName, description, self.SERVICE_OPTS)
+
+        imageId = iId.getValue()
+        return (containerService.getImages(
+            "Image", [imageId], None, self.SERVICE_OPTS)[0], convertToType)
+
+    def createImageFromNumpyArray(self, data, imageName, description=None,
+                                  dataset=None, sourceImageId=None,
+                                  channelList=None, tileSize=None,
+                                  queueSize=4):
+        """
+        Creates a new multi-dimensional image from a 5D array ordered
+        (Z, C, T, Y, X). data may be a numpy array, a numpy.memmap or any
+        object with a shape and dtype which can be sliced as
+        ``data[z, c, t, y0:y1, x0:x1]``, so that the whole image never
+        needs to be in memory.
+
+        Pixels are written tile by tile (in the tile size preferred by
+        the server unless tileSize is given) while the next tiles are
+        being read and converted, so this also works for images larger
+        than the server's maximum plane size.
+        See :class:`omero.util.tiles.PixelsWriter`
+
+        :param data:            Array-like of shape (Z, C, T, Y, X)
+        :param imageName:       Name of new image
+        :param description:     Description for the new image
+        :param dataset:         If specified, put the image in this dataset.
+                                omero.model.Dataset object
+        :param sourceImageId:   If specified, copy this image with metadata,
+                                then add pixel data
+        :param channelList:     Copies metadata from these channels in
+                                source image (if specified). E.g. [0,2]
+        :param tileSize:        (width, height) of the tiles to write
+        :param queueSize:       Maximum number of tiles converted ahead of
+                                the upload
+        :return: The new OMERO image: omero.gateway.ImageWrapper
+        """
+        from omero.util.tiles import PixelsWriter
+        sizeZ, sizeC, sizeT, sizeY, sizeX = data.shape
+        image, convertToType = self._createImageForArray(
+            sizeX, sizeY, sizeZ, sizeC, sizeT, data.dtype, imageName,
+            description, sourceImageId, channelList)
+        pixelsId = image.getPrimaryPixels().getId().getValue()
+
+        tileWidth = tileHeight = None
+        if tileSize is not None:
+            tileWidth, tileHeight = tileSize
+        rawPixelsStore = self.c.sf.createRawPixelsStore()
+        exc = None
+        try:
+            rawPixelsStore.setPixelsId(pixelsId, True, self.SERVICE_OPTS)
+            writer = PixelsWriter(
+                rawPixelsStore, sizeX, sizeY, sizeZ, sizeC, sizeT,
+                convertToType or data.dtype, tileWidth, tileHeight,
+                queueSize, self.SERVICE_OPTS)
+            writer.write(data)
+        except Exception, e:
+            logger.error(
+                "Failed to setTile() on rawPixelsStore while creating Image",
+                exc_info=True)
+            exc = e
+        try:
+            rawPixelsStore.close(self.SERVICE_OPTS)
+        except Exception, e:
+            logger.error("Failed to close rawPixelsStore", exc_info=True)
+            if exc is None:
+                exc = e
+        if exc is not None:
+            raise exc
+
+        pixelsService = self.getPixelsService()
+        for theC, mm in enumerate(writer.minmax()):
+            pixelsService.setChannelGlobalMinMax(
+                pixelsId, theC, float(mm[0]), float(mm[1]), self.SERVICE_OPTS)
+
+        if dataset:
+            link = omero.model.DatasetImageLinkI()
+            link.parent = omero.model.DatasetI(dataset.getId(), False)
+            link.child = omero.model.ImageI(image.id.val, False)
+            self.getUpdateService().saveObject(link, self.SERVICE_OPTS)
+
+        return ImageWrapper(self, image)
+
     def applySettingsToSet(self, fromid, to_type, toids):
         """
         Applies the rendering settings from one image to others.
@@ -4742,6 +4832,26 @@ def splitHTMLColor(color):
     return None
 
 
+def unpackRGB(packed, width, height):
+    """
+    Converts the packed ARGB integers returned by
+    RenderingEngine.renderAsPackedInt into a numpy array.
+
+    :param packed:  Sequence of width * height packed ints
+    :param width:   Width of the rendered region
+    :param height:  Height of the rendered region
+    :return:        RGB image
+    :rtype:         numpy.ndarray of uint8 with shape (height, width, 3)
+    """
+    import numpy
+    packed = numpy.asarray(packed, dtype=numpy.int64).reshape(height, width)
+    rgb = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    rgb[..., 0] = (packed >> 16) & 0xFF
+    rgb[..., 1] = (packed >> 8) & 0xFF
+    rgb[..., 2] = packed & 0xFF
+    return rgb
+
+
 class ProxyObjectWrapper (object):
     """
     Wrapper for services. E.g. Admin Service, Delete Service etc.
@@ -9457,6 +9567,164 @@ class _ImageWrapper (BlitzObjectWrapper, OmeroRestrictionWrapper):
             rv = Image.open(i)
         return rv
 
+    def _getRenderSettings(self):
+        """
+        Returns the rendering model and the channel settings of the current
+        rendering engine, to be copied to other engines with
+        :meth:`_setRenderSettings`.
+
+        :return:    (model, list of channel settings)
+        """
+        ctx = self._conn.SERVICE_OPTS
+        channels = []
+        for c in range(self.getSizeC()):
+            inverted = False
+            for m in self._re.getCodomainMapContext(c, ctx):
+                if isinstance(m, omero.model.ReverseIntensityContext):
+                    inverted = True
+            channels.append({
+                'active': self._re.isActive(c, ctx),
+                'start': self._re.getChannelWindowStart(c, ctx),
+                'end': self._re.getChannelWindowEnd(c, ctx),
+                'rgba': list(self._re.getRGBA(c, ctx)),
+                'lut': self._re.getChannelLookupTable(c, ctx),
+                'inverted': inverted})
+        return self._re.getModel(ctx), channels
+
+    def _setRenderSettings(self, re, settings):
+        """
+        Applies settings from :meth:`_getRenderSettings` to another
+        rendering engine on the same pixels.
+        """
+        ctx = self._conn.SERVICE_OPTS
+        model, channels = settings
+        re.setModel(model, ctx)
+        for c, ch in enumerate(channels):
+            re.setActive(c, ch['active'], ctx)
+            re.setChannelWindow(c, ch['start'], ch['end'], ctx)
+            re.setRGBA(c, *(ch['rgba'] + [ctx]))
+            re.setChannelLookupTable(c, ch['lut'], ctx)
+            r = omero.romio.ReverseIntensityMapContext()
+            re.removeCodomainMapFromChannel(r, c, ctx)
+            if ch['inverted']:
+                re.addCodomainMapToChannel(r, c, ctx)
+
+    @assert_re()
+    def renderBatch(self, requests, workers=1):
+        """
+        Renders a batch of planes or regions as RGB numpy arrays, avoiding
+        the JPEG encoding and decoding of :meth:`renderImage`.
+
+        Each request is a tuple (z, t, channels, region): channels is a list
+        of active channel indexes ** 1-based index ** (None to use the
+        currently active channels) and region is (x, y, width, height)
+        (None for the whole plane). Windows, colors, rendering model etc.
+        are those of the current rendering engine.
+
+        With more than one worker, extra rendering engines are created with
+        the current settings and the requests are split between them and
+        rendered concurrently. Requests are grouped by channels so that each
+        engine switches channels as rarely as possible. The active channels
+        of the current rendering engine are restored afterwards.
+        NB. Projection and resolution levels are not supported: the
+        projection set with :meth:`setProjection` is ignored.
+
+        :param requests:    List of (z, t, channels, region) tuples
+        :param workers:     Number of rendering engines to use (int)
+        :return:            RGB images, in the order of requests
+        :rtype:             List of numpy.ndarray with shape (h, w, 3)
+        """
+
+        ctx = self._conn.SERVICE_OPTS
+        sizeX = self.getSizeX()
+        sizeY = self.getSizeY()
+        sizeC = self.getSizeC()
+        settings = self._getRenderSettings()
+        rdid = self._re.getRenderingDefId(ctx)
+        current = frozenset(
+            c + 1 for c, ch in enumerate(settings[1]) if ch['active'])
+
+        jobs = []
+        for z, t, channels, region in requests:
+            if channels is None:
+                channels = current
+            else:
+                channels = frozenset(int(c) for c in channels if c > 0)
+            pd = omero.romio.PlaneDef(self.PLANEDEF)
+            pd.z = long(z)
+            pd.t = long(t)
+            if region is None:
+                width, height = sizeX, sizeY
+            else:
+                x, y, width, height = [int(v) for v in region]
+                # Regions are truncated at the edge of the plane
+                width = min(width, sizeX - x)
+                height = min(height, sizeY - y)
+                regionDef = omero.romio.RegionDef()
+                regionDef.x = x
+                regionDef.y = y
+                regionDef.width = width
+                regionDef.height = height
+                pd.region = regionDef
+            jobs.append((channels, pd, width, height))
+        if not jobs:
+            return []
+
+        order = sorted(range(len(jobs)),
+                       key=lambda i: (sorted(jobs[i][0]), i))
+        workers = max(1, min(int(workers), len(order)))
+        step = -(-len(order) // workers)
+        rv = [None] * len(jobs)
+        errors = []
+        restore = []
+
+        def render(re, indexes):
+            close = re is None
+            active = current
+            try:
+                if close:
+                    re = self._prepareRE(rdid=rdid)
+                    self._setRenderSettings(re, settings)
+                for i in indexes:
+                    if errors:
+                        break
+                    channels, pd, width, height = jobs[i]
+                    for c in range(sizeC):
+                        if ((c + 1) in channels) != ((c + 1) in active):
+                            re.setActive(c, (c + 1) in channels, ctx)
+                    active = channels
+                    packed = re.renderAsPackedInt(pd, ctx)
+                    rv[i] = unpackRGB(packed, width, height)
+            except Exception:
+                logger.debug('On renderBatch', exc_info=True)
+                errors.append(sys.exc_info())
+            finally:
+                if close:
+                    if re is not None:
+                        re.close()
+                else:
+                    restore.append(active)
+
+        threads = []
+        for w in range(1, workers):
+            thread = threading.Thread(
+                target=render, args=(None, order[w * step:(w + 1) * step]),
+                name="renderBatch-%s" % w)
+            thread.start()
+            threads.append(thread)
+        try:
+            render(self._re, order[:step])
+        finally:
+            for thread in threads:
+                thread.join()
+            for active in restore:
+                for c in range(sizeC):
+                    if ((c + 1) in active) != ((c + 1) in current):
+                        self._re.setActive(c, (c + 1) in current, ctx)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return rv
+
     def renderSplitChannel(self, z, t, compression=0.9, border=2):
         """
         Prepares a jpeg representation of a 2d grid holding a render of each
@@ -9517,6 +9785,29 @@ class _ImageWrapper (BlitzObjectWrapper, OmeroRestrictionWrapper):
     def _renderSplit_channelLabel(self, channel):
         return str(channel.getLabel())
 
+    def _renderSplit_panels(self, z, t, cmap, compression):
+        """
+        Renders each active channel on its own. Uses :meth:`renderBatch`
+        when numpy is available and no projection is set, saving a JPEG
+        round trip per panel.
+
+        :return:    Dict of channel index to PIL Image
+        """
+        indexes = [i for i, active in enumerate(cmap) if active]
+        try:
+            import numpy  # noqa
+            batch = self.getProjection() == 'normal'
+        except ImportError:  # pragma: no cover
+            batch = False
+        if not batch:
+            rv = {}
+            for i in indexes:
+                self.setActiveChannels((i+1,))
+                rv[i] = self.renderImage(z, t, compression)
+            return rv
+        arrays = self.renderBatch([(z, t, (i+1,), None) for i in indexes])
+        return dict((i, Image.fromarray(a)) for i, a in zip(indexes, arrays))
+
     def renderSplitChannelImage(self, z, t, compression=0.9, border=2):
         """
         Prepares a PIL Image with a 2d grid holding a render of each channel,
@@ -9564,10 +9855,10 @@ class _ImageWrapper (BlitzObjectWrapper, OmeroRestrictionWrapper):
         if fsize > 0:
             font = ImageFont.load('%s/pilfonts/B%0.2d.pil' % (THISPATH, fsize))
 
+        panels = self._renderSplit_panels(z, t, cmap, compression)
         for i in range(c):
             if cmap[i]:
-                self.setActiveChannels((i+1,))
-                img = self.renderImage(z, t, compression)
+                img = panels[i]
                 if fsize > 0:
                     draw = ImageDraw.ImageDraw(img)
                     draw.text(
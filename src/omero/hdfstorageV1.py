@@ -304,12 +304,15 @@ class HdfStorage(object):
 
     @locked
     @modifies
-    def initialize(self, cols, metadata=None):
+    def initialize(self, cols, metadata=None, options=None):
         """
-
+        options are ignored since compression and chunking are only
+        supported by the V2 storage.
         """
         if metadata is None:
             metadata = {}
+        if options:
+            self.logger.warn("Ignoring storage options: %s", options)
 
         if self.__initialized:
             raise omero.ValidationException(None, None, "Already initialized.")
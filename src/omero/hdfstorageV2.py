@@ -6,12 +6,14 @@
 # Use is subject to license terms supplied in LICENSE.txt
 #
 
+import os
 import time
 import numpy
 import logging
 import threading
 import traceback
 
+from collections import OrderedDict
 from os import W_OK
 from path import path
 
@@ -21,6 +23,8 @@ import omero.callbacks
 
 # For ease of use
 from omero.columns import columns2definition
+from omero.columns import StringColumnI
+from omero.columns import decode_strings, string_encoding, string_lookup
 from omero.rtypes import rfloat, rint, rlong, rstring, unwrap
 from omero.util.decorators import locked
 from omero_ext import portalocker
@@ -40,6 +44,222 @@ def internal_attr(s):
     return s.startswith('__')
 
 
+# Keys of the storage options accepted by HdfStorage.initialize(). The
+# Tables server reads them from the "omero.tables." prefixed properties.
+STORAGE_OPTIONS = ("compression", "compression_level", "shuffle",
+                   "expected_rows", "chunk_rows", "vlen_columns",
+                   "dictionary_columns")
+
+
+def encoded_columns(options):
+    """
+    Returns a dict of the names of the string columns which should be
+    encoded to their StringColumnI encoding from the comma-separated
+    "vlen_columns" and "dictionary_columns" storage options
+    """
+    rv = {}
+    for key, encoding in (("vlen_columns", StringColumnI.VLEN),
+                          ("dictionary_columns", StringColumnI.DICTIONARY)):
+        value = (options or {}).get(key) or ""
+        for name in set(x.strip() for x in value.split(",") if x.strip()):
+            if name in rv:
+                raise omero.ApiUsageException(
+                    None, None, "Conflicting encodings for column: %s" % name)
+            rv[name] = encoding
+    return rv
+
+
+def get_filters(options):
+    """
+    Returns the tables.Filters for the "compression", "compression_level"
+    and "shuffle" storage options, or None if no compression is requested.
+    compression is one of the PyTables compression libraries, e.g. "zlib",
+    "blosc" or "blosc:lz4".
+    """
+    complib = (options or {}).get("compression") or "none"
+    if complib == "none":
+        return None
+    if complib not in tables.filters.all_complibs:
+        raise omero.ApiUsageException(
+            None, None, "Unknown compression library: %s" % complib)
+    try:
+        level = int(options.get("compression_level", 5))
+    except ValueError:
+        raise omero.ApiUsageException(
+            None, None, "Bad compression level: %s"
+            % options.get("compression_level"))
+    shuffle = str(options.get("shuffle", "true")).lower() in (
+        "true", "yes", "1")
+    return tables.Filters(complevel=level, complib=complib, shuffle=shuffle)
+
+
+def table_kwargs(options):
+    """
+    Converts storage options into the keyword arguments for
+    tables.File.create_table
+    """
+    kwargs = {}
+    if not options:
+        return kwargs
+    filters = get_filters(options)
+    if filters is not None:
+        kwargs["filters"] = filters
+    try:
+        if options.get("expected_rows"):
+            kwargs["expectedrows"] = int(options["expected_rows"])
+        if options.get("chunk_rows"):
+            kwargs["chunkshape"] = (int(options["chunk_rows"]),)
+    except ValueError:
+        raise omero.ApiUsageException(
+            None, None, "Bad storage options: %s" % options)
+    return kwargs
+
+
+def repack(file_path, options):
+    """
+    Rewrites an existing OMERO.tables file using the filters and chunk
+    size from the given storage options. The file is copied to a temporary
+    file next to it which then replaces the original. Returns the new size,
+    or None if the Measurements table already uses the requested filters
+    and chunk size.
+
+    The caller must ensure that the file is not in use by the Tables server.
+    """
+    filters = get_filters(options) or tables.Filters()
+    chunkshape = None
+    if options.get("chunk_rows"):
+        chunkshape = (int(options["chunk_rows"]),)
+    file_path = path(file_path)
+    tmp = file_path.parent / (".%s.repack" % file_path.name)
+    try:
+        src = tables.open_file(str(file_path), mode="r")
+        try:
+            measurements = src.root.OME.Measurements
+            if measurements.filters == filters and \
+                    chunkshape in (None, measurements.chunkshape):
+                return None
+            kwargs = {"filters": filters, "overwrite": True}
+            if chunkshape is not None:
+                kwargs["chunkshape"] = chunkshape
+            src.copy_file(str(tmp), **kwargs)
+        finally:
+            src.close()
+        os.rename(tmp, file_path)
+    finally:
+        # Only left behind if the copy failed
+        if tmp.exists():
+            tmp.remove()
+    return file_path.size
+
+
+# Formats supported by HdfStorage.export() and their mimetypes
+EXPORT_FORMATS = {
+    "npy": "application/zip",
+    "arrow": "application/vnd.apache.arrow.file",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_columns(target, fmt, columns):
+    """
+    Writes the named numpy arrays in columns (a list of (name, array)
+    pairs) to the file target. "npy" produces an uncompressed zip of one
+    .npy file per column which can be memory-mapped once extracted,
+    "arrow" an Arrow IPC file and "parquet" a Parquet file. The latter
+    two require pyarrow.
+
+    A list of uint8 arrays instead of an array is a column of variable
+    length binary values. For "npy" these are concatenated into
+    "name.npy" with the start of each value, followed by the total
+    length, in "name_offsets.npy".
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise omero.ApiUsageException(
+            None, None, "Unknown export format: %s" % fmt)
+
+    if fmt == "npy":
+        import zipfile
+        import tempfile
+        import shutil
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED,
+                                 allowZip64=True) as zf:
+                for name, arr in columns:
+                    if isinstance(arr, list):
+                        offsets = numpy.cumsum(
+                            [0] + [len(x) for x in arr], dtype=numpy.int64)
+                        arrays = [(name + "_offsets", offsets),
+                                  (name, numpy.concatenate(
+                                      [numpy.zeros(0, numpy.uint8)] + arr))]
+                    else:
+                        arrays = [(name, arr)]
+                    for n, a in arrays:
+                        npy = os.path.join(tmpdir, "column.npy")
+                        numpy.save(npy, a)
+                        zf.write(npy, "%s.npy" % n)
+                        os.remove(npy)
+        finally:
+            shutil.rmtree(tmpdir)
+        return
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise omero.ApiUsageException(
+            None, None, "pyarrow is required for %s export" % fmt)
+
+    arrays = []
+    for name, arr in columns:
+        if isinstance(arr, list):
+            arrays.append(pyarrow.array(
+                [x.tostring() for x in arr], pyarrow.binary()))
+        elif arr.ndim == 2:
+            values = pyarrow.array(arr.ravel())
+            arrays.append(pyarrow.FixedSizeListArray.from_arrays(
+                values, arr.shape[1]))
+        elif arr.dtype.kind == "S":
+            arrays.append(pyarrow.array(arr).cast(pyarrow.string()))
+        else:
+            arrays.append(pyarrow.array(arr))
+    table = pyarrow.Table.from_arrays(arrays, [n for n, a in columns])
+
+    if fmt == "parquet":
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, target)
+    else:
+        sink = pyarrow.OSFile(target, "wb")
+        try:
+            writer = pyarrow.RecordBatchFileWriter(sink, table.schema)
+            writer.write_table(table)
+            writer.close()
+        finally:
+            sink.close()
+
+
+def replace_strings(source, names):
+    """
+    Replaces the string literals in the Python expression source which
+    start at the (row, column) positions in names with the mapped names.
+    Implicitly concatenated literals are replaced as a whole.
+    """
+    import tokenize
+    from StringIO import StringIO
+    tokens = []
+    replacing = False
+    for tok in tokenize.generate_tokens(StringIO(source).readline):
+        tok = list(tok)
+        if tok[0] == tokenize.STRING and tuple(tok[2]) in names:
+            tok[0:2] = tokenize.NAME, names[tuple(tok[2])]
+            replacing = True
+        elif tok[0] == tokenize.STRING and replacing:
+            tok[1] = ""
+        elif tok[0] not in (tokenize.NL, tokenize.COMMENT):
+            replacing = False
+        tokens.append(tuple(tok))
+    return tokenize.untokenize(tokens)
+
+
 def stamped(func, update=False):
     """
     Decorator which takes the first argument after "self" and compares
@@ -95,11 +315,34 @@ class HdfList(object):
     https://trac.openmicroscopy.org/ome/ticket/10464
     """
 
+    # Defaults for the cache of idle storage instances, see configure()
+    CACHE_SIZE = 32
+    CACHE_IDLE = 300
+
     def __init__(self):
         self.logger = logging.getLogger("omero.tables.HdfList")
         self._lock = threading.RLock()
         self.__filenos = {}
         self.__paths = {}
+        self.__read_only = set()
+        self.__idle = OrderedDict()
+        self.cache_size = self.CACHE_SIZE
+        self.cache_idle = self.CACHE_IDLE
+        self.hits = 0
+        self.misses = 0
+
+    @locked
+    def configure(self, cache_size=None, cache_idle=None):
+        """
+        Sets the maximum number of idle storage instances which are kept
+        open and the number of seconds after which they are closed. A
+        cache_size of 0 disables the cache.
+        """
+        if cache_size is not None:
+            self.cache_size = int(cache_size)
+        if cache_idle is not None:
+            self.cache_idle = float(cache_idle)
+        self.evict()
 
     @locked
     def addOrThrow(self, hdfpath, hdfstorage, read_only=False):
@@ -137,21 +380,107 @@ class HdfList(object):
         else:
             self.__filenos[fileno] = hdfstorage
             self.__paths[hdfpath] = hdfstorage
+            if read_only:
+                self.__read_only.add(hdfpath)
 
         return hdffile
 
     @locked
     def getOrCreate(self, hdfpath, read_only=False):
         try:
-            return self.__paths[hdfpath]
+            storage = self.__paths[hdfpath]
         except KeyError:
+            storage = None
+
+        if storage is not None and hdfpath in self.__idle:
+            signature = self.__idle.pop(hdfpath)[1]
+            if not read_only:
+                self.logger.debug(
+                    "Reopening cached storage for writing: %s", hdfpath)
+            elif signature == file_signature(hdfpath):
+                self.hits += 1
+                self.logger.debug("Reusing cached storage: %s", hdfpath)
+                return storage
+            else:
+                self.logger.info(
+                    "Cached storage changed on disk: %s", hdfpath)
+            storage.cleanup()
+            storage = None
+
+        if storage is None:
+            self.misses += 1
             # Adds itself to the global list
-            return HdfStorage(hdfpath, self._lock, read_only=read_only)
+            storage = HdfStorage(hdfpath, self._lock, read_only=read_only)
+        return storage
+
+    @locked
+    def release(self, hdfpath, hdfstorage):
+        """
+        Called by HdfStorage once no tables are attached. Returns True if
+        the storage has been kept open in the idle cache, otherwise the
+        caller must clean it up. Only storages opened read-only are cached
+        since a writable file must not stay open without its exclusive
+        lock.
+        """
+        if self.cache_size <= 0 or hdfpath not in self.__read_only:
+            return False
+        signature = file_signature(hdfpath)
+        if signature is None:
+            return False
+        self.__idle[hdfpath] = (time.time(), signature)
+        self.evict()
+        return hdfpath in self.__idle
+
+    @locked
+    def evict(self, now=None):
+        """
+        Closes idle storage instances which have not been used for
+        cache_idle seconds and the least recently used instances beyond
+        cache_size.
+        """
+        if now is None:
+            now = time.time()
+        for hdfpath, (released, signature) in self.__idle.items():
+            if (len(self.__idle) > self.cache_size or
+                    now - released > self.cache_idle):
+                self.__idle.pop(hdfpath)
+                self.__paths[hdfpath].cleanup()
+
+    def check(self):
+        """
+        Periodically called by omero.util.Resources
+        """
+        self.evict()
+        self.logger.debug("Storage cache: %s idle, %s hits, %s misses",
+                          len(self.__idle), self.hits, self.misses)
+        return True
+
+    @locked
+    def cleanup(self):
+        """
+        Closes all idle storage instances
+        """
+        self.cache_size = 0
+        self.evict()
 
     @locked
     def remove(self, hdfpath, hdffile):
         del self.__filenos[hdffile.fileno()]
         del self.__paths[hdfpath]
+        self.__read_only.discard(hdfpath)
+        self.__idle.pop(hdfpath, None)
+
+
+def file_signature(hdfpath):
+    """
+    Returns the inode, modification time and size of the given path which
+    must match for a cached storage instance to be reused.
+    """
+    try:
+        st = os.stat(hdfpath)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
 
 # Global object for maintaining files
 HDFLIST = HdfList()
@@ -322,9 +651,11 @@ class HdfStorage(object):
 
     @locked
     @modifies
-    def initialize(self, cols, metadata=None):
+    def initialize(self, cols, metadata=None, options=None):
         """
-
+        Creates the Measurements table for the given columns. options may
+        contain any of the STORAGE_OPTIONS to control compression and
+        chunking of the table.
         """
         if metadata is None:
             metadata = {}
@@ -343,10 +674,18 @@ class HdfStorage(object):
                 raise omero.ApiUsageException(
                     None, None, "Reserved column name: %s" % c.name)
 
+        for name, encoding in encoded_columns(options).items():
+            matches = [c for c in cols if c.name == name]
+            if not matches or not isinstance(matches[0], StringColumnI):
+                raise omero.ApiUsageException(
+                    None, None, "Not a string column: %s" % name)
+            matches[0].encoding = encoding
+
+        kwargs = table_kwargs(options)
         self.__definition = columns2definition(cols)
         self.__ome = self.__hdf_file.create_group("/", "OME")
         self.__mea = self.__hdf_file.create_table(
-            self.__ome, "Measurements", self.__definition)
+            self.__ome, "Measurements", self.__definition, **kwargs)
 
         self.__types = [x.ice_staticId() for x in cols]
         self.__descriptions = [
@@ -386,7 +725,10 @@ class HdfStorage(object):
             raise omero.ApiUsageException(None, None, "Unknown table")
         self.__tables.remove(table)
         if sz <= 1:
-            self.cleanup()
+            # Read-only tables are kept open for the next reader
+            if (self._modified or not self.__initialized or
+                    not HDFLIST.release(self.__hdf_path, self)):
+                self.cleanup()
         return sz - 1
 
     @locked
@@ -495,6 +837,7 @@ class HdfStorage(object):
                 if sz != col.getsize():
                     raise omero.ValidationException(
                         "Columns are of differing length")
+            col.prepare(self.__mea)
             arrays.extend(col.arrays())
             dtypes.extend(col.dtypes())
             col.append(self.__mea)  # Potential corruption !!!
@@ -513,15 +856,24 @@ class HdfStorage(object):
     def update(self, stamp, data):
         self.__initcheck()
         if data:
+            values = {}
+            for col in data.columns:
+                if hasattr(col, "encode"):
+                    values[col.name] = col.encode(self.__mea)
+                else:
+                    values[col.name] = col.values
             for i, rn in enumerate(data.rowNumbers):
                 for col in data.columns:
-                    getattr(self.__mea.cols, col.name)[rn] = col.values[i]
+                    getattr(self.__mea.cols, col.name)[rn] = \
+                        values[col.name][i]
 
     @stamped
     def getWhereList(self, stamp, condition, variables, unused,
                      start, stop, step):
         self.__initcheck()
         try:
+            condition, variables = self._dictionary_condition(
+                condition, variables)
             return self.__mea.get_where_list(condition, variables, None,
                                              start, stop, step).tolist()
         except (NameError, SyntaxError, TypeError, ValueError), err:
@@ -531,6 +883,57 @@ class HdfStorage(object):
             aue.serverExceptionClass = str(err.__class__.__name__)
             raise aue
 
+    def _dictionary_condition(self, condition, variables):
+        """
+        Rewrites == and != comparisons between a dictionary encoded column
+        and a string, either a variable as in "(gene == g)" or a literal as
+        in "(gene != 'abc')", to use the integer code of the string so that
+        the query runs on the codes. Strings which are not in the dictionary
+        are mapped to -1. Other comparisons of encoded columns are rejected
+        since the order of the codes is not that of the strings. Returns
+        the new condition and variables.
+        """
+        encoded = [n for n in self.__mea.colnames
+                   if self.__mea.coldtypes[n] == numpy.int32 and
+                   string_encoding(self.__mea, n) is not None]
+        if not encoded:
+            return condition, variables
+
+        import ast
+        condition = condition.strip()
+        variables = dict(variables or {})
+        lookups = {}
+        literals = {}  # Position of a literal to its new variable
+        for node in ast.walk(ast.parse(condition, mode="eval")):
+            if not isinstance(node, ast.Compare):
+                continue
+            operands = [node.left] + node.comparators
+            for op, a, b in zip(node.ops, operands, operands[1:]):
+                for col, other in ((a, b), (b, a)):
+                    if not (isinstance(col, ast.Name) and col.id in encoded):
+                        continue
+                    if not isinstance(op, (ast.Eq, ast.NotEq)):
+                        raise omero.ApiUsageException(
+                            None, None, "Only == and != are supported for "
+                            "dictionary encoded column %s: %s"
+                            % (col.id, condition))
+                    if col.id not in lookups:
+                        lookups[col.id] = string_lookup(self.__mea, col.id)
+                    lookup = lookups[col.id]
+                    if isinstance(other, ast.Str):
+                        name = "omero_literal%s" % len(literals)
+                        while name in variables or name in encoded:
+                            name += "_"
+                        literals[(other.lineno, other.col_offset)] = name
+                        variables[name] = lookup.get(other.s, -1)
+                    elif (isinstance(other, ast.Name) and
+                            isinstance(variables.get(other.id), basestring)):
+                        variables[other.id] = lookup.get(
+                            variables[other.id], -1)
+        if literals:
+            condition = replace_strings(condition, literals)
+        return condition, variables
+
     def _as_data(self, cols, rowNumbers):
         """
         Constructs a omero.grid.Data object for returning to the client.
@@ -593,6 +996,63 @@ class HdfStorage(object):
             rv.append(col)
         return self._as_data(rv, rowNumbers)
 
+    def export(self, stamp, target, fmt, colNumbers=None, start=None,
+               stop=None):
+        """
+        Writes the given columns of rows [start, stop) to the file target
+        in one of the EXPORT_FORMATS without converting the values to
+        Python objects. Nested columns, e.g. masks, are split into one
+        column per field named "column/field" and the bytes of a mask are
+        exported as "column/bytes". The values are read under the lock but
+        written after it has been released. Returns the number of exported
+        rows.
+        """
+        columns = self._read_export(stamp, colNumbers, start, stop)
+        export_columns(target, fmt, columns)
+        return columns and len(columns[0][1]) or 0
+
+    @stamped
+    def _read_export(self, stamp, colNumbers, start, stop):
+        self.__initcheck()
+        if colNumbers is None or len(colNumbers) == 0:
+            colNumbers = range(self.__width())
+        self.__sizecheck(colNumbers, None)
+
+        names = self.__mea.colnames
+        mask_type = omero.grid.MaskColumn.ice_staticId()
+        columns = []
+        for i in colNumbers:
+            arr = self.__mea.read(start, stop, field=names[i])
+            if arr.dtype.kind in "i":
+                decoded = decode_strings(self.__mea, names[i], arr)
+                if decoded is not None:
+                    arr = decoded.astype(str)
+            if arr.dtype.names:
+                for sub in arr.dtype.names:
+                    columns.append(("%s/%s" % (names[i], sub), arr[sub]))
+            else:
+                columns.append((names[i], arr))
+            if self.__types[i] == mask_type:
+                columns.append(
+                    ("%s/bytes" % names[i], self.__masks(start, stop)))
+        return columns
+
+    def __masks(self, start, stop):
+        """
+        Returns the mask bytes of rows [start, stop) as a list of uint8
+        arrays, see omero.columns.MaskColumnI._getmasks. All mask columns
+        share one array, so the bytes can only be exported if it holds
+        exactly one value per row.
+        """
+        try:
+            masks = getattr(self.__ome, "%s_masks" % self.__mea._v_name)
+        except tables.NoSuchNodeError:
+            masks = None
+        if masks is None or masks.nrows != self.__mea.nrows:
+            raise omero.ApiUsageException(
+                None, None, "Cannot export mask bytes: %s" % self.__hdf_path)
+        return masks[start:stop]
+
     #
     # Lifecycle methods
     #
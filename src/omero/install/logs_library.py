@@ -15,15 +15,25 @@
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.lines as lines
-import matplotlib.transforms as mtransforms
-import matplotlib.text as mtext
 
+try:
+    import matplotlib.pyplot as plt
+    import matplotlib.lines as lines
+    import matplotlib.transforms as mtransforms
+    import matplotlib.text as mtext
+    has_matplotlib = True
+except ImportError:
+    has_matplotlib = False
+
+from array import array
+from heapq import heappush, heappushpop, nlargest
+from multiprocessing import cpu_count
+from multiprocessing import Pool
 from time import mktime, strptime
 
 import fileinput
 import logging
+import os
 import sys
 import re
 
@@ -121,10 +131,14 @@ class log_watcher(object):
             fileinput.close()
 
 
+ALLTHREADS_ENTRIES = ["Meth:", "Executor.doWork"]
+ALLTHREADS_EXITS = ["Rslt:", "Excp:"]
+
+
 class allthreads_watcher(log_watcher):
     def __init__(self, files):
-        log_watcher.__init__(self, files, ["Meth:", "Executor.doWork"],
-                             ["Rslt:", "Excp:"])
+        log_watcher.__init__(self, files, ALLTHREADS_ENTRIES,
+                             ALLTHREADS_EXITS)
 
 
 class saveAndReturnObject_watcher(log_watcher):
@@ -134,46 +148,291 @@ class saveAndReturnObject_watcher(log_watcher):
                              storeall=["Adding log"])
 
 
-# http://matplotlib.sourceforge.net/examples/api/line_with_text.html
-class MyLine(lines.Line2D):
+#
+# Fast analysis engine
+#
+# log_watcher.gen() creates a log_line for every line of input and tests
+# each pattern via str.find which is too slow for large sets of logs. The
+# functions below instead split the files into byte ranges which are scanned
+# by a pool of worker processes using a single compiled regular expression.
+# Only the timings of completed calls are kept and then merged in order.
+#
+
+ENTRY = 1
+EXIT = 2
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def compile_patterns(entries, exits):
+    """
+    Combine the entry and exit strings into a single regular expression.
+    Returns the expression along with a map from group index to either
+    ENTRY or EXIT.
+    """
+    groups = []
+    kinds = {}
+    for kind, patterns in ((ENTRY, entries), (EXIT, exits)):
+        for pattern in patterns:
+            groups.append("(%s)" % re.escape(pattern))
+            kinds[len(groups)] = kind
+    return re.compile("|".join(groups)), kinds
+
+
+class time_parser(object):
+    """
+    Caching version of parse_time(). The expensive strptime/mktime
+    calls are only made once for all lines logged in the same second.
+    """
+
+    MAX_CACHE = 100000
 
-    def __init__(self, *args, **kwargs):
-        # we'll update the position when the line data is set
-        self.text = mtext.Text(0, 0, '')
-        lines.Line2D.__init__(self, *args, **kwargs)
+    def __init__(self):
+        self.cache = {}
 
-        # we can't access the label attr until *after* the line is
-        # inited
-        self.text.set_text(self.get_label())
+    def __call__(self, value):
+        seconds = value[0:19]
+        try:
+            t = self.cache[seconds]
+        except KeyError:
+            if len(self.cache) > self.MAX_CACHE:
+                self.cache.clear()
+            t = float(mktime(strptime(seconds, "%Y-%m-%d %H:%M:%S")))
+            self.cache[seconds] = t
+        return t + float(value[20:23]) / 1000.0
 
-    def set_figure(self, figure):
-        self.text.set_figure(figure)
-        lines.Line2D.set_figure(self, figure)
 
-    def set_axes(self, axes):
-        self.text.set_axes(axes)
-        lines.Line2D.set_axes(self, axes)
+def split_ranges(files, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generate (file, start, end) byte ranges covering all the given files
+    in order. The boundaries are aligned on lines by read_range().
+    """
+    for filename in files:
+        size = os.path.getsize(filename)
+        for start in xrange(0, size, chunk_size):
+            yield filename, start, min(start + chunk_size, size)
 
-    def set_transform(self, transform):
-        # 2 pixel offset
-        texttrans = transform + mtransforms.Affine2D().translate(2, 2)
-        self.text.set_transform(texttrans)
-        lines.Line2D.set_transform(self, transform)
 
-    def set_data(self, x, y):
-        if len(x):
-            self.text.set_position((x[-1], y[-1]))
+def read_range(filename, start, end):
+    """
+    Return the lines of filename which begin within [start, end). A line
+    which straddles start belongs to the previous range, a line which
+    straddles end is read completely.
+    """
+    f = open(filename, "rb")
+    try:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        if pos >= end:
+            return []
+        data = f.read(end - pos)
+        if data and not data.endswith("\n"):
+            data += f.readline()
+    finally:
+        f.close()
+    return data.splitlines()
+
+
+def scan_range(task):
+    """
+    Worker function for analyze(). Scans a single byte range and returns a
+    tuple of:
+
+     * durations: a map from method to an array of completed call times
+     * slowest: the (took, date, thread, method) tuples of the slowest calls
+     * heads: for each thread seen, None if the first matching line was an
+       entry or the (stop, status) of the exit which could not be matched
+       within the range
+     * opened: for each thread, the (start, date, method) of the entry which
+       was still open at the end of the range
+
+    heads and opened are used to stitch calls across range boundaries.
+    """
+    filename, start, end, entries, exits, top = task
+    regex, kinds = compile_patterns(entries, exits)
+    parse = time_parser()
+    durations = {}
+    slowest = []
+    heads = {}
+    opened = {}
+    for line in read_range(filename, start, end):
+        m = regex.search(line)
+        if m is None:
+            continue
+        thread = line[74:84]
+        try:
+            t = parse(line)
+        except ValueError:
+            logging.debug("Unparseable: %s", line)
+            continue
+        if kinds[m.lastindex] == ENTRY:
+            if thread not in heads:
+                heads[thread] = None
+            opened[thread] = (t, line[0:23], line[96:].strip())
+        else:
+            try:
+                begin, date, method = opened.pop(thread)
+            except KeyError:
+                if thread not in heads:
+                    heads[thread] = (t, m.group())
+                continue
+            took = t - begin
+            try:
+                durations[method].append(took)
+            except KeyError:
+                durations[method] = array("d", [took])
+            _keep_slowest(slowest, top, (took, date, thread, method))
+    return durations, slowest, heads, opened
 
-        lines.Line2D.set_data(self, x, y)
 
-    def draw(self, renderer):
-        # draw my label at the end of the line with 2 pixel offset
-        lines.Line2D.draw(self, renderer)
-        self.text.draw(renderer)
+def _keep_slowest(heap, top, item):
+    if len(heap) < top:
+        heappush(heap, item)
+    elif top and item > heap[0]:
+        heappushpop(heap, item)
+
+
+class log_stats(object):
+    """
+    Merged results of analyze(). durations maps each method to an array
+    of call times in seconds; slowest holds the top-N individual calls.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.durations = {}
+        self.slowest = []
+        self.unmatched = 0
+        self.carry = {}
+
+    def merge(self, result):
+        """
+        Add the results of one scan_range() call. Results must be merged
+        in the same order as the ranges were generated.
+        """
+        durations, slowest, heads, opened = result
+        for thread, head in heads.items():
+            begin = self.carry.pop(thread, None)
+            if head is None:
+                continue
+            if begin is None:
+                self.unmatched += 1
+                continue
+            stop, status = head
+            self.add(begin[2], stop - begin[0], begin[1], thread)
+        self.carry.update(opened)
+        for method, values in durations.items():
+            try:
+                self.durations[method].extend(values)
+            except KeyError:
+                self.durations[method] = values
+        for item in slowest:
+            _keep_slowest(self.slowest, self.top, item)
+
+    def add(self, method, took, date, thread):
+        try:
+            self.durations[method].append(took)
+        except KeyError:
+            self.durations[method] = array("d", [took])
+        _keep_slowest(self.slowest, self.top, (took, date, thread, method))
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Return one (method, count, total, mean, percentiles..., max) tuple
+        per method, sorted by the total time spent in the method.
+        """
+        rv = []
+        for method, values in self.durations.items():
+            values = np.frombuffer(values, dtype=np.float64)
+            row = [method, len(values), values.sum(), values.mean()]
+            row.extend(np.percentile(values, percentiles))
+            row.append(values.max())
+            rv.append(tuple(row))
+        rv.sort(key=lambda x: x[2], reverse=True)
+        return rv
+
+    def slowest_calls(self):
+        """
+        Return the (took, date, thread, method) tuples of the slowest
+        calls, slowest first.
+        """
+        return nlargest(len(self.slowest), self.slowest)
+
+
+def analyze(files, entries=ALLTHREADS_ENTRIES, exits=ALLTHREADS_EXITS,
+            processes=None, chunk_size=DEFAULT_CHUNK_SIZE, top=10):
+    """
+    Scan the given log files, which should be passed oldest first, and
+    return a log_stats instance. If processes is 1, the scan happens in the
+    current process, otherwise a pool of the given size (default: number
+    of CPUs) is used.
+    """
+    tasks = [(f, s, e, entries, exits, top)
+             for f, s, e in split_ranges(files, chunk_size)]
+    stats = log_stats(top)
+    if processes is None:
+        processes = cpu_count()
+    if processes == 1 or len(tasks) < 2:
+        for task in tasks:
+            stats.merge(scan_range(task))
+    else:
+        pool = Pool(min(processes, len(tasks)))
+        try:
+            for result in pool.imap(scan_range, tasks):
+                stats.merge(result)
+        finally:
+            pool.terminate()
+            pool.join()
+    stats.unmatched += len(stats.carry)
+    return stats
+
+
+if has_matplotlib:
+    # http://matplotlib.sourceforge.net/examples/api/line_with_text.html
+    class MyLine(lines.Line2D):
+
+        def __init__(self, *args, **kwargs):
+            # we'll update the position when the line data is set
+            self.text = mtext.Text(0, 0, '')
+            lines.Line2D.__init__(self, *args, **kwargs)
+
+            # we can't access the label attr until *after* the line is
+            # inited
+            self.text.set_text(self.get_label())
+
+        def set_figure(self, figure):
+            self.text.set_figure(figure)
+            lines.Line2D.set_figure(self, figure)
+
+        def set_axes(self, axes):
+            self.text.set_axes(axes)
+            lines.Line2D.set_axes(self, axes)
+
+        def set_transform(self, transform):
+            # 2 pixel offset
+            texttrans = transform + mtransforms.Affine2D().translate(2, 2)
+            self.text.set_transform(texttrans)
+            lines.Line2D.set_transform(self, transform)
+
+        def set_data(self, x, y):
+            if len(x):
+                self.text.set_position((x[-1], y[-1]))
+
+            lines.Line2D.set_data(self, x, y)
+
+        def draw(self, renderer):
+            # draw my label at the end of the line with 2 pixel offset
+            lines.Line2D.draw(self, renderer)
+            self.text.draw(renderer)
 
 
 def plot_threads(watcher, all_colors=("blue", "red", "yellow", "green",
                                       "pink", "purple")):
+    if not has_matplotlib:
+        raise ImportError("matplotlib is required for plot_threads")
+
     digit = re.compile(".*(\d+).*")
 
     fig = plt.figure()
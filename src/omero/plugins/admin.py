@@ -414,6 +414,55 @@ location.
                 help="omero.data.dir directory value e.g. /OMERO")
             x.add_login_arguments()
 
+        cleanse.add_argument(
+            "--progress", action="store_true",
+            help="Periodically print progress, rate and reclaimable space "
+            "to stderr")
+        cleanse.add_argument(
+            "--checkpoint", metavar="FILE",
+            help="Record reconciled directories in FILE so that an "
+            "interrupted run can be resumed. The file is removed on "
+            "completion")
+
+        compresstables = Action(
+            "compresstables",
+            """Rewrite OMERO.tables files with compression (admins only)
+
+Existing tables are copied into a new HDF5 file using the given compression
+filters which then replaces the original. Tables which are currently open
+for writing are skipped so the command can safely be run in the background,
+e.g. from a cron job, until all tables have been converted. New tables can
+be compressed by setting the matching omero.tables.* server properties.
+
+This command must be run on the machine where, for example, /OMERO/ is
+located.
+
+Examples:
+  bin/omero admin compresstables --dry-run /OMERO
+  bin/omero admin compresstables --compression blosc:lz4 /OMERO
+  bin/omero admin compresstables --compression zlib --level 9 /OMERO
+""").parser
+        compresstables.add_argument(
+            "--dry-run", action="store_true",
+            help="Print out which tables would be rewritten")
+        compresstables.add_argument(
+            "--compression", default="blosc",
+            help="Compression library, e.g. zlib, blosc, blosc:lz4 or none "
+            "(default: blosc)")
+        compresstables.add_argument(
+            "--level", type=int, default=5,
+            help="Compression level from 0 to 9 (default: 5)")
+        compresstables.add_argument(
+            "--no-shuffle", action="store_true",
+            help="Disable the byte shuffle filter")
+        compresstables.add_argument(
+            "--chunk-rows", type=int,
+            help="Number of rows per HDF5 chunk")
+        compresstables.add_argument(
+            "data_dir", type=DirectoryType(),
+            help="omero.data.dir directory value e.g. /OMERO")
+        compresstables.add_login_arguments()
+
         removepyramids.add_argument(
             "--dry-run", action="store_true",
             help="Print out which files would be deleted")
@@ -441,6 +490,35 @@ location.
         Action(
             "checkupgrade", "Check whether a server upgrade is available")
 
+        logstats = Action("logstats", """Summarize call durations from the \
+server logs
+
+The given log files are split into byte ranges which are scanned by a pool
+of worker processes. Per-method latency percentiles and the slowest
+individual calls are printed. Files should be given oldest first; by default
+var/log/Blitz-0.log and its rotated copies are used.
+
+Examples:
+  bin/omero admin logstats
+  bin/omero admin logstats --top 25 -j 8 /tmp/logs/Blitz-0.log*
+""").parser
+        logstats.add_argument(
+            "files", nargs="*",
+            help="Log files to analyze (default: var/log/Blitz-0.log*)")
+        logstats.add_argument(
+            "-j", "--processes", type=int, default=None,
+            help="Number of worker processes (default: number of CPUs)")
+        logstats.add_argument(
+            "--chunk-size", type=int, default=64,
+            help="Size in MB of the byte range given to each worker")
+        logstats.add_argument(
+            "--top", type=int, default=10,
+            help="Number of slowest calls to list (default: 10)")
+        logstats.add_argument(
+            "--limit", type=int, default=None,
+            help="Maximum number of methods to list (default: all)")
+        logstats.add_style_argument()
+
         log = Action("log", "Add a custom log message to "
                             "the server log").parser
         log.add_argument(
@@ -1825,7 +1903,27 @@ present, the user will enter a console""")
         self.check_access()
         from omero.util.cleanse import cleanse
         cleanse(data_dir=args.data_dir, client=self.ctx.conn(args),
-                dry_run=args.dry_run)
+                dry_run=args.dry_run, progress=args.progress,
+                checkpoint=args.checkpoint)
+
+    @admin_only(full_admin=True)
+    def compresstables(self, args):
+        self.check_access()
+        from omero.util.cleanse import compresstables
+        options = {
+            "compression": args.compression,
+            "compression_level": args.level,
+            "shuffle": not args.no_shuffle,
+        }
+        if args.chunk_rows:
+            options["chunk_rows"] = args.chunk_rows
+        try:
+            from omero.hdfstorageV2 import get_filters
+            get_filters(options)
+        except omero.ApiUsageException, aue:
+            self.ctx.die(443, aue.message)
+        compresstables(data_dir=args.data_dir, client=self.ctx.conn(args),
+                       options=options, dry_run=args.dry_run)
 
     @admin_only(full_admin=False)
     def log(self, args):
@@ -1834,6 +1932,68 @@ present, the user will enter a console""")
                                repoUuid=args.repo, args=[args.message])
         client.submit(req).loop(100, 100)
 
+    def logstats(self, args):
+        from omero.install.logs_library import analyze
+        from omero.util.text import TableBuilder
+
+        files = args.files
+        if not files:
+            files = self._rotated_logs("Blitz-0.log")
+        for f in files:
+            if not os.path.isfile(f):
+                self.ctx.die(103, "No such file: %s" % f)
+        if not files:
+            self.ctx.die(103, "No log files found")
+
+        stats = analyze(files, processes=args.processes,
+                        chunk_size=args.chunk_size * 1024 * 1024,
+                        top=args.top)
+
+        def secs(x):
+            return "%.3f" % x
+
+        tb = TableBuilder("method", "count", "total", "mean",
+                          "p50", "p90", "p99", "max")
+        if args.style:
+            tb.set_style(args.style)
+        summary = stats.summary((50, 90, 99))
+        if args.limit is not None:
+            summary = summary[:args.limit]
+        for row in summary:
+            tb.row(row[0], row[1], *[secs(x) for x in row[2:]])
+        self.ctx.out(str(tb.build()))
+
+        if stats.slowest:
+            tb = TableBuilder("took", "date", "thread", "method")
+            if args.style:
+                tb.set_style(args.style)
+            for took, date, thread, method in stats.slowest_calls():
+                tb.row(secs(took), date, thread.strip(), method)
+            self.ctx.out("")
+            self.ctx.out(str(tb.build()))
+
+        if stats.unmatched:
+            self.ctx.err("%s entries or exits could not be matched"
+                         % stats.unmatched)
+
+    def _rotated_logs(self, name):
+        """
+        Returns the paths of the given log file and its rotated copies
+        (name.1, name.2, ...) oldest first.
+        """
+        log_dir = self.ctx.dir / "var" / "log"
+        rotated = []
+        for x in glob(str(log_dir / name) + ".*"):
+            suffix = x.rsplit(".", 1)[-1]
+            if suffix.isdigit():
+                rotated.append((int(suffix), x))
+        rotated.sort(reverse=True)
+        files = [x for _, x in rotated]
+        current = log_dir / name
+        if current.exists():
+            files.append(str(current))
+        return files
+
     def sessionlist(self, args):
         self.ctx.err('WARNING: "admin sessionlist" is deprecated, '
                      'use "sessions who" instead')
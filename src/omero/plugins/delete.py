@@ -37,6 +37,10 @@ Examples:
     # Delete a project excluding contained datasets and linked annotations
     omero delete Project:101 --exclude Dataset,Annotation
 
+    # Delete many images in separate commands of 1000 images each,
+    # running four of these commands at a time
+    omero delete Image:1-100000 --batch-size 1000 --parallel 4 --force
+
     # Delete all images contained under a project
     omero delete Project/Dataset/Image:53
     # Delete all images contained under two projects
@@ -9,7 +9,15 @@
 import os
 import time
 import signal
+import stat
 import uuid
+import shutil
+import logging
+import itertools
+import threading
+import collections
+import multiprocessing
+from collections import OrderedDict
 from omero_ext import killableprocess as subprocess
 
 from path import path
@@ -24,7 +32,7 @@ import omero.util.concurrency
 from omero.util import load_dotted_class
 from omero.util.temp_files import create_path, remove_path
 from omero.util.decorators import remoted, perf, locked, wraps
-from omero.rtypes import rint, rlong
+from omero.rtypes import rint, rlong, unwrap
 
 sys = __import__("sys")
 
@@ -123,6 +131,11 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         self.stopped = None  #: time of deactivation
         #: status which will be sent on set_job_status
         self.final_status = None
+        #: JobScheduler which queued this instance, if any
+        self.scheduler = None
+        self.queued = None  #: time the process was queued
+        #: set once the process has been activated or removed from the queue
+        self.launched = threading.Event()
         # Non arguments (immutable state)
         #: session this instance is tied to
         self.uuid = properties["omero.user"]
@@ -228,8 +241,52 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         self.pid = self.popen.pid
         self.started = time.time()
         self.stopped = None
+        self.launched.set()
         self.status("Activated")
 
+    @locked
+    def launch(self):
+        """
+        Activates a process which was queued by a JobScheduler
+        and marks its job as running.
+        """
+        client = self.tmp_client()
+        try:
+            self.activate()
+            self.set_job_status(client, "Running")
+        finally:
+            if client:
+                client.__del__()  # Safe closeSession
+
+    @locked
+    def dequeue(self, status="Cancelled"):
+        """
+        Removes this process from its scheduler if it has not yet been
+        activated, setting the job status to the given value. Returns
+        True if the process was removed.
+        """
+        if self.scheduler is None or not self.scheduler.remove(self):
+            return False
+        self.abandon(status)
+        return True
+
+    @locked
+    def abandon(self, status):
+        """
+        Finishes a process which will never be activated.
+        """
+        self.rcode = -signal.SIGTERM
+        self.final_status = status
+        self.status("Abandoned: %s" % status)
+        client = self.tmp_client()
+        try:
+            self.set_job_status(client)
+            self.cleanup_tmpdir()
+        finally:
+            if client:
+                client.__del__()  # Safe closeSession
+            self.launched.set()
+
     def command(self):
         """
         Method to allow subclasses to override the launch
@@ -281,6 +338,9 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         d_elapsed = int(d_stop - d_start)
         self.status("Lived %ss. Deactivation took %ss." % (elapsed, d_elapsed))
 
+        if self.scheduler is not None:
+            self.scheduler.release(self)
+
     @locked
     def isActive(self):
         """
@@ -335,11 +395,14 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         False if this resource can be cleaned up. (Resources API)
         """
 
-        if not self.wasActivated():
+        if not self.wasActivated() and self.queued is None:
             return True  # This should only happen on startup, so ignore
 
         try:
-            self.poll()
+            # Queued jobs are not polled but their session must outlive
+            # the wait for the JobScheduler
+            if self.wasActivated():
+                self.poll()
             self.ctx.getSession().getSessionService().getSession(self.uuid)
             return True
         except:
@@ -354,6 +417,7 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         connection. (Resources API)
         """
 
+        self.dequeue()
         if self.isRunning():
             self.deactivate()
 
@@ -397,9 +461,10 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         except:
             self.logger.error("cleanup of sterr failed", exc_info=True)
 
-    def set_job_status(self, client):
+    def set_job_status(self, client, status=None):
         """
-        Sets the job status
+        Sets the job status. If no status is given, the final
+        status of the process is used.
         """
         if not client:
             self.logger.error(
@@ -410,7 +475,8 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         gid = client.sf.getAdminService().getEventContext().groupId
         handle = WithGroup(client.sf.createJobHandle(), gid)
         try:
-            status = self.final_status
+            if status is None:
+                status = self.final_status
             if status is None:
                 status = (self.rcode == 0 and "Finished" or "Error")
             handle.attach(long(self.properties["omero.job"]))
@@ -521,6 +587,9 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         all callbacks. Marks this process as inactive.
         """
 
+        if self.scheduler is not None:
+            self.launched.wait()  # Until activated or dequeued
+
         if self.alreadyDone():
             return self.rcode
 
@@ -572,6 +641,10 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         if self.alreadyDone():
             return True
 
+        if self.dequeue():
+            self.allcallbacks("processCancelled", True)
+            return True
+
         self.final_status = "Cancelled"
         self._send(iskill=False)
         finished = self.isFinished()
@@ -587,6 +660,10 @@ class ProcessI(omero.grid.Process, omero.util.SimpleServant):
         if self.alreadyDone():
             return True
 
+        if self.dequeue():
+            self.allcallbacks("processKilled", True)
+            return True
+
         self.final_status = "Cancelled"
         self._send(iskill=True)
         finished = self.isFinished()
@@ -707,6 +784,35 @@ class MATLABProcessI(ProcessI):
         return matlab_cmd
 
 
+class ZygoteProcessI(ProcessI):
+    """
+    ProcessI which forks each script from a pre-loaded interpreter
+    (see omero.util.zygote) rather than starting a new one. Jobs still
+    run in their own process, directory and session. If the zygote
+    cannot be used, the job is started via subprocess.Popen.
+
+    Selected by setting "omero.process" to
+    "omero.processor.ZygoteProcessI".
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("Popen", self.zygote_popen)
+        ProcessI.__init__(self, *args, **kwargs)
+
+    def zygote_popen(self, args, cwd=None, env=None,
+                     stdout=None, stderr=None):
+        try:
+            import omero.util.zygote
+            zygote = omero.util.zygote.get_zygote(args[0])
+            return zygote.spawn(args, cwd=cwd, env=env,
+                                stdout=stdout.name, stderr=stderr.name)
+        except Exception:
+            self.logger.warn("Zygote unavailable. Using Popen for %s",
+                             self.uuid, exc_info=True)
+            return subprocess.Popen(args, cwd=cwd, env=env,
+                                    stdout=stdout, stderr=stderr)
+
+
 class UseSessionHolder(object):
 
     def __init__(self, sf):
@@ -723,11 +829,347 @@ class UseSessionHolder(object):
         pass
 
 
+class ScriptCache(object):
+    """
+    Content-addressed store of script files keyed by the hash of
+    their OriginalFile, so that a script run repeatedly is only
+    downloaded once. Entries are read-only and are hard-linked into
+    the job directory (or copied where linking is not possible).
+    When the cache grows beyond max_bytes, the least recently used
+    entries are removed. A max_bytes of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.logger = logging.getLogger("omero.processor.ScriptCache")
+        self.max_bytes = max_bytes
+        self.dir = directory
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, hash):
+        if not self.max_bytes or not hash or not hash.isalnum():
+            return None
+        if self.dir is None:
+            self.dir = create_path("scripts", ".cache", folder=True)
+        return path(self.dir) / hash
+
+    @locked
+    def fetch(self, hash, target):
+        """
+        Places the script with the given hash at target. Returns
+        False if the script is not in the cache.
+        """
+        entry = self._entry(hash)
+        if entry is None or not entry.exists():
+            self.misses += 1
+            return False
+        try:
+            os.link(str(entry), str(target))
+        except (AttributeError, OSError):
+            shutil.copyfile(str(entry), str(target))
+        os.utime(str(entry), None)  # Most recently used
+        self.hits += 1
+        return True
+
+    @locked
+    def store(self, hash, source):
+        """
+        Adds a copy of source, whose contents have been verified to
+        match hash, to the cache.
+        """
+        entry = self._entry(hash)
+        if entry is None or entry.exists():
+            return
+        tmp = entry.parent / (".%s.tmp" % hash)
+        try:
+            shutil.copyfile(str(source), str(tmp))
+            os.chmod(str(tmp), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(str(tmp), str(entry))
+        except (IOError, OSError):
+            self.logger.warn("Failed to cache script %s", hash,
+                             exc_info=True)
+            if tmp.exists():
+                tmp.remove()
+            return
+        self.evict()
+
+    @locked
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in path(self.dir).files():
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        entries.sort()
+        while entries and total > self.max_bytes:
+            mtime, size, entry = entries.pop(0)
+            try:
+                entry.remove()
+                total -= size
+            except OSError:
+                self.logger.debug("Failed to evict %s", entry, exc_info=True)
+
+
+class _QueuedJob(object):
+
+    def __init__(self, process, user, group, priority, seq):
+        self.process = process
+        self.user = user
+        self.group = group
+        self.priority = priority
+        self.seq = seq
+        self.submitted = time.time()
+
+
+class JobScheduler(object):
+    """
+    Decides when the ProcessI instances created by ProcessorI.processJob
+    are activated. At most max_jobs processes run at once, and at most
+    max_user_jobs per user and max_group_jobs per group (0 for no limit).
+
+    Waiting jobs are started in fair-share order: the user with the
+    fewest running jobs first, then the user with the least recent
+    usage (decaying with the given half-life in seconds), then the
+    highest priority and finally the order of submission.
+
+    Obeys the Resources API: check() logs the queue metrics and
+    starts any jobs which can run, cleanup() cancels all waiting jobs.
+    """
+
+    def __init__(self, max_jobs=0, max_user_jobs=0, max_group_jobs=0,
+                 half_life=600, interval=1.0, stop_event=None):
+        self.logger = logging.getLogger("omero.processor.JobScheduler")
+        self.max_jobs = max_jobs
+        self.max_user_jobs = max_user_jobs
+        self.max_group_jobs = max_group_jobs
+        self.half_life = half_life
+        self.interval = interval
+        if stop_event is None:
+            stop_event = omero.util.concurrency.get_event("JobScheduler")
+        self.stop_event = stop_event
+        self._lock = threading.RLock()
+        self._seq = itertools.count()
+        self.queue = []     #: _QueuedJob instances waiting to start
+        self.running = {}   #: ProcessI to _QueuedJob
+        self.usage = {}     #: user to (decayed usage, time)
+        self.poller = None  #: thread watching running jobs
+        self.submitted = 0
+        self.started = 0
+        self.finished = 0
+        self.cancelled = 0
+        self.waits = collections.deque(maxlen=1000)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _usage(self, user, now):
+        value, then = self.usage.get(user, (0.0, now))
+        return value * 0.5 ** ((now - then) / float(self.half_life))
+
+    def _counts(self):
+        users = collections.defaultdict(int)
+        groups = collections.defaultdict(int)
+        for job in self.running.values():
+            users[job.user] += 1
+            groups[job.group] += 1
+        return users, groups
+
+    @locked
+    def _select(self):
+        """
+        Moves the jobs which may start now from the queue to the
+        running map and returns them.
+        """
+        now = time.time()
+        users, groups = self._counts()
+        selected = []
+        while self.queue:
+            if self.max_jobs and len(self.running) >= self.max_jobs:
+                break
+            eligible = [
+                job for job in self.queue
+                if not (self.max_user_jobs and
+                        users[job.user] >= self.max_user_jobs) and
+                not (self.max_group_jobs and
+                     groups[job.group] >= self.max_group_jobs)]
+            if not eligible:
+                break
+            job = min(eligible, key=lambda job: (
+                users[job.user], self._usage(job.user, now),
+                -job.priority, job.seq))
+            self.queue.remove(job)
+            self.running[job.process] = job
+            users[job.user] += 1
+            groups[job.group] += 1
+            self.usage[job.user] = (self._usage(job.user, now) + 1, now)
+            self.waits.append(now - job.submitted)
+            self.started += 1
+            selected.append(job)
+        return selected
+
+    def submit(self, process, user, group, priority=0):
+        """
+        Queues the process. Returns True if the process may be activated
+        immediately by the caller, otherwise it will be launched by the
+        scheduler once a slot is free.
+        """
+        self._lock.acquire()
+        try:
+            job = _QueuedJob(process, user, group, priority, next(self._seq))
+            process.scheduler = self
+            process.queued = job.submitted
+            self.queue.append(job)
+            self.submitted += 1
+            selected = self._select()
+            admitted = job in selected
+            if admitted:
+                selected.remove(job)
+            else:
+                self.logger.info(
+                    "Queued %s for user=%s group=%s (%s waiting)",
+                    process.uuid, user, group, len(self.queue))
+                self._start_poller()
+        finally:
+            self._lock.release()
+        self._launch(selected)
+        return admitted
+
+    def remove(self, process):
+        """
+        Removes a process which has not yet been started. Returns
+        True if the process was found in the queue.
+        """
+        self._lock.acquire()
+        try:
+            for job in self.queue:
+                if job.process is process:
+                    self.queue.remove(job)
+                    self.cancelled += 1
+                    return True
+            return False
+        finally:
+            self._lock.release()
+
+    def release(self, process):
+        """
+        Frees the slot held by a process and starts waiting jobs.
+        """
+        self._lock.acquire()
+        try:
+            if self.running.pop(process, None) is not None:
+                self.finished += 1
+        finally:
+            self._lock.release()
+        self.dispatch()
+
+    def dispatch(self):
+        self._launch(self._select())
+
+    def _launch(self, jobs):
+        for job in jobs:
+            try:
+                job.process.launch()
+            except Exception:
+                self.logger.error("Failed to launch %s", job.process.uuid,
+                                  exc_info=True)
+                self.release(job.process)
+                job.process.abandon("Error")
+
+    @locked
+    def _start_poller(self):
+        if self.poller is None or not self.poller.isAlive():
+            self.poller = threading.Thread(
+                target=self._poll, name="JobScheduler-poller")
+            self.poller.daemon = True
+            self.poller.start()
+
+    def _poll(self):
+        """
+        While jobs are waiting, notices finished processes sooner than
+        the Resources check would so that their slots are reused.
+        """
+        while not self.stop_event.isSet():
+            self.stop_event.wait(self.interval)
+            self._lock.acquire()
+            try:
+                if not self.queue:
+                    self.poller = None
+                    return
+                processes = list(self.running)
+            finally:
+                self._lock.release()
+            for process in processes:
+                try:
+                    popen = process.popen
+                    if popen is None or popen.poll() is not None:
+                        process.poll()
+                except Exception:
+                    self.logger.debug("Poll failed for %s", process.uuid,
+                                      exc_info=True)
+
+    @locked
+    def metrics(self):
+        """
+        Returns a dictionary of queue-length and wait-time metrics.
+        Wait times are in seconds, computed over recently started jobs.
+        """
+        now = time.time()
+        waits = list(self.waits)
+        oldest = 0.0
+        if self.queue:
+            oldest = now - min(job.submitted for job in self.queue)
+        return {
+            "queued": len(self.queue),
+            "running": len(self.running),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "cancelled": self.cancelled,
+            "wait_mean": waits and sum(waits) / len(waits) or 0.0,
+            "wait_max": waits and max(waits) or 0.0,
+            "oldest_wait": oldest,
+        }
+
+    def check(self):
+        m = self.metrics()
+        if m["queued"] or m["running"]:
+            self.logger.info(
+                "Jobs: %(queued)s queued, %(running)s running, "
+                "oldest waiting %(oldest_wait).1fs, "
+                "mean wait %(wait_mean).1fs, max wait %(wait_max).1fs", m)
+        self.dispatch()
+        return True
+
+    def cleanup(self):
+        self._lock.acquire()
+        try:
+            waiting = [job.process for job in self.queue]
+        finally:
+            self._lock.release()
+        for process in waiting:
+            process.dequeue()
+
+
+def _int_property(ctx, name, default):
+    if ctx.communicator is None:
+        return default
+    props = ctx.communicator.getProperties()
+    try:
+        return int(props.getPropertyWithDefault(name, str(default)))
+    except ValueError:
+        return default
+
+
 class ProcessorI(omero.grid.Processor, omero.util.Servant):
 
+    PARAMS_CACHE_SIZE = 256
+    """Number of parsed omero.grid.JobParams kept by parseJob."""
+
     def __init__(self, ctx, needs_session=True, use_session=None,
                  accepts_list=None, cfg=None, omero_home=path.getcwd(),
-                 category=None):
+                 category=None, static_parse=True):
 
         if accepts_list is None:
             accepts_list = []
@@ -735,6 +1177,12 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         self.category = category  #: Category to be used w/ ProcessI
         self.omero_home = omero_home
 
+        #: Parsed JobParams keyed by (OriginalFile id, hash)
+        self.params_cache = OrderedDict()
+        self.params_lock = threading.Lock()
+        #: Whether parseJob may read parameters without running the script
+        self.static_parse = static_parse
+
         # Extensions for user-mode processors (ticket:1672)
 
         self.use_session = use_session
@@ -762,6 +1210,21 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         # Keep this session alive until the processor is finished
         self.resources.add(UseSessionHolder(use_session))
 
+        #: Limits the number of jobs from processJob running at once
+        self.scheduler = JobScheduler(
+            max_jobs=_int_property(
+                ctx, "omero.scripts.max_jobs",
+                2 * multiprocessing.cpu_count()),
+            max_user_jobs=_int_property(ctx, "omero.scripts.max_user_jobs", 0),
+            max_group_jobs=_int_property(
+                ctx, "omero.scripts.max_group_jobs", 0),
+            stop_event=ctx.stop_event)
+        self.resources.add(self.scheduler)
+
+        #: Local copies of recently run scripts
+        self.script_cache = ScriptCache(_int_property(
+            ctx, "omero.scripts.cache_size", 64 * 1024 * 1024))
+
     def setProxy(self, prx):
         """
         Overrides the default action in order to register this proxy
@@ -900,22 +1363,101 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
             self.logger.warn(
                 "callback failed on requestRunning: %s Exception:%s", cb, e)
 
+    def cached_params(self, key):
+        """
+        Returns the JobParams cached for key, if any. Entries for
+        other versions of the same script are discarded.
+        """
+        self.params_lock.acquire()
+        try:
+            for other in list(self.params_cache):
+                if other[0] == key[0] and other != key:
+                    del self.params_cache[other]
+            rv = self.params_cache.pop(key, None)
+            if rv is not None:
+                self.params_cache[key] = rv  # Most recently used
+            return rv
+        finally:
+            self.params_lock.release()
+
+    def cache_params(self, key, params):
+        self.params_lock.acquire()
+        try:
+            self.params_cache.pop(key, None)
+            self.params_cache[key] = params
+            while len(self.params_cache) > self.PARAMS_CACHE_SIZE:
+                self.params_cache.popitem(last=False)
+        finally:
+            self.params_lock.release()
+
+    def cacheable(self, params):
+        """
+        Scripts in the NSDYNAMIC namespace compute their parameters each
+        time they are parsed, so these must never be cached.
+        """
+        return omero.constants.namespaces.NSDYNAMIC not in (
+            params.namespaces or [])
+
+    def static_params(self, file, job):
+        """
+        Reads the parameters of a Python script without running it.
+        Returns None if the script must be run, including for dynamic
+        scripts. See omero.scripts.parse_static
+        """
+        if not self.static_parse:
+            return None
+        mimetype = unwrap(file.mimetype)
+        if mimetype and mimetype != "text/x-python":
+            return None
+        try:
+            gid = job.details.group.id.val
+            svc = WithGroup(self.internal_session().getScriptService(), gid)
+            rv = omero.scripts.parse_static(svc.getScriptText(file.id.val))
+        except Exception:
+            self.logger.debug("Static parse failed for script %s",
+                              file.id.val, exc_info=True)
+            return None
+        if rv is None or not self.cacheable(rv):
+            return None
+        return rv
+
     @remoted
     def parseJob(self, session, job, current=None):
         self.logger.info(
             "parseJob: Session = %s, JobId = %s" % (session, job.id.val))
+
         client = self.user_client("OMERO.parseJob")
 
         try:
-            iskill = False
+            # Also validates the session before a cached value is returned
             client.joinSession(session).detachOnDestroy()
+
+            key = None
+            file, handle = self.lookup(job)
+            if file is not None and unwrap(file.hash):
+                key = (file.id.val, file.hash.val)
+                rv = self.cached_params(key)
+                if rv is None:
+                    rv = self.static_params(file, job)
+                    if rv is not None:
+                        self.cache_params(key, rv)
+                if rv is not None:
+                    handle.close()
+                    self.logger.debug(
+                        "parseJob: Using cached params for %s", file.id.val)
+                    return rv
+
+            iskill = False
             properties = {}
             properties["omero.scripts.parse"] = "true"
             prx, process = self.process(
-                client, session, job, current, None, properties, iskill)
+                client, session, job, current, None, properties, iskill,
+                found=(file, handle))
             process.wait()
             rv = client.getOutput("omero.scripts.parse")
             if rv is not None:
+                if key is not None and self.cacheable(rv.val):
+                    self.cache_params(key, rv.val)
                 return rv.val
             else:
                 self.logger.warning(
@@ -936,7 +1478,8 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         try:
             client.joinSession(session).detachOnDestroy()
             prx, process = self.process(
-                client, session, job, current, params, iskill=True)
+                client, session, job, current, params, iskill=True,
+                scheduler=self.scheduler)
             return prx
         finally:
             client.closeSession()
@@ -944,19 +1487,27 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
 
     @perf
     def process(self, client, session, job, current, params, properties=None,
-                iskill=True):
+                iskill=True, scheduler=None, found=None):
         """
         session: session uuid, used primarily if client is None
         client: an omero.client object which should be attached to a session
+        scheduler: JobScheduler which decides when the process is activated.
+        If None, the process is activated immediately.
+        found: the (file, handle) already returned by lookup(job), if any.
+        The handle is closed by this method.
         """
 
         if properties is None:
             properties = {}
 
         if not session or not job or not job.id:
+            if found is not None:
+                found[1].close()
             raise omero.ApiUsageException("No null arguments")
 
-        file, handle = self.lookup(job)
+        if found is None:
+            found = self.lookup(job)
+        file, handle = found
 
         try:
             if not file:
@@ -986,21 +1537,28 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
                                    iskill, omero_home=self.omero_home)
             self.resources.add(process)
 
-            # client.download(file, str(process.script_path))
-            scriptText = sf.getScriptService().getScriptText(file.id.val)
-            process.script_path.write_bytes(scriptText)
-
-            self.logger.info("Downloaded file: %s" % file.id.val)
-            s = client.sha1(str(process.script_path))
-            if not s == file.hash.val:
-                msg = "Sha1s don't match! expected %s, found %s" \
-                    % (file.hash.val, s)
-                self.logger.error(msg)
-                process.cleanup()
-                raise omero.InternalException(None, None, msg)
+            if self.script_cache.fetch(file.hash.val, process.script_path):
+                self.logger.info("Using cached file: %s" % file.id.val)
             else:
+                # client.download(file, str(process.script_path))
+                scriptText = sf.getScriptService().getScriptText(file.id.val)
+                process.script_path.write_bytes(scriptText)
+
+                self.logger.info("Downloaded file: %s" % file.id.val)
+                s = client.sha1(str(process.script_path))
+                if not s == file.hash.val:
+                    msg = "Sha1s don't match! expected %s, found %s" \
+                        % (file.hash.val, s)
+                    self.logger.error(msg)
+                    process.cleanup()
+                    raise omero.InternalException(None, None, msg)
+                self.script_cache.store(file.hash.val, process.script_path)
+
+            if scheduler is None:
                 process.activate()
                 handle.setStatus("Running")
+            else:
+                self.schedule(scheduler, process, handle, job, current)
 
             id = None
             if self.category:
@@ -1013,13 +1571,50 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         finally:
             handle.close()
 
+    def schedule(self, scheduler, process, handle, job, current):
+        """
+        Passes the process to the scheduler, activating it now if a
+        slot is free. The process lock is held so that a queued process
+        cannot be launched before its job is marked as queued.
+        """
+        try:
+            user = job.details.owner.id.val
+        except AttributeError:
+            user = process.uuid
+        group = job.details.group.id.val
+        priority = 0
+        if current.ctx:
+            try:
+                priority = int(current.ctx.get("omero.scripts.priority", 0))
+            except ValueError:
+                pass
+
+        process._lock.acquire()
+        try:
+            if scheduler.submit(process, user, group, priority):
+                try:
+                    process.activate()
+                except Exception:
+                    self.logger.error(
+                        "Failed to activate %s" % process.uuid, exc_info=True)
+                    scheduler.release(process)
+                    raise
+                handle.setStatus("Running")
+            else:
+                handle.setStatus("Queued")
+        finally:
+            process._lock.release()
+
     def find_launcher(self, current):
         launcher = ""
         process_class = ""
+        if self.ctx.communicator:
+            props = self.ctx.communicator.getProperties()
+            launcher = props.getPropertyWithDefault("omero.launcher", "")
+            process_class = props.getPropertyWithDefault("omero.process", "")
         if current.ctx:
-            launcher = current.ctx.get("omero.launcher", "")
-            process_class = current.ctx.get(
-                "omero.process", "omero.process.ProcessI")
+            launcher = current.ctx.get("omero.launcher", launcher)
+            process_class = current.ctx.get("omero.process", process_class)
 
         if not launcher:
             launcher = sys.executable
@@ -1032,7 +1627,7 @@ class ProcessorI(omero.grid.Processor, omero.util.Servant):
         internal = False
         parts = process_class.split(".")
         if len(parts) == 3:
-            if parts[0:2] == ("omero", "processor"):
+            if parts[0:2] == ["omero", "processor"]:
                 internal = True
 
         if not process_class:
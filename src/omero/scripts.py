@@ -20,7 +20,11 @@
 """
 
 import os
+import ast
+import sys
+import types
 import logging
+import operator
 
 import omero
 import omero.callbacks
@@ -316,6 +320,49 @@ class ParseExit(Exception):
         self.params = params
 
 
+def job_params(*args, **kwargs):
+    """
+    Builds the omero.grid.JobParams described by the arguments to
+    client() without creating a client.
+    """
+
+    args = list(args)
+    if len(args) >= 1:
+        if isinstance(args[0], str):
+            kwargs["name"] = args.pop(0)
+    if len(args) >= 1:
+        if isinstance(args[0], str):
+            kwargs["description"] = args.pop(0)
+
+    if args and isinstance(args[0], omero.grid.JobParams):
+        params = args.pop(0)
+    else:
+        params = omero.grid.JobParams()
+        params.inputs = {}
+        params.outputs = {}
+
+    for k, v in kwargs.items():
+        if hasattr(params, k):
+            setattr(params, k, v)
+
+    if not params.stdoutFormat:
+        params.stdoutFormat = "text/plain"
+
+    if not params.stderrFormat:
+        params.stderrFormat = "text/plain"
+
+    for p in args:
+        if isinstance(p, Type):
+            if p._in:
+                params.inputs[p._name] = p
+            if p._out:
+                params.outputs[p._name] = p
+        else:
+            raise ValueError("Not Type: %s" % type(p))
+
+    return params
+
+
 def client(*args, **kwargs):
     """
     Entry point for all script engine scripts.
@@ -353,44 +400,11 @@ def client(*args, **kwargs):
     must be configured for the argumentless version of createSession()
     """
 
-    args = list(args)
-    if len(args) >= 1:
-        if isinstance(args[0], str):
-            kwargs["name"] = args.pop(0)
-    if len(args) >= 1:
-        if isinstance(args[0], str):
-            kwargs["description"] = args.pop(0)
-
     if "client" not in kwargs:
         kwargs["client"] = omero.client()
     c = kwargs["client"]
     c.setAgent("OMERO.scripts")
-
-    if args and isinstance(args[0], omero.grid.JobParams):
-        c.params = args.pop(0)
-    else:
-        c.params = omero.grid.JobParams()
-        c.params.inputs = {}
-        c.params.outputs = {}
-
-    for k, v in kwargs.items():
-        if hasattr(c.params, k):
-            setattr(c.params, k, v)
-
-    if not c.params.stdoutFormat:
-        c.params.stdoutFormat = "text/plain"
-
-    if not c.params.stderrFormat:
-        c.params.stderrFormat = "text/plain"
-
-    for p in args:
-        if isinstance(p, Type):
-            if p._in:
-                c.params.inputs[p._name] = p
-            if p._out:
-                c.params.outputs[p._name] = p
-        else:
-            raise ValueError("Not Type: %s" % type(p))
+    c.params = job_params(*args, **kwargs)
 
     handleParse(c)  # May throw
 
@@ -448,6 +462,264 @@ def parse_file(filename):
     return parse_text(scriptText)
 
 
+class _NotStatic(Exception):
+    pass
+
+
+_STATIC_MODULES = ("omero", "omero.scripts", "omero.rtypes")
+_STATIC_METHODS = {
+    Type: ("out", "inout", "type", "ofType", "append", "extend", "update"),
+    str: ("join", "strip", "replace", "lower", "upper"),
+    unicode: ("join", "strip", "replace", "lower", "upper"),
+}
+_STATIC_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.div, ast.Mod: operator.mod,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_,
+}
+# Operators which could build arbitrarily large strings or lists, e.g.
+# "x" * 10 ** 9 or "%999999999d" % 1, are only evaluated on numbers
+_STATIC_NUMERIC_OPERATORS = (ast.Mult, ast.Mod)
+_STATIC_CONSTANTS = {"True": True, "False": False, "None": None}
+# Largest value built while evaluating, see _static_size(). Since every
+# name is only evaluated once, chained assignments like "b = a + a" could
+# otherwise grow values exponentially.
+_STATIC_MAX_SIZE = 64 * 1024
+
+
+def _static_size(value):
+    """
+    Returns the approximate number of bytes held by a value built by
+    _StaticEvaluator, counting shared elements once per reference.
+    """
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (int, long)):
+        return value.bit_length() // 8
+    if isinstance(value, (list, tuple)):
+        return len(value) + sum(_static_size(x) for x in value)
+    if isinstance(value, dict):
+        return len(value) + sum(_static_size(k) + _static_size(v)
+                                for k, v in value.items())
+    return 0
+
+
+def _static_callable(obj):
+    if isinstance(obj, type) and issubclass(obj, Type):
+        return True
+    if getattr(obj, "__module__", None) == "omero.rtypes":
+        return obj.__name__ == "wrap" or obj.__name__.startswith("r")
+    bound = getattr(obj, "__self__", None)
+    if bound is None:
+        return False
+    for cls, names in _STATIC_METHODS.items():
+        if isinstance(bound, cls) and obj.__name__ in names:
+            return True
+    return False
+
+
+class _StaticEvaluator(object):
+    """
+    Evaluates the subset of Python expressions which is commonly used
+    for the arguments of client(): literals, containers, arithmetic,
+    omero.scripts types and omero.rtypes factories. Anything else
+    raises _NotStatic.
+    """
+
+    def __init__(self, tree):
+        self.names = {}
+        self.imports = {}
+        self.wildcards = []
+        self.bindings = {}
+        self.mutated = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                if not isinstance(node.ctx, ast.Load):
+                    self.bind(node.id)
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                self.bind(node.name, 2)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.add_import(node)
+            elif isinstance(node, ast.Attribute):
+                if isinstance(node.value, ast.Name):
+                    self.mutated.add(node.value.id)
+            elif isinstance(node, ast.Assign):
+                if len(node.targets) == 1 and \
+                        isinstance(node.targets[0], ast.Name):
+                    self.names.setdefault(node.targets[0].id, node.value)
+
+    def bind(self, name, count=1):
+        self.bindings[name] = self.bindings.get(name, 0) + count
+
+    def add_import(self, node):
+        """
+        Records names bound by imports of omero, omero.scripts and
+        omero.rtypes. Importing the same object twice under one name
+        (e.g. "import omero" and "import omero.gateway") is allowed.
+        """
+        for alias in node.names:
+            local = alias.asname or alias.name.split(".")[0]
+            value = None
+            if isinstance(node, ast.Import):
+                target = alias.asname and alias.name or local
+                if target in _STATIC_MODULES:
+                    value = sys.modules.get(target)
+            elif node.module in _STATIC_MODULES and alias.name != "*":
+                module = sys.modules.get(node.module)
+                value = getattr(module, alias.name, None)
+                if not isinstance(value, types.ModuleType) and \
+                        value is not client and \
+                        not _static_callable(value):
+                    value = None
+            if alias.name == "*":
+                if node.module in _STATIC_MODULES:
+                    self.wildcards.append(sys.modules.get(node.module))
+                continue
+            if self.imports.get(local, value) is not value:
+                value = None
+            self.imports[local] = value
+
+    def name(self, name):
+        if name in _STATIC_CONSTANTS:
+            return _STATIC_CONSTANTS[name]
+        count = self.bindings.get(name, 0)
+        if name in self.imports:
+            if count or self.imports[name] is None:
+                raise _NotStatic(name)
+            return self.imports[name]
+        if not count:
+            for module in self.wildcards:
+                value = getattr(module, name, None)
+                if value is client or _static_callable(value):
+                    return value
+        if count != 1 or name not in self.names or name in self.mutated:
+            raise _NotStatic(name)
+        value = self.names[name]
+        if value is _NotStatic:
+            raise _NotStatic(name)  # Recursive definition
+        if isinstance(value, ast.AST):
+            self.names[name] = _NotStatic
+            value = self(value)
+            self.names[name] = value
+        return value
+
+    def __call__(self, node):
+        if isinstance(node, ast.Str):
+            return node.s
+        elif isinstance(node, ast.Num):
+            return node.n
+        elif isinstance(node, ast.Name):
+            return self.name(node.id)
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            values = [self(x) for x in node.elts]
+            return self.sized(
+                isinstance(node, ast.List) and values or tuple(values))
+        elif isinstance(node, ast.Dict):
+            return self.sized(dict((self(k), self(v))
+                                   for k, v in zip(node.keys, node.values)))
+        elif isinstance(node, ast.BinOp) and \
+                type(node.op) in _STATIC_OPERATORS:
+            op = _STATIC_OPERATORS[type(node.op)]
+            left, right = self(node.left), self(node.right)
+            if isinstance(node.op, _STATIC_NUMERIC_OPERATORS):
+                for value in (left, right):
+                    if not isinstance(value, (int, long, float)):
+                        raise _NotStatic(type(node.op).__name__)
+            return self.sized(op(left, right))
+        elif isinstance(node, ast.UnaryOp) and \
+                type(node.op) in _STATIC_OPERATORS:
+            return _STATIC_OPERATORS[type(node.op)](self(node.operand))
+        elif isinstance(node, ast.Attribute):
+            return self.attribute(node)
+        elif isinstance(node, ast.Call):
+            func = self(node.func)
+            if not _static_callable(func) or node.starargs or node.kwargs:
+                raise _NotStatic(ast.dump(node.func))
+            args = [self(x) for x in node.args]
+            kwargs = dict((k.arg, self(k.value)) for k in node.keywords)
+            if isinstance(getattr(func, "__self__", None), basestring):
+                # Bounds the result of join() and replace() before they
+                # are called
+                size = _static_size(args) + _static_size(kwargs)
+                self.sized(None, (_static_size(func.__self__) + 1) *
+                           (size + 1))
+            return self.sized(func(*args, **kwargs))
+        raise _NotStatic(type(node).__name__)
+
+    def sized(self, value, size=None):
+        """
+        Returns value unless it (or the given size) exceeds
+        _STATIC_MAX_SIZE.
+        """
+        if size is None:
+            size = _static_size(value)
+        if size > _STATIC_MAX_SIZE:
+            raise _NotStatic("%d bytes" % size)
+        return value
+
+    def attribute(self, node):
+        if node.attr.startswith("_"):
+            raise _NotStatic(node.attr)
+        base = self(node.value)
+        if isinstance(base, types.ModuleType):
+            if not base.__name__.startswith("omero"):
+                raise _NotStatic(base.__name__)
+            value = getattr(base, node.attr, None)
+            if value is None:
+                raise _NotStatic(node.attr)
+            if isinstance(value, (types.ModuleType, basestring, bool,
+                                  int, long, float)) or \
+                    value is client or _static_callable(value):
+                return value
+            raise _NotStatic(node.attr)
+        value = getattr(base, node.attr, None)
+        if value is None or not _static_callable(value):
+            raise _NotStatic(node.attr)
+        return value
+
+    def is_client(self, node):
+        if not isinstance(node, ast.Call):
+            return False
+        try:
+            return self(node.func) is client
+        except Exception:
+            return False
+
+
+def parse_static(scriptText):
+    """
+    Returns the parameters of a script without running it, or None
+    if the script does not call client() exactly once with arguments
+    which can be evaluated statically. The call may appear anywhere
+    in the script (usually a run_script() function). Only literals,
+    containers, omero.scripts types, omero.rtypes factories and
+    names assigned once to such values are evaluated.
+    """
+    try:
+        tree = ast.parse(scriptText)
+    except (SyntaxError, TypeError, ValueError):
+        return None
+
+    evaluator = _StaticEvaluator(tree)
+    calls = [node for node in ast.walk(tree) if evaluator.is_client(node)]
+    if len(calls) != 1:
+        return None
+
+    call = calls[0]
+    try:
+        if call.starargs or call.kwargs:
+            raise _NotStatic("*args")
+        args = [evaluator(x) for x in call.args]
+        kwargs = dict((k.arg, evaluator(k.value)) for k in call.keywords)
+        kwargs.pop("client", None)
+        return job_params(*args, **kwargs)
+    except _NotStatic, ns:
+        TYPE_LOG.debug("Script is not static: %s", ns)
+    except Exception:
+        TYPE_LOG.debug("Static parse failed", exc_info=True)
+    return None
+
+
 class MissingInputs(Exception):
     def __init__(self):
         Exception.__init__(self)
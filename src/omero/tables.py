@@ -15,12 +15,14 @@ from path import path
 import omero  # Do we need both??
 import omero.clients
 import omero.callbacks
+import omero.columns
 
 # For ease of use
 from omero import LockTimeout
 from omero.rtypes import rstring
 from omero.rtypes import unwrap
 from omero.util.decorators import remoted, perf
+from omero.util.table_utils import EXPORT
 
 
 sys = __import__("sys")  # Python sys
@@ -29,6 +31,27 @@ tables = __import__("tables")  # Pytables
 VERSION = '2'
 RETRIES = 20
 
+EXPORT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def storage_options(properties, ctx=None):
+    """
+    Collects the "omero.tables.*" storage options (see
+    omero.hdfstorageV2.STORAGE_OPTIONS) from the server properties.
+    Values in the call context override the configured defaults so that
+    clients can choose the layout of individual tables.
+    """
+    from omero.hdfstorageV2 import STORAGE_OPTIONS
+    rv = {}
+    for name in STORAGE_OPTIONS:
+        key = "omero.tables.%s" % name
+        value = properties.getProperty(key)
+        if ctx and ctx.get(key):
+            value = ctx[key]
+        if value:
+            rv[name] = value
+    return rv
+
 
 def slen(rv):
     """
@@ -245,6 +268,9 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
         self.logger.info("%s.read(%s, %s, %s)", self, colNumbers, start, stop)
         if start == 0L and stop == 0L:
             stop = None
+        fmt = current is not None and current.ctx and current.ctx.get(EXPORT)
+        if fmt:
+            return self.export(fmt, colNumbers, start, stop)
         try:
             return self.storage.read(self.stamp, colNumbers,
                                      start, stop, current)
@@ -263,13 +289,85 @@ class TableI(omero.grid.Table, omero.util.SimpleServant):
             slen(colNumbers), slen(rowNumbers))
         return self.storage.slice(self.stamp, colNumbers, rowNumbers, current)
 
+    def export(self, fmt, colNumbers, start, stop):
+        """
+        Writes the given columns and rows into a new OriginalFile in one of
+        the omero.hdfstorageV2.EXPORT_FORMATS. Since the Table API has no
+        dedicated method, this is invoked by passing the format under the
+        EXPORT key in the call context of read(). The returned Data holds
+        a single FileColumn "export" with the id of the new file.
+        """
+        if not hasattr(self.storage, "export"):
+            raise omero.ApiUsageException(
+                None, None, "Export not supported by %s" % self.storage)
+        from omero.hdfstorageV2 import EXPORT_FORMATS
+        from omero.util.temp_files import create_path, remove_path
+        if fmt not in EXPORT_FORMATS:
+            raise omero.ApiUsageException(
+                None, None, "Unknown export format: %s" % fmt)
+
+        tmp = create_path("export", "." + fmt)
+        try:
+            rows = self.storage.export(self.stamp, str(tmp), fmt,
+                                       colNumbers, start, stop)
+            name = "%s.%s" % (unwrap(self.file_obj.name) or "table", fmt)
+            ofile = self.__upload(tmp, name, EXPORT_FORMATS[fmt])
+        finally:
+            remove_path(tmp)
+        self.logger.info("%s exported %s rows to file %s (%s bytes)",
+                         self, rows, ofile.id.val, unwrap(ofile.size))
+
+        col = omero.columns.FileColumnI(
+            "export", "%s rows as %s" % (rows, fmt), [ofile.id.val])
+        data = omero.grid.Data()
+        data.columns = [col]
+        data.rowNumbers = []
+        data.lastModification = long(self.stamp * 1000)
+        return data
+
+    def __upload(self, filename, name, mimetype):
+        gid = unwrap(self.file_obj.details.group.id)
+        client_uuid = self.factory.ice_getIdentity().category[8:]
+        ctx = {
+            "omero.group": str(gid),
+            omero.constants.CLIENTUUID: client_uuid}
+
+        ofile = omero.model.OriginalFileI()
+        ofile.name = rstring(name)
+        ofile.path = rstring(unwrap(self.file_obj.path) or "/")
+        ofile.mimetype = rstring(mimetype)
+        ofile = self.factory.getUpdateService(ctx).saveAndReturnObject(
+            ofile, ctx)
+
+        rfs = self.factory.createRawFileStore(ctx)
+        try:
+            rfs.setFileId(ofile.id.val, ctx)
+            f = open(filename, "rb")
+            try:
+                offset = 0
+                while True:
+                    block = f.read(EXPORT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    rfs.write(block, offset, len(block), ctx)
+                    offset += len(block)
+            finally:
+                f.close()
+            return rfs.save(ctx)
+        finally:
+            rfs.close(ctx)
+
     # TABLES WRITE API ===========================
 
     @remoted
     @perf
     def initialize(self, cols, current=None):
         self.assert_write()
-        self.storage.initialize(cols)
+        options = storage_options(self.communicator.getProperties(),
+                                  current and current.ctx or None)
+        if options:
+            self.logger.info("%s storage options: %s", self, options)
+        self.storage.initialize(cols, options=options)
         if cols:
             self.logger.info("Initialized %s with %s col(s)", self, slen(cols))
 
@@ -403,6 +501,18 @@ class TablesI(omero.grid.Tables, omero.util.Servant):
                          str(self._storage_factory.__module__),
                          self._storage_factory.__class__.__name__)
 
+        # Idle, read-only tables are kept open by the storage factory
+        if hasattr(self._storage_factory, "configure"):
+            props = self.communicator.getProperties()
+            self._storage_factory.configure(
+                cache_size=props.getPropertyWithDefault(
+                    "omero.tables.cache_size",
+                    str(self._storage_factory.CACHE_SIZE)),
+                cache_idle=props.getPropertyWithDefault(
+                    "omero.tables.cache_idle",
+                    str(self._storage_factory.CACHE_IDLE)))
+            self.resources.add(self._storage_factory)
+
         self.repo_cfg = None
         self.repo_mgr = None
         self.repo_obj = None
@@ -793,14 +793,7 @@ class PolygonData(ShapeData, ROIDrawingI):
     def listToString(self, pointsList):
         warnings.warn(
             "This module is deprecated as of OMERO 5.3.0", DeprecationWarning)
-        string = ''
-        cnt = 0
-        for element in pointsList:
-            if(cnt != 0):
-                string = string + ','
-            cnt += 1
-            string = string + str(element)
-        return string
+        return ','.join(map(str, pointsList))
 
     ##
     # Convert a string of points to a tuple list [(x1,y1),(x2,y2)..].
@@ -809,13 +802,8 @@ class PolygonData(ShapeData, ROIDrawingI):
     def stringToTupleList(self, pointString):
         warnings.warn(
             "This module is deprecated as of OMERO 5.3.0", DeprecationWarning)
-        elements = []
-        list = pointString.split(',')
-        numTokens = len(list)
-        for tokenPair in range(0, numTokens / 2):
-            elements.append(
-                (int(list[tokenPair * 2]), int(list[tokenPair * 2 + 1])))
-        return elements
+        values = map(int, pointString.split(','))
+        return zip(values[0::2], values[1::2])
 
     ##
     # overridden, @See ShapeData#createBaseType
@@ -897,13 +885,8 @@ class PolylineData(ShapeData, ROIDrawingI):
     def stringToTupleList(self, pointString):
         warnings.warn(
             "This module is deprecated as of OMERO 5.3.0", DeprecationWarning)
-        elements = []
-        list = pointString.split(',')
-        numTokens = len(list)
-        for tokenPair in range(0, numTokens / 2):
-            elements.append(
-                (int(list[tokenPair * 2]), int(list[tokenPair * 2 + 1])))
-        return elements
+        values = map(int, pointString.split(','))
+        return zip(values[0::2], values[1::2])
 
     ##
     # overridden, @See ShapeData#createBaseType
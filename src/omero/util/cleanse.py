@@ -33,13 +33,28 @@ import omero
 import sys
 import os
 import getpass
+import json
+import time
 import Ice
 
+from bisect import bisect_left
+from datetime import timedelta
 from Glacier2 import PermissionDeniedException
 from getopt import getopt, GetoptError
+from multiprocessing.pool import ThreadPool
 from omero.util import get_user
+from omero.util.text import filesizeformat
 from math import ceil
 from stat import ST_SIZE
+from threading import RLock
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 # The directories underneath an OMERO data directory to search for "dangling"
@@ -81,10 +96,24 @@ class Cleanser(object):
     """
     Keeps file cleansing state and performs OMERO database reconciliation of
     files within an OMERO binary repository.
+
+    The subdirectories of the repository are walked by a pool of threads.
+    The files of each directory are reconciled as soon as it has been
+    listed: the ids parsed from their names are checked against the
+    database in windows of RANGE_SIZE consecutive ids so that a single
+    query returns all existing objects for many files at once. Directories
+    which have been reconciled are appended to the checkpoint file, if any,
+    so that an interrupted run can be resumed.
     """
 
-    # Number of objects to defer before we actually make a query
-    QUERY_THRESHOLD = 25
+    # Width of the id range checked by each database query
+    RANGE_SIZE = 50000
+
+    # Number of threads used to walk the repository
+    WALK_THREADS = 8
+
+    # Seconds between two progress reports
+    PROGRESS_INTERVAL = 30
 
     # Strings identifying pyramid files
     PYRAMID_FILE = "_pyramid"
@@ -96,96 +125,245 @@ class Cleanser(object):
         self.object_type = object_type
         self.cleansed = list()
         self.bytes_cleansed = 0
-        self.deferred_paths = list()
+        self.files_checked = 0
+        self.dirs_checked = 0
+        self.dirs_found = 0
         self.dry_run = False
+        self.progress = False
+        self.checkpoint = None
+        self.lock = RLock()
+        self.began = time.time()
+        self._last_report = 0
 
     def cleanse(self, root):
         """
         Begins a cleansing operation from a given OMERO binary repository
         root directory. /OMERO/Files or /OMERO/Pixels for instance.
+        Subdirectories of root are walked in parallel.
         """
-        for file in os.listdir(root):
-            path = os.path.join(root, file)
-            if os.path.isdir(path):
-                self.cleanse(path)
-            else:
-                self.query_or_defer(path)
-
-    def query_or_defer(self, path):
+        done = self.load_checkpoint()
+        self.dirs_found = 1
+        dirs = self.reconcile_directory(root, done)
+        if not dirs:
+            return
+        pool = ThreadPool(min(self.WALK_THREADS, len(dirs)))
+        try:
+            for _ in pool.imap_unordered(
+                    lambda directory: self._walk(directory, done), dirs):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    def _walk(self, root, done):
         """
-        Adds a given path to the list of deferred paths. If the number of
-        deferred paths has reached the QUERY_THRESHOLD (to reduce database
-        hits) a reconciliation check will happen against OMERO.
+        Reconciles every directory below root, one directory at a time.
         """
-        self.deferred_paths.append(path)
-        if len(self.deferred_paths) == self.QUERY_THRESHOLD:
-            self.do_cleanse()
+        stack = [root]
+        while stack:
+            stack.extend(self.reconcile_directory(stack.pop(), done))
 
-    def do_cleanse(self):
+    def _scan(self, directory):
         """
-        Actually performs the reconciliation check against OMERO and
-        removes relevant files.
+        Splits the entries of a single directory into subdirectories
+        and files, using scandir() to avoid a stat() per entry if available.
         """
-        if len(self.deferred_paths) == 0:
-            return
-        split = os.path.split
-        object_ids = []
-        for path in self.deferred_paths:
-            file_name = split(path)[1]
-            try:
-                object_id = omero.rtypes.rlong(long(file_name))
-            except ValueError:
-                try:
-                    file_name.index(self.PYRAMID_FILE)
-                    id_part = file_name.split("_")[0]
-                    if file_name.endswith(self.PYRAMID_FILE):
-                        object_id = omero.rtypes.rlong(long(id_part))
-                    elif (file_name.endswith(self.PYRAMID_LOCK)
-                            or file_name.endswith(self.PYRAMID_TEMP)):
-                        object_id = omero.rtypes.rlong(
-                            long(id_part.lstrip('.')))
-                    else:
-                        object_id = omero.rtypes.rlong(-1)
-                except ValueError:
-                    object_id = omero.rtypes.rlong(-1)
-            object_ids.append(object_id)
+        dirs = list()
+        files = list()
+        if scandir is not None:
+            for entry in scandir(directory):
+                if entry.is_dir():
+                    dirs.append(entry.path)
+                else:
+                    files.append(entry.path)
+        else:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    dirs.append(path)
+                else:
+                    files.append(path)
+        return dirs, files
 
+    def parse_id(self, file_name):
+        """
+        Returns the object id encoded in the name of a repository file,
+        or -1 if the file does not belong to any object.
+        """
+        try:
+            return long(file_name)
+        except ValueError:
+            pass
+        if self.PYRAMID_FILE not in file_name:
+            return -1
+        id_part = file_name.split("_")[0]
+        try:
+            if file_name.endswith(self.PYRAMID_FILE):
+                return long(id_part)
+            elif (file_name.endswith(self.PYRAMID_LOCK)
+                    or file_name.endswith(self.PYRAMID_TEMP)):
+                return long(id_part.lstrip('.'))
+        except ValueError:
+            pass
+        return -1
+
+    def existing_ids(self, start, stop):
+        """
+        Returns the set of ids in [start, stop) which exist in the database.
+        """
         parameters = omero.sys.Parameters()
-        parameters.map = {'ids': omero.rtypes.rlist(object_ids)}
+        parameters.map = {'start': omero.rtypes.rlong(start),
+                          'stop': omero.rtypes.rlong(stop)}
         rows = self.query_service.projection(
-            "select o.id from %s as o where o.id in (:ids)" % self.object_type,
+            "select o.id from %s as o where o.id >= :start "
+            "and o.id < :stop" % self.object_type,
             parameters, {"omero.group": "-1"})
-        existing_ids = [cols[0].val for cols in rows]
+        return set(cols[0].val for cols in rows)
 
-        for i, object_id in enumerate(object_ids):
-            path = self.deferred_paths[i]
-            if object_id.val not in existing_ids:
-                if object_id.val == -1:
+    def reconcile_directory(self, directory, done=()):
+        """
+        Reconciles the files of a single directory unless it is in done,
+        the directories completed by a previous run, and returns its
+        subdirectories.
+        """
+        dirs, files = self._scan(directory)
+        with self.lock:
+            self.dirs_found += len(dirs)
+            if directory in done:
+                self.dirs_found -= 1
+        if directory not in done:
+            self.reconcile(files)
+            self.save_checkpoint(directory)
+        return dirs
+
+    def reconcile(self, paths):
+        """
+        Performs the reconciliation check against OMERO for the given
+        paths and removes those which have no object in the database.
+        Paths are grouped by the id parsed from their file name.
+        """
+        by_id = dict()
+        for path in paths:
+            object_id = self.parse_id(os.path.split(path)[1])
+            if object_id == -1:
+                if self.dry_run:
+                    self._print("   \_ %s (ignored/keep)" % path)
+            else:
+                by_id.setdefault(object_id, list()).append(path)
+
+        ids = sorted(by_id)
+        idx = 0
+        while idx < len(ids):
+            start = ids[idx]
+            stop = min(start + self.RANGE_SIZE, ids[-1] + 1)
+            end = bisect_left(ids, stop, idx)
+            existing = self.existing_ids(start, stop)
+            for object_id in ids[idx:end]:
+                if object_id in existing:
                     if self.dry_run:
-                        print "   \_ %s (ignored/keep)" % path
+                        for path in by_id[object_id]:
+                            self._print("   \_ %s (keep)" % path)
                 else:
-                    size = os.stat(path)[ST_SIZE]
-                    self.cleansed.append(path)
-                    self.bytes_cleansed = size
-                    if self.dry_run:
-                        print "   \_ %s (remove)" % path
-                    else:
-                        try:
-                            os.unlink(path)
-                        except OSError, e:
-                            print e
-            elif self.dry_run:
-                print "   \_ %s (keep)" % path
-        self.deferred_paths = list()
+                    for path in by_id[object_id]:
+                        self.remove(path)
+            idx = end
+
+        with self.lock:
+            self.files_checked += len(paths)
+            self.dirs_checked += 1
+            elapsed = time.time() - self.began
+            self._report(
+                "Checked %s files in %s/%s directories (%.0f files/s, "
+                "ETA %s), %s reclaimable" % (
+                    self.files_checked, self.dirs_checked, self.dirs_found,
+                    elapsed and self.files_checked / elapsed or 0,
+                    self.eta(elapsed), filesizeformat(self.bytes_cleansed)))
+
+    def eta(self, elapsed):
+        """
+        Estimates the time left from the directories found so far. Since
+        subdirectories are only found while walking, this is a lower
+        bound early in the run.
+        """
+        remaining = max(self.dirs_found - self.dirs_checked, 0)
+        if not self.dirs_checked:
+            return "unknown"
+        return str(timedelta(
+            seconds=int(elapsed * remaining / self.dirs_checked)))
+
+    def remove(self, path):
+        try:
+            size = os.stat(path)[ST_SIZE]
+        except OSError, e:
+            self._print(e)
+            return
+        with self.lock:
+            self.cleansed.append(path)
+            self.bytes_cleansed += size
+        if self.dry_run:
+            self._print("   \_ %s (remove)" % path)
+        else:
+            try:
+                os.unlink(path)
+            except OSError, e:
+                self._print(e)
+
+    def load_checkpoint(self):
+        """
+        Returns the set of directories which were reconciled for this
+        object type by a previous run.
+        """
+        done = set()
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return done
+        line = ""
+        with open(self.checkpoint) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partially written last line
+                    continue
+                if record.get("type") == self.object_type:
+                    done.add(record.get("dir"))
+        if line and not line.endswith("\n") and not self.dry_run:
+            # Terminate the partial line so that new records are readable
+            with open(self.checkpoint, "a") as f:
+                f.write("\n")
+        return done
+
+    def save_checkpoint(self, directory):
+        """
+        Records that all files in directory have been reconciled by
+        appending a line to the checkpoint file. Nothing is recorded for
+        dry runs.
+        """
+        if self.checkpoint is None or self.dry_run:
+            return
+        line = json.dumps({"type": self.object_type, "dir": directory})
+        with self.lock:
+            with open(self.checkpoint, "a") as f:
+                f.write(line + "\n")
+
+    def _print(self, msg):
+        with self.lock:
+            print msg
+
+    def _report(self, msg):
+        if not self.progress:
+            return
+        with self.lock:
+            now = time.time()
+            if now - self._last_report >= self.PROGRESS_INTERVAL:
+                self._last_report = now
+                print >>sys.stderr, "%s: %s" % (self.object_type, msg)
 
     def finalize(self):
         """
-        Takes the final set of deferred paths and performs a reconciliation
-        check against OMERO for them. This method's purpose is basically to
-        catch the final set of paths in the deferred path list and/or perform
-        any cleanup.
+        Called once the repository has been walked. Files are reconciled
+        directory by directory while walking so nothing is left to do.
         """
-        self.do_cleanse()
+        pass
 
     def __str__(self):
         return "Cleansing context: %d files (%d bytes)" % \
@@ -216,7 +394,15 @@ def initial_check(config_service, admin_service=None):
         sys.exit(3)
 
 
-def cleanse(data_dir, client, dry_run=False):
+def cleanse(data_dir, client, dry_run=False, progress=False,
+            checkpoint=None):
+    """
+    Cleanses all SEARCH_DIRECTORIES below data_dir. If progress is True,
+    periodic progress reports are printed to stderr. If a checkpoint file
+    is given, reconciled directories are recorded there so that an
+    interrupted run can be resumed; the file is removed once all directories
+    are done.
+    """
     client.getImplicitContext().put(omero.constants.GROUP, '-1')
 
     admin_service = client.sf.getAdminService()
@@ -237,12 +423,21 @@ def cleanse(data_dir, client, dry_run=False):
             object_type = SEARCH_DIRECTORIES[directory]
             cleanser = Cleanser(query_service, object_type)
             cleanser.dry_run = dry_run
+            cleanser.progress = progress
+            cleanser.checkpoint = checkpoint
             cleanser.cleanse(full_path)
             cleanser.finalize()
+            if progress:
+                print >>sys.stderr, "%s: %s reclaimable" % (
+                    object_type, filesizeformat(cleanser.bytes_cleansed))
     finally:
         if dry_run:
             print cleanser
 
+    if checkpoint is not None and not dry_run \
+            and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
     # delete empty directories from the managed repositories
     proxy, description = client.getManagedRepository(description=True)
     if proxy:
@@ -332,6 +527,77 @@ def fixpyramids(data_dir, query_service,
                         os.remove(pixels_file)
 
 
+def compresstables(data_dir, client, options, dry_run=False):
+    """
+    Rewrites the OMERO.tables files under data_dir using the filters
+    given by the storage options (see omero.hdfstorageV2.STORAGE_OPTIONS).
+    Tables which are currently open for writing are skipped and may be
+    handled by a later run. The size and hash of each rewritten
+    OriginalFile are updated on the server.
+    """
+    from omero.hdfstorageV2 import repack
+    from omero.util import long_to_path
+    from omero_ext import portalocker
+
+    client.getImplicitContext().put(omero.constants.GROUP, '-1')
+    initial_check(client.sf.getConfigService(), client.sf.getAdminService())
+    query_service = client.sf.getQueryService()
+
+    params = omero.sys.ParametersI()
+    params.add("mimetype", omero.rtypes.rstring("OMERO.tables"))
+    rows = query_service.projection(
+        "select f.id, f.size from OriginalFile f "
+        "where f.mimetype = :mimetype order by f.id", params)
+
+    before = after = 0
+    for row in rows:
+        file_id = row[0].val
+        file_path = long_to_path(file_id, os.path.join(data_dir, "Files"))
+        if not os.path.exists(file_path):
+            continue
+        size = os.path.getsize(file_path)
+        if dry_run:
+            print "Would compress table %s (%s)" % (
+                file_id, filesizeformat(size))
+            continue
+
+        with open(file_path, "rb") as lock:
+            try:
+                portalocker.lock(
+                    lock, portalocker.LOCK_EX | portalocker.LOCK_NB)
+            except portalocker.LockException:
+                print "Skipping table %s: in use" % file_id
+                continue
+            try:
+                new_size = repack(file_path, options)
+            except Exception, e:
+                print "Failed to compress table %s: %s" % (file_id, e)
+                continue
+            finally:
+                portalocker.unlock(lock)
+
+        if new_size is None:
+            continue
+        before += size
+        after += new_size
+
+        group_ctx = {omero.constants.GROUP: '-1'}
+        rfs = client.sf.createRawFileStore()
+        try:
+            rfs.setFileId(file_id, group_ctx)
+            rfs.truncate(new_size, group_ctx)     # May do nothing
+            rfs.write([], new_size, 0, group_ctx)  # Force an update
+            rfs.save(group_ctx)
+        finally:
+            rfs.close()
+        print "Compressed table %s: %s -> %s" % (
+            file_id, filesizeformat(size), filesizeformat(new_size))
+
+    if before:
+        print "Reduced tables from %s to %s" % (
+            filesizeformat(before), filesizeformat(after))
+
+
 def removepyramids(client, little_endian=None, dry_run=False,
                    imported_after=None, wait=25, limit=500):
     client.getImplicitContext().put(omero.constants.GROUP, '-1')
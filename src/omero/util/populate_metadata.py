@@ -24,15 +24,19 @@ Populate bulk metadata tables from delimited text files.
 
 
 import logging
+import copy
 import gzip
+import time
 import sys
 import csv
 import re
 import json
 from getpass import getpass
 from getopt import getopt, GetoptError
-from itertools import izip
+from itertools import chain, compress, groupby, islice, izip
 from collections import defaultdict
+from threading import Event, Lock, Semaphore, Thread
+from Queue import Full, Queue
 import warnings
 
 import omero.clients
@@ -40,7 +44,6 @@ from omero import CmdError
 from omero.rtypes import rlist, rstring, unwrap
 from omero.model import DatasetAnnotationLinkI, DatasetI, FileAnnotationI
 from omero.model import OriginalFileI, PlateI, PlateAnnotationLinkI, ScreenI
-from omero.model import PlateAcquisitionI, WellI, WellSampleI, ImageI
 from omero.model import ProjectAnnotationLinkI, ProjectI
 from omero.model import ScreenAnnotationLinkI
 from omero.model import MapAnnotationI, NamedValue
@@ -127,6 +130,147 @@ class MetadataError(Exception):
     pass
 
 
+class BatchWriter(object):
+    """
+    Saves batches on up to `streams` background threads so that the
+    caller can prepare the next batch while earlier ones are in flight.
+
+    `batch_size` is the suggested size of the next batch. It is adjusted
+    after every save so that a save takes about TARGET_LATENCY seconds,
+    at most doubling or halving each time, and stays within
+    `min_batch_size`, `max_batch_size` and, if the caller passes the
+    payload of each batch, `max_bytes`.
+    """
+
+    # Seconds a single save should take
+    TARGET_LATENCY = 2.0
+
+    def __init__(self, save, batch_size, streams=1, min_batch_size=None,
+                 max_batch_size=None, max_bytes=None, name='objects',
+                 action='Saved', total=None):
+        """
+        :param save: callable saving a single batch
+        :param batch_size: initial batch size
+        :param streams: number of batches saved concurrently
+        :param name: what is being saved, for logging
+        :param action: what is done to each batch, for logging
+        :param total: number of items expected, for progress logging
+        """
+        self.save = save
+        self.action = action
+        self.total = total
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size or max(1, batch_size // 10)
+        self.max_batch_size = max_batch_size or batch_size * 10
+        self.max_bytes = max_bytes
+        self.name = name
+        self.count = 0
+        self.nbytes = 0
+        self.batches = 0
+        self.error = None
+        self.lock = Lock()
+        self.slots = Semaphore(streams)
+        self.queue = Queue()
+        self.start = time.time()
+        self.threads = []
+        for i in range(streams):
+            thread = Thread(target=self._run, name='BatchWriter-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            batch, count, nbytes = task
+            try:
+                if self.error is None:
+                    t0 = time.time()
+                    self.save(batch)
+                    self._saved(count, nbytes, time.time() - t0)
+            except Exception:
+                log.error('Failed to save %d %s', count, self.name,
+                          exc_info=True)
+                with self.lock:
+                    if self.error is None:
+                        self.error = sys.exc_info()
+            finally:
+                self.slots.release()
+
+    def _saved(self, count, nbytes, elapsed):
+        with self.lock:
+            self.count += count
+            self.nbytes += nbytes or 0
+            self.batches += 1
+            size = self.batch_size
+            if elapsed > 0:
+                rate = count / elapsed
+                size = int(rate * self.TARGET_LATENCY)
+                size = min(max(size, self.batch_size // 2),
+                           self.batch_size * 2)
+            limit = self.max_batch_size
+            if nbytes and self.max_bytes:
+                limit = min(limit, self.max_bytes * count // nbytes)
+            self.batch_size = max(self.min_batch_size, min(size, limit))
+            progress = '%d' % self.count
+            if self.total:
+                progress += ' of %d, %.0f%%' % (
+                    self.total, 100.0 * self.count / self.total)
+            log.info('%s %d %s in %.2fs (batch %d, total %s)',
+                     self.action, count, self.name, elapsed, self.batches,
+                     progress)
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def submit(self, batch, count=None, nbytes=None):
+        """
+        Queues batch for saving, blocking while all streams are busy.
+        Raises the error of any earlier batch which failed.
+
+        :param count: number of items in the batch, defaults to its length
+        :param nbytes: estimated payload of the batch in bytes
+        """
+        self._raise()
+        if count is None:
+            count = len(batch)
+        self.slots.acquire()
+        self.queue.put((batch, count, nbytes))
+
+    def _stop(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def close(self):
+        """
+        Waits for all batches, raises the first error if any, and logs
+        the throughput.
+
+        :return: the number of items saved
+        """
+        self._stop()
+        self._raise()
+        elapsed = time.time() - self.start
+        rate = elapsed > 0 and self.count / elapsed or 0
+        log.info('%s %d %s in %d batches in %.1fs (%.1f per second, '
+                 '%.1f MB, final batch size %d)', self.action, self.count,
+                 self.name, self.batches, elapsed, rate,
+                 self.nbytes / 1048576.0, self.batch_size)
+        return self.count
+
+    def abort(self):
+        """Discards any queued batches and waits for those in flight."""
+        with self.lock:
+            if self.error is None:
+                self.error = (MetadataError, MetadataError('Aborted'), None)
+        self._stop()
+
+
 class HeaderResolver(object):
     """
     Header resolver for known header names which is responsible for creating
@@ -380,6 +524,45 @@ class ValueResolver(object):
             return value.lower() in BOOLEAN_TRUE
         raise MetadataError('Unsupported column class: %s' % column_class)
 
+    def resolve_column(self, column, values, plate=None):
+        """
+        Resolves the values of a column for a block of rows at once.
+        Strings, numbers and booleans are converted in bulk. Identifiers
+        (images, wells, plates, rows and columns) are resolved with
+        :meth:`resolve` once per distinct value and then looked up.
+
+        :param plate: (PlateColumn, values) for the same rows, if any
+        """
+        column_class = column.__class__
+        if StringColumn is column_class:
+            return list(values)
+        if DoubleColumn is column_class:
+            return map(float, values)
+        if LongColumn is column_class and \
+                column.name.lower() not in ('row', 'column'):
+            return map(long, values)
+        if BoolColumn is column_class:
+            return [value.lower() in BOOLEAN_TRUE for value in values]
+        resolved = dict()
+        rv = list()
+        if plate is None:
+            for value in values:
+                try:
+                    rv.append(resolved[value])
+                except KeyError:
+                    v = resolved[value] = self.resolve(column, value, [])
+                    rv.append(v)
+        else:
+            plate_column, plates = plate
+            for key in izip(values, plates):
+                try:
+                    rv.append(resolved[key])
+                except KeyError:
+                    row = [(plate_column, key[1])]
+                    v = resolved[key] = self.resolve(column, key[0], row)
+                    rv.append(v)
+        return rv
+
 
 class PlateData(object):
     """
@@ -765,6 +948,12 @@ class ProjectWrapper(PDIWrapper):
 class ParsingContext(object):
     """Generic parsing context for CSV files."""
 
+    # Number of CSV rows resolved at once
+    BLOCK_SIZE = 10000
+
+    # Largest batch of rows sent with addData, well below Ice.MessageSizeMax
+    MAX_BATCH_BYTES = 32 * 1024 * 1024
+
     def __init__(self, client, target_object, file=None, fileid=None,
                  cfg=None, cfgid=None, attach=False, column_types=None,
                  options=None):
@@ -810,32 +999,39 @@ class ParsingContext(object):
         return widths
 
     def parse_from_handle(self, data):
-        rows = list(csv.reader(data, delimiter=','))
-        first_row_is_types = HeaderResolver.is_row_column_types(rows[0])
-        header_index = 0
-        rows_index = 1
-        if first_row_is_types:
-            header_index = 1
-            rows_index = 2
-        log.debug('Header: %r' % rows[header_index])
-        for h in rows[0]:
+        rows = csv.reader(data, delimiter=',')
+        try:
+            first_row = rows.next()
+            header_row = first_row
+            first_row_is_types = HeaderResolver.is_row_column_types(first_row)
+            if first_row_is_types:
+                header_row = rows.next()
+        except StopIteration:
+            raise MetadataError('Missing header row in CSV')
+        log.debug('Header: %r' % header_row)
+        for h in first_row:
             if not h:
                 raise Exception('Empty column header in CSV: %s'
-                                % rows[header_index])
+                                % header_row)
         if self.column_types is None and first_row_is_types:
-            self.column_types = HeaderResolver.get_column_types(rows[0])
+            self.column_types = HeaderResolver.get_column_types(first_row)
         log.debug('Column types: %r' % self.column_types)
         self.header_resolver = HeaderResolver(
-            self.target_object, rows[header_index],
+            self.target_object, header_row,
             column_types=self.column_types)
         self.columns = self.header_resolver.create_columns()
         log.debug('Columns: %r' % self.columns)
 
-        valuerows = rows[rows_index:]
-        log.debug('Got %d rows', len(valuerows))
-        valuerows = self.value_resolver.subselect(
-            valuerows, rows[header_index])
-        self.populate(valuerows)
+        t0 = time.time()
+        count = 0
+        selected = 0
+        for block in self.blocks(rows):
+            count += len(block)
+            block = self.value_resolver.subselect(block, header_row)
+            selected += len(block)
+            self.populate_block(block)
+        log.info('Resolved %d/%d rows in %.1fs', selected, count,
+                 time.time() - t0)
         self.post_process()
         log.debug('Column widths: %r' % self.get_column_widths())
         log.debug('Columns: %r' % [
@@ -852,44 +1048,62 @@ class ParsingContext(object):
         finally:
             data.close()
 
+    def blocks(self, rows):
+        """Yields lists of up to BLOCK_SIZE rows from the iterable rows."""
+        rows = iter(rows)
+        while True:
+            block = list(islice(rows, self.BLOCK_SIZE))
+            if not block:
+                return
+            yield block
+
     def populate(self, rows):
-        nrows = len(rows)
-        for (r, row) in enumerate(rows):
-            values = list()
-            row = [(self.columns[i], value) for i, value in enumerate(row)]
-            for column, original_value in row:
-                log.debug('Row %d/%d Original value %s, %s',
-                          r + 1, nrows, original_value, column.name)
-                value = self.value_resolver.resolve(
-                    column, original_value, row)
-                if value.__class__ is Skip:
+        for block in self.blocks(rows):
+            self.populate_block(block)
+
+    def populate_block(self, rows):
+        """
+        Resolves a block of CSV rows column by column and appends the
+        values to the columns. Rows for which the plate is unknown are
+        skipped.
+        """
+        for width, run in groupby(rows, len):
+            if width > len(self.columns):
+                msg = 'Row has %d values for %d columns.' % (
+                    width, len(self.columns))
+                log.error(msg)
+                raise IndexError(msg)
+            for column in self.columns[width:]:
+                # Image and name columns can be calculated later based on
+                # another column.
+                if not (isinstance(column, ImageColumn) or
+                        column.name in (PLATE_NAME_COLUMN,
+                                        WELL_NAME_COLUMN,
+                                        IMAGE_NAME_COLUMN)):
+                    msg = 'Column %s has no values.' % column.name
+                    log.error(msg)
+                    raise IndexError(msg)
+            cells = zip(*run)
+            resolved = [None] * width
+            plate = None
+            for i in range(width):
+                if self.columns[i].__class__ is PlateColumn:
+                    resolved[i] = self.value_resolver.resolve_column(
+                        self.columns[i], cells[i])
+                    keep = [v.__class__ is not Skip for v in resolved[i]]
+                    if not all(keep):
+                        cells = [list(compress(c, keep)) for c in cells]
+                        resolved[i] = list(compress(resolved[i], keep))
+                    plate = (self.columns[i], cells[i])
                     break
-                values.append(value)
-                try:
-                    log.debug("Value's class: %s" % value.__class__)
-                    if value.__class__ is str:
-                        column.size = max(column.size, len(value))
-                except TypeError:
-                    log.error('Original value "%s" now "%s" of bad type!' % (
-                        original_value, value))
-                    raise
-            if value.__class__ is not Skip:
-                values.reverse()
-                for column in self.columns:
-                    if not values:
-                        if isinstance(column, ImageColumn) or \
-                           column.name in (PLATE_NAME_COLUMN,
-                                           WELL_NAME_COLUMN,
-                                           IMAGE_NAME_COLUMN):
-                            # Then assume that the values will be calculated
-                            # later based on another column.
-                            continue
-                        else:
-                            msg = 'Column %s has no values.' % column.name
-                            log.error(msg)
-                            raise IndexError(msg)
-                    else:
-                        column.values.append(values.pop())
+            for i, column in enumerate(self.columns[:width]):
+                values = resolved[i]
+                if values is None:
+                    values = self.value_resolver.resolve_column(
+                        column, cells[i], plate)
+                if StringColumn is column.__class__ and values:
+                    column.size = max(column.size, max(map(len, values)))
+                column.values.extend(values)
 
     def post_process(self):
         target_class = self.target_object.__class__
@@ -919,6 +1133,13 @@ class ParsingContext(object):
             log.info('Nothing to do during post processing.')
             return
 
+        if well_name_column is None:
+            log.info('Missing well name column, skipping.')
+        if image_name_column is None:
+            log.info('Missing image name column, skipping.')
+        if plate_name_column is None:
+            log.info('Missing plate name column, skipping.')
+
         sz = max([len(x.values) for x in self.columns])
         for i in range(0, sz):
             if well_name_column is not None:
@@ -937,8 +1158,6 @@ class ParsingContext(object):
                     )
                 well_name_column.size = max(well_name_column.size, len(v))
                 well_name_column.values.append(v)
-            else:
-                log.info('Missing well name column, skipping.')
 
             if image_name_column is not None and (
                     DatasetI is target_class or
@@ -971,16 +1190,12 @@ class ParsingContext(object):
                 image_name_column.size = max(
                     image_name_column.size, len(iname)
                 )
-            else:
-                log.info('Missing image name column, skipping.')
 
             if plate_name_column is not None:
                 plate = columns_by_name['Plate'].values[i]   # FIXME
                 v = self.value_resolver.get_plate_name_by_id(plate)
                 plate_name_column.size = max(plate_name_column.size, len(v))
                 plate_name_column.values.append(v)
-            else:
-                log.info('Missing plate name column, skipping.')
 
     def write_to_omero(self, batch_size=1000, loops=10, ms=500):
         sf = self.client.getSession()
@@ -1008,14 +1223,32 @@ class ParsingContext(object):
         table.initialize(self.columns)
         log.info('Table initialized with %d columns.' % (len(self.columns)))
 
-        i = 0
-        for pos in xrange(0, length, batch_size):
-            i += 1
-            for idx, x in enumerate(values):
-                self.columns[idx].values = x[pos:pos+batch_size]
-            table.addData(self.columns)
-            count = min(batch_size, length - pos)
-            log.info('Added %s rows of column data (batch %s)', count, i)
+        # Rows must be appended in order so a single stream is used, the
+        # next batch is sliced while the previous one is being added
+        row_bytes = 0
+        for x in self.columns:
+            if StringColumn is x.__class__:
+                row_bytes += x.size
+            else:
+                row_bytes += 8
+        writer = BatchWriter(
+            table.addData, batch_size, max_bytes=self.MAX_BATCH_BYTES,
+            name='rows of column data')
+        try:
+            pos = 0
+            while pos < length:
+                count = min(writer.batch_size, length - pos)
+                columns = []
+                for idx, x in enumerate(values):
+                    column = copy.copy(self.columns[idx])
+                    column.values = x[pos:pos + count]
+                    columns.append(column)
+                writer.submit(columns, count, count * row_bytes)
+                pos += count
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
 
         table.close()
         file_annotation = FileAnnotationI()
@@ -1139,8 +1372,23 @@ def get_config(session, cfg=None, cfgid=None):
 class BulkToMapAnnotationContext(_QueryContext):
     """
     Processor for creating MapAnnotations from BulkAnnotations.
+
+    The table is read in blocks of BLOCK_SIZE rows. Annotations in
+    namespaces with primary keys may be merged across rows so they are
+    collected by parse(). Annotations without primary keys are never
+    merged and are therefore not kept: write_to_omero() reads the table a
+    second time and saves them while further blocks are being read.
     """
 
+    # Number of table rows read at once
+    BLOCK_SIZE = 10000
+
+    # Number of blocks of annotations read ahead of the writes
+    READ_AHEAD = 2
+
+    # Number of batches of links saved concurrently
+    SAVE_STREAMS = 4
+
     def __init__(self, client, target_object, file=None, fileid=None,
                  cfg=None, cfgid=None, attach=False, options=None):
         """
@@ -1173,6 +1421,7 @@ class BulkToMapAnnotationContext(_QueryContext):
 
         self.pkmap = {}
         self.mapannotations = MapAnnotationManager()
+        self.nokey_count = 0
         self._init_namespace_primarykeys()
 
         self.options = {}
@@ -1290,42 +1539,40 @@ class BulkToMapAnnotationContext(_QueryContext):
         sf = self.client.getSession()
         group = str(self.target_object.details.group.id)
         update_service = sf.getUpdateService()
-        arr = update_service.saveAndReturnArray(links, {'omero.group': group})
-        return arr
+        update_service.saveArray(links, {'omero.group': group})
 
-    def _save_annotation_and_links(self, links, ann, batch_size):
+    def _save_annotation_and_links(self, links, ann, writer):
         """
-        Save a single `Annotation`, followed by the `AnnotationLinks` to that
-        Annotation and return the number of links saved.
+        Save a single `Annotation`, then queue the `AnnotationLinks` to that
+        Annotation on writer in batches of `writer.batch_size`.
 
         All `AnnotationLinks` must have `ann` as their child.
-        Links will be saved in batches of `batch_size`.
 
         See `_create_map_annotation_links`
         """
         sf = self.client.getSession()
-        group = str(self.target_object.details.group.id)
         update_service = sf.getUpdateService()
 
         annobj = update_service.saveAndReturnObject(ann)
         annobj.unload()
 
-        sz = 0
-        for batch in self._batch(links, sz=batch_size):
+        pos = 0
+        while pos < len(links):
+            batch = links[pos:pos + writer.batch_size]
             for link in batch:
                 link.setChild(annobj)
-            update_service.saveArray(
-                batch, {'omero.group': group})
-            sz += len(batch)
-        return sz
+            writer.submit(batch)
+            pos += len(batch)
 
-    def parse(self):
-        tableid = self.ofileid
+    def _open_table(self):
         sr = self.client.getSession().sharedResources()
         log.debug('Loading table OriginalFile:%d', self.ofileid)
-        table = sr.openTable(omero.model.OriginalFileI(tableid, False))
+        table = sr.openTable(omero.model.OriginalFileI(self.ofileid, False))
         assert table
+        return table
 
+    def parse(self):
+        table = self._open_table()
         try:
             return self.populate(table)
         finally:
@@ -1341,7 +1588,69 @@ class BulkToMapAnnotationContext(_QueryContext):
             pass
         return [('Image', i) for i in iids]
 
-    def populate(self, table):
+    def _read_blocks(self, table):
+        """
+        Yields the columns of the table, BLOCK_SIZE rows at a time.
+        """
+        nrows = table.getNumberOfRows()
+        colnumbers = range(len(table.getHeaders()))
+        for start in xrange(0, nrows, self.BLOCK_SIZE):
+            stop = min(start + self.BLOCK_SIZE, nrows)
+            yield table.read(colnumbers, start, stop).columns
+
+    def _prefetch(self, blocks):
+        """
+        Iterates over blocks in a background thread, keeping up to
+        READ_AHEAD items ready for the caller.
+        """
+        queue = Queue(self.READ_AHEAD)
+        stop = Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.5)
+                    return
+                except Full:
+                    pass
+
+        def run():
+            try:
+                for block in blocks:
+                    if stop.is_set():
+                        return
+                    put((block, None))
+                put((end, None))
+            except Exception:
+                put((end, sys.exc_info()))
+
+        reader = Thread(target=run, name="BulkToMapAnnotationReader")
+        reader.daemon = True
+        reader.start()
+        try:
+            while True:
+                block, exc_info = queue.get()
+                if block is end:
+                    if exc_info:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    return
+                yield block
+        finally:
+            stop.set()
+            reader.join()
+
+    def _map_annotations(self, blocks, keyed=None):
+        """
+        Yields a `CanonicalMapAnnotation` for every row and namespace of
+        the table.
+
+        :param blocks: an iterable of lists of table columns
+        :param keyed: if True only namespaces with primary keys are used,
+               if False only those without. If None all namespaces are
+               used but annotations without primary keys only have the
+               targets of the row as parents.
+        """
         def idcolumn_to_omeroclass(col):
             clsname = re.search('::(\w+)Column$', col.ice_staticId()).group(1)
             return clsname
@@ -1352,54 +1661,71 @@ class BulkToMapAnnotationContext(_QueryContext):
         except (KeyError, TypeError):
             ignore_missing_primary_key = False
 
-        nrows = table.getNumberOfRows()
-        data = table.readCoordinates(range(nrows))
-
-        # Don't create annotations on higher-level objects
-        # idcoltypes = set(HeaderResolver.screen_keys.values())
-        idcoltypes = set((ImageColumn, WellColumn))
-        idcols = []
-        for n in xrange(len(data.columns)):
-            col = data.columns[n]
-            if col.__class__ in idcoltypes:
-                omeroclass = idcolumn_to_omeroclass(col)
-                idcols.append((omeroclass, n))
-
-        headers = [c.name for c in data.columns]
-        if self.default_cfg or self.column_cfgs:
-            kvgl = KeyValueGroupList(
-                headers, self.default_cfg, self.column_cfgs)
-            trs = kvgl.get_transformers()
-        else:
-            trs = [KeyValueListPassThrough(headers)]
-
         selected_nss = self._get_selected_namespaces()
-        for row in izip(*(c.values for c in data.columns)):
-            targets = []
-            for omerotype, n in idcols:
-                if row[n] > 0:
-                    # Be aware this has implications for client UIs, since
-                    # Wells and Images may be treated as one when it comes
-                    # to annotations
-                    obj = (omerotype, row[n])
-                    targets.append(obj)
-                    targets.extend(self._get_additional_targets(obj))
+        idcols = None
+        for columns in blocks:
+            if idcols is None:
+                # Don't create annotations on higher-level objects
+                # idcoltypes = set(HeaderResolver.screen_keys.values())
+                idcoltypes = set((ImageColumn, WellColumn))
+                idcols = []
+                for n in xrange(len(columns)):
+                    col = columns[n]
+                    if col.__class__ in idcoltypes:
+                        omeroclass = idcolumn_to_omeroclass(col)
+                        idcols.append((omeroclass, n))
+
+                headers = [c.name for c in columns]
+                if self.default_cfg or self.column_cfgs:
+                    kvgl = KeyValueGroupList(
+                        headers, self.default_cfg, self.column_cfgs)
+                    trs = kvgl.get_transformers()
                 else:
-                    log.warn("Invalid Id:%d found in row %s", row[n], row)
-            if targets:
+                    trs = [KeyValueListPassThrough(headers)]
+
+                nss = []
                 for tr in trs:
-                    rowkvs = tr.transform(row)
                     ns = tr.name
                     if not ns:
                         ns = omero.constants.namespaces.NSBULKANNOTATIONS
-                    if (selected_nss is not None) and (ns not in selected_nss):
+                    if (selected_nss is not None) and (
+                            ns not in selected_nss):
                         log.debug('Skipping namespace: %s', ns)
                         continue
+                    haskeys = ns in self.pkmap
+                    if keyed is None or keyed == haskeys:
+                        nss.append((tr, ns, haskeys))
+
+            for row in izip(*(c.values for c in columns)):
+                targets = []
+                for omerotype, n in idcols:
+                    if row[n] > 0:
+                        # Be aware this has implications for client UIs,
+                        # since Wells and Images may be treated as one when
+                        # it comes to annotations
+                        targets.append((omerotype, row[n]))
+                    else:
+                        log.warn("Invalid Id:%d found in row %s", row[n], row)
+                if not targets:
+                    continue
+                alltargets = None
+                for tr, ns, haskeys in nss:
+                    rowkvs = tr.transform(row)
+                    if keyed is None and not haskeys:
+                        parents = targets
+                    else:
+                        if alltargets is None:
+                            alltargets = []
+                            for obj in targets:
+                                alltargets.append(obj)
+                                alltargets.extend(
+                                    self._get_additional_targets(obj))
+                        parents = alltargets
                     try:
-                        cma = self._create_cmap_annotation(targets, rowkvs, ns)
+                        cma = self._create_cmap_annotation(
+                            parents, rowkvs, ns)
                         if cma:
-                            self.mapannotations.add(cma)
-                            log.debug('Added MapAnnotation: %s', cma)
+                            yield cma
                         else:
                             log.debug(
                                 'Empty MapAnnotation: %s', rowkvs)
@@ -1412,56 +1738,146 @@ class BulkToMapAnnotationContext(_QueryContext):
                         if not ignore_missing_primary_key:
                             raise
 
+    def populate(self, table):
+        """
+        Reads the table block by block, merging annotations with primary
+        keys into `self.mapannotations` and counting those without.
+        """
+        t0 = time.time()
+        self.nokey_count = 0
+        for cma in self._map_annotations(self._read_blocks(table)):
+            if cma.primary is None:
+                self.nokey_count += 1
+            else:
+                self.mapannotations.add(cma)
+                log.debug('Added MapAnnotation: %s', cma)
+        log.info('Read %d rows in %.1fs: %d MapAnnotations with and %d '
+                 'without primary keys', table.getNumberOfRows(),
+                 time.time() - t0, len(self.mapannotations.mapanns),
+                 self.nokey_count)
+
+    def _nokey_map_annotations(self):
+        """
+        Re-reads the table and yields the annotations without primary
+        keys, reading ahead while the caller writes them.
+        """
+        if not self.nokey_count:
+            return
+        table = self._open_table()
+        try:
+            blocks = self._prefetch(self._read_blocks(table))
+            for cma in self._map_annotations(blocks, keyed=False):
+                yield cma
+        finally:
+            table.close()
+
     def _write_log(self, text):
         log.debug("BulkToMapAnnotation:write_to_omero - %s" % text)
 
     def write_to_omero(self, batch_size=1000, loops=10, ms=500):
-        i = 0
-        cur = 0
+        """
+        Saves the annotations and their links on SAVE_STREAMS concurrent
+        streams. Annotations with fewer than batch_size links are saved
+        together with their links, larger ones are saved first and their
+        links are then saved in batches.
+        """
+        writer = BatchWriter(
+            self._save_annotation_links, batch_size,
+            streams=self.SAVE_STREAMS, name='MapAnnotation links')
         links = []
 
         # This may be many-links-to-one-new-mapann so everything must
         # be kept together to avoid duplication of the mapann
         self._write_log("Start")
         cmas = self.mapannotations.get_map_annotations()
-        self._write_log("found %s annotations" % len(cmas))
-        for cma in cmas:
-            batch, ma = self._create_map_annotation_links(cma)
-            self._write_log("found batch of size %s" % len(batch))
-            if len(batch) < batch_size:
-                links.append(batch)
-                cur += len(batch)
-                if cur > 10 * batch_size:
-                    self._write_log("running batches. accumulated: %s" % cur)
-                    i += self._write_links(links, batch_size, i)
-                    links = []
-                    cur = 0
-            else:
-                self._write_log("running grouped_batch")
-                sz = self._save_annotation_and_links(batch, ma, batch_size)
-                i += sz
-                log.info('Created/linked %d MapAnnotations (total %s)',
-                         sz, i)
-        # Handle any remaining writes
-        i += self._write_links(links, batch_size, i)
-
-    def _write_links(self, links, batch_size, i):
-        count = 0
-        for batch in self._grouped_batch(links, sz=batch_size):
-            self._write_log("batch size: %s" % len(batch))
-            arr = self._save_annotation_links(batch)
-            count += len(arr)
-            log.info('Created/linked %d MapAnnotations (total %s)',
-                     len(arr), i+count)
-        return count
+        self._write_log("found %s annotations" % (
+            len(cmas) + self.nokey_count))
+        try:
+            for cma in chain(cmas, self._nokey_map_annotations()):
+                batch, ma = self._create_map_annotation_links(cma)
+                self._write_log("found batch of size %s" % len(batch))
+                if len(batch) < batch_size:
+                    if links and \
+                            len(links) + len(batch) > writer.batch_size:
+                        writer.submit(links)
+                        links = []
+                    links.extend(batch)
+                else:
+                    self._write_log("running grouped_batch")
+                    self._save_annotation_and_links(batch, ma, writer)
+            # Handle any remaining writes
+            if links:
+                writer.submit(links)
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
 
 
 class DeleteMapAnnotationContext(_QueryContext):
     """
     Processor for deleting MapAnnotations in the BulkAnnotations namespace
     on these types: Image WellSample Well PlateAcquisition Plate Screen
+
+    The annotation links below the target are found with one joined query
+    per annotated type and the Delete2 batches are run concurrently.
     """
 
+    # Queries for the IDs of the annotated objects of each type below a
+    # target of each type, the target ID is passed as :id.
+    # Hierarchy: Screen, Plate, {PlateAcquistion, Well}, WellSample, Image
+    # WellSamples are linked to PlateAcqs and Plates, images are found via
+    # the Wells of a Plate. Wells are not included if the target is a
+    # PlateAcquisition since this only refers to the fields in the well.
+    SCOPES = {
+        "Screen": {
+            "Plate": ("SELECT l.child.id FROM ScreenPlateLink l "
+                      "WHERE l.parent.id = :id"),
+            "PlateAcquisition": (
+                "SELECT pa.id FROM PlateAcquisition pa, ScreenPlateLink l "
+                "WHERE pa.plate.id = l.child.id AND l.parent.id = :id"),
+            "Well": ("SELECT w.id FROM Well w, ScreenPlateLink l "
+                     "WHERE w.plate.id = l.child.id AND l.parent.id = :id"),
+            "Image": ("SELECT ws.image.id FROM WellSample ws, Well w, "
+                      "ScreenPlateLink l WHERE ws.well.id = w.id "
+                      "AND w.plate.id = l.child.id AND l.parent.id = :id"),
+        },
+        "Plate": {
+            "PlateAcquisition": ("SELECT pa.id FROM PlateAcquisition pa "
+                                 "WHERE pa.plate.id = :id"),
+            "Well": "SELECT w.id FROM Well w WHERE w.plate.id = :id",
+            "Image": ("SELECT ws.image.id FROM WellSample ws, Well w "
+                      "WHERE ws.well.id = w.id AND w.plate.id = :id"),
+        },
+        "PlateAcquisition": {
+            "Image": ("SELECT ws.image.id FROM WellSample ws "
+                      "WHERE ws.plateAcquisition.id = :id"),
+        },
+        "Well": {
+            "Image": ("SELECT ws.image.id FROM WellSample ws "
+                      "WHERE ws.well.id = :id"),
+        },
+        "WellSample": {
+            "Image": "SELECT ws.image.id FROM WellSample ws WHERE ws.id = :id",
+        },
+        "Project": {
+            "Dataset": ("SELECT l.child.id FROM ProjectDatasetLink l "
+                        "WHERE l.parent.id = :id"),
+            "Image": ("SELECT dil.child.id FROM DatasetImageLink dil, "
+                      "ProjectDatasetLink pdl "
+                      "WHERE dil.parent.id = pdl.child.id "
+                      "AND pdl.parent.id = :id"),
+        },
+        "Dataset": {
+            "Image": ("SELECT l.child.id FROM DatasetImageLink l "
+                      "WHERE l.parent.id = :id"),
+        },
+        "Image": {},
+    }
+
+    # Number of Delete2 batches run concurrently
+    DELETE_STREAMS = 4
+
     def __init__(self, client, target_object, file=None, fileid=None,
                  cfg=None, cfgid=None, attach=False, options=None):
         """
@@ -1492,19 +1908,35 @@ class DeleteMapAnnotationContext(_QueryContext):
         return self.populate()
 
     def _get_annotations_for_deletion(
-            self, objtype, objids, anntype, nss, getlink=False):
-        r = []
+            self, objtype, scope, anntype, nss, getlink=False):
+        """
+        Returns the IDs of the annotations of anntype in nss linked to the
+        objects of objtype in scope, as (link ID, annotation ID) pairs if
+        getlink is True.
+
+        :param scope: a query for the IDs of the objects, or None for the
+               target itself
+        """
+        if getlink:
+            fetch = 'link.id, link.child.id'
+        else:
+            fetch = 'link.child.id'
+        if scope is None:
+            scope = ':id'
+        q = ("SELECT %s FROM %sAnnotationLink link "
+             "WHERE link.child.class=%s AND link.child.ns in (:nss) "
+             "AND link.parent.id in (%s)") % (fetch, objtype, anntype, scope)
+        qs = self.client.getSession().getQueryService()
+        params = omero.sys.ParametersI()
+        params.addId(unwrap(self.target_object.getId()))
+        params.map['nss'] = rlist(rstring(ns) for ns in nss)
+        log.debug("Query: %s namespace(s): %s", q, nss)
+        rss = unwrap(qs.projection(q, params))
         if getlink:
-            fetch = ''
+            r = [tuple(rs) for rs in rss]
         else:
-            fetch = 'child.'
-        if objids:
-            q = ("SELECT %sid FROM %sAnnotationLink WHERE "
-                 "child.class=%s AND parent.id in (:ids) "
-                 "AND child.ns in (:nss)")
-            r = self.projection(q % (fetch, objtype, anntype), objids, nss,
-                                batch_size=10000)
-            log.debug("%s: %d %s(s)", objtype, len(set(r)), anntype)
+            r = [rs[0] for rs in rss]
+        log.debug("%s: %d %s(s)", objtype, len(set(r)), anntype)
         return r
 
     def _get_configured_namespaces(self):
@@ -1529,93 +1961,33 @@ class DeleteMapAnnotationContext(_QueryContext):
                     continue
         return list(nss)
 
-    def populate(self):
-        # Hierarchy: Screen, Plate, {PlateAcquistion, Well}, WellSample, Image
-        parentids = {
-            "Screen": None,
-            "Plate":  None,
-            "PlateAcquisition": None,
-            "Well": None,
-            "WellSample": None,
-            "Image": None,
-            "Dataset": None,
-            "Project": None,
-        }
-
+    def _get_scopes(self):
+        """
+        Returns a dict from each annotated type below the target to the
+        query for the IDs of its objects, or None for the target itself.
+        """
         target = self.target_object
-        ids = [unwrap(target.getId())]
-
-        if isinstance(target, ScreenI):
-            q = ("SELECT child.id FROM ScreenPlateLink "
-                 "WHERE parent.id in (:ids)")
-            parentids["Screen"] = ids
-        if parentids["Screen"]:
-            parentids["Plate"] = self.projection(q, parentids["Screen"])
-
-        if isinstance(target, PlateI):
-            parentids["Plate"] = ids
-        if parentids["Plate"]:
-            q = "SELECT id FROM PlateAcquisition WHERE plate.id IN (:ids)"
-            parentids["PlateAcquisition"] = self.projection(
-                q, parentids["Plate"])
-            q = "SELECT id FROM Well WHERE plate.id IN (:ids)"
-            parentids["Well"] = self.projection(q, parentids["Plate"])
-
-        if isinstance(target, PlateAcquisitionI):
-            parentids["PlateAcquisition"] = ids
-        if parentids["PlateAcquisition"] and not isinstance(target, PlateI):
-            # WellSamples are linked to PlateAcqs and Plates, so only get
-            # if they haven't been obtained via a Plate
-            # Also note that we do not get Wells if the parent is a
-            # PlateAcquisition since this only refers to the fields in
-            # the well
-            q = "SELECT id FROM WellSample WHERE plateAcquisition.id IN (:ids)"
-            parentids["WellSample"] = self.projection(
-                q, parentids["PlateAcquisition"])
-
-        if isinstance(target, WellI):
-            parentids["Well"] = ids
-        if parentids["Well"]:
-            q = "SELECT id FROM WellSample WHERE well.id IN (:ids)"
-            parentids["WellSample"] = self.projection(
-                q, parentids["Well"], batch_size=10000)
-
-        if isinstance(target, WellSampleI):
-            parentids["WellSample"] = ids
-        if parentids["WellSample"]:
-            q = "SELECT image.id FROM WellSample WHERE id IN (:ids)"
-            parentids["Image"] = self.projection(
-                q, parentids["WellSample"], batch_size=10000)
-
-        if isinstance(target, ProjectI):
-            parentids["Project"] = ids
-        if parentids["Project"]:
-            q = ("SELECT ds.id FROM ProjectDatasetLink link "
-                 "join link.parent prj "
-                 "join link.child as ds WHERE prj.id IN (:ids)")
-            parentids["Dataset"] = self.projection(q, parentids["Project"])
-
-        if isinstance(target, DatasetI):
-            parentids["Dataset"] = ids
-        if parentids["Dataset"]:
-            q = ("SELECT i.id FROM DatasetImageLink link "
-                 "join link.parent ds "
-                 "join link.child as i WHERE ds.id IN (:ids)")
-            parentids["Image"] = self.projection(q, parentids["Dataset"])
-
-        if isinstance(target, ImageI):
-            parentids["Image"] = ids
-
-        # TODO: This should really include:
-        #    raise Exception("Unknown target: %s" % target.__class__.__name__)
-
-        log.debug("Parent IDs: %s",
-                  ["%s:%s" % (k, v is not None and len(v) or "NA")
-                   for k, v in parentids.items()])
+        objtype = target.ice_staticId().split('::')[-1]
+        try:
+            scopes = dict(self.SCOPES[objtype])
+        except KeyError:
+            # TODO: This should really include:
+            #    raise Exception("Unknown target: %s" % objtype)
+            log.warn("Unknown target: %s", objtype)
+            return {}
+        if objtype not in ('WellSample',):
+            scopes[objtype] = None
+        return scopes
 
+    def populate(self):
+        scopes = self._get_scopes()
+        log.debug("Annotated types: %s", scopes.keys())
+
+        # Links by MapAnnotation, so that all links to one MapAnnotation
+        # are deleted together
+        self.mapannlinks = defaultdict(list)
         self.mapannids = dict()
         self.fileannids = set()
-        not_annotatable = ('WellSample',)
 
         # Currently deleting AnnotationLinks should automatically delete
         # orphaned MapAnnotations:
@@ -1623,27 +1995,25 @@ class DeleteMapAnnotationContext(_QueryContext):
         # Note this may change in future:
         # https://trello.com/c/Gnoi9mTM/141-never-delete-orphaned-map-annotations
         nss = self._get_configured_namespaces()
-        for objtype, objids in parentids.iteritems():
-            if objtype in not_annotatable:
-                continue
+        for objtype, scope in scopes.iteritems():
             r = self._get_annotations_for_deletion(
-                objtype, objids, 'MapAnnotation', nss, getlink=True)
-            if r:
-                try:
-                    self.mapannids[objtype].update(r)
-                except KeyError:
-                    self.mapannids[objtype] = set(r)
+                objtype, scope, 'MapAnnotation', nss, getlink=True)
+            linkids = self.mapannids.setdefault(objtype, set())
+            for linkid, annid in r:
+                if linkid not in linkids:
+                    linkids.add(linkid)
+                    self.mapannlinks[annid].append((objtype, linkid))
+            if not linkids:
+                del self.mapannids[objtype]
 
         log.info("Total MapAnnotationLinks in %s: %d",
                  nss, sum(len(v) for v in self.mapannids.values()))
         log.debug("MapAnnotationLinks in %s: %s", nss, self.mapannids)
 
         if self.attach and NSBULKANNOTATIONSCONFIG in nss:
-            for objtype, objids in parentids.iteritems():
-                if objtype in not_annotatable:
-                    continue
+            for objtype, scope in scopes.iteritems():
                 r = self._get_annotations_for_deletion(
-                    objtype, objids, 'FileAnnotation',
+                    objtype, scope, 'FileAnnotation',
                     [NSBULKANNOTATIONSCONFIG])
                 self.fileannids.update(r)
 
@@ -1652,14 +2022,40 @@ class DeleteMapAnnotationContext(_QueryContext):
             log.debug("FileAnnotations in %s: %s",
                       [NSBULKANNOTATIONSCONFIG], self.fileannids)
 
-    def write_to_omero(self, batch_size=1000, loops=10, ms=500):
-        for objtype, maids in self.mapannids.iteritems():
-            for batch in self._batch(maids, sz=batch_size):
-                self._write_to_omero_batch(
-                    {"%sAnnotationLink" % objtype: batch}, loops, ms)
+    def _plan_batches(self, batch_size):
+        """
+        Returns the Delete2 targets in batches of about batch_size objects.
+        Links to the same MapAnnotation are kept in one batch so that
+        concurrent batches do not race to delete the orphaned annotation.
+        """
+        batches = []
+        for batch in self._grouped_batch(
+                self.mapannlinks.itervalues(), sz=batch_size):
+            to_delete = defaultdict(list)
+            for objtype, linkid in batch:
+                to_delete["%sAnnotationLink" % objtype].append(linkid)
+            batches.append(dict(to_delete))
         for batch in self._batch(self.fileannids, sz=batch_size):
-            self._write_to_omero_batch({"FileAnnotation": batch},
-                                       loops, ms)
+            batches.append({"FileAnnotation": batch})
+        return batches
+
+    def write_to_omero(self, batch_size=1000, loops=10, ms=500):
+        batches = self._plan_batches(batch_size)
+        counts = [sum(len(ids) for ids in b.values()) for b in batches]
+        log.info("Deleting %d objects in %d batches",
+                 sum(counts), len(batches))
+        writer = BatchWriter(
+            lambda to_delete: self._write_to_omero_batch(
+                to_delete, loops, ms),
+            batch_size, streams=self.DELETE_STREAMS,
+            name='objects', action='Deleted', total=sum(counts))
+        try:
+            for to_delete, count in izip(batches, counts):
+                writer.submit(to_delete, count)
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
 
     def _write_to_omero_batch(self, to_delete, loops=10, ms=500):
         delCmd = omero.cmd.Delete2(targetObjects=to_delete)
@@ -23,16 +23,23 @@
 #
 
 
+import multiprocessing
 import tempfile
+import hashlib
+import copy
 import logging
 import time
+import stat
 import sys
 import csv
+import os
 import re
-from threading import Thread
+from cStringIO import StringIO
+from itertools import islice
+from threading import Event, RLock, Thread
 from getpass import getpass
 from getopt import getopt, GetoptError
-from Queue import Queue
+from Queue import Queue, Full
 
 from omero.rtypes import rdouble, rstring, rint, unwrap
 from omero.model import OriginalFileI, PlateI, PlateAnnotationLinkI, ImageI, \
@@ -41,6 +48,8 @@ from omero.grid import ImageColumn, WellColumn, RoiColumn, LongColumn, \
     DoubleColumn
 
 from omero.sys import ParametersI
+from omero.util import get_omero_userdir
+from omero.util.decorators import locked
 from omero.util.temp_files import create_path
 from omero import client
 
@@ -64,7 +73,11 @@ Options:
   -m    Measurement index to populate
   -i    Dump measurement information and exit (no population)
   -d    Print debug statements
-  -t    Number of threads to use when populating [defaults to 1]
+  -t    Number of threads saving ROI [defaults to the number of CPUs]
+  -w    Number of processes parsing result files
+        [defaults to the number of CPUs]
+  -c    Size of the local result file cache in MB [defaults to 1024]
+        (0 disables the cache)
 
 Examples:
   %s -s localhost -p 4063 -u bob 27
@@ -119,13 +132,68 @@ class ThreadPool:
 thread_pool = None
 
 
+def default_worker_count():
+    """Returns the default number of threads or processes: one per CPU."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 def get_thread_pool():
     global thread_pool
     if thread_pool is None:
-        thread_pool = ThreadPool(1)
+        thread_pool = ThreadPool(default_worker_count())
     return thread_pool
 
 
+# Global process pool for parsing result files and its size
+parse_pool = None
+parse_process_count = None
+
+
+def get_parse_pool():
+    """
+    Returns the pool of processes parsing result files, or None if they
+    are to be parsed by the calling process.
+    """
+    global parse_pool
+    if parse_pool is None:
+        count = parse_process_count
+        if count is None:
+            count = default_worker_count()
+        if count > 1:
+            log.debug('Creating pool of %d parsing processes' % count)
+            parse_pool = multiprocessing.Pool(count)
+    return parse_pool
+
+
+def log_throughput(stage, count, unit, t0):
+    """Logs the rate at which count units were processed since t0."""
+    elapsed = time.time() - t0
+    log.info("%s: %d %s in %.1fs (%.1f %s/s)" % (
+        stage, count, unit, elapsed, count / max(elapsed, 0.001), unit))
+
+
+def parse_mias_detail(text):
+    """
+    Parses the tab delimited content of a MIAS detail file, which is read
+    from the end up to the header row. Returns a tuple of the width of the
+    last row, the header row (None if missing) and the numeric rows, as
+    lists of floats in reverse file order. Runs in the parsing processes.
+    """
+    rows = list(csv.reader(StringIO(text), delimiter='\t'))
+    rows.reverse()
+    width = rows and len(rows[0]) or 0
+    values = list()
+    for row in rows:
+        try:
+            values.append([float(value) for value in row])
+        except ValueError:
+            return width, row, values
+    return width, None, values
+
+
 class MeasurementError(Exception):
 
     """
@@ -171,6 +239,332 @@ class DownloadingOriginalFileProvider(object):
         self.raw_file_store.close()
 
 
+class OriginalFileCache(object):
+
+    """
+    Local content-addressed cache of original files, keyed by the hasher
+    and hash stored on the OriginalFile, so that re-populating a plate does
+    not download its result files again. Only files hashed with one of
+    HASHERS are cached, so that the content can be checked before it is
+    added. When the cache grows beyond max_bytes the least recently used
+    entries are removed; a max_bytes of 0 disables the cache.
+    """
+
+    # Default maximum size of the cache
+    MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+    # Hash functions of the supported OriginalFile hashers
+    HASHERS = {"SHA1-160": hashlib.sha1, "MD5-128": hashlib.md5}
+
+    def __init__(self, max_bytes=MAX_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        if directory is None:
+            directory = get_omero_userdir() / "cache" / "populate_roi"
+        self.dir = directory
+        self._lock = RLock()
+
+    def hasher(self, original_file):
+        """
+        Returns the name of the hasher of original_file if it is one of
+        HASHERS, otherwise None
+        """
+        hasher = original_file.hasher
+        if hasher is None or not hasher.isLoaded():
+            return None
+        name = unwrap(hasher.value)
+        return name in self.HASHERS and name or None
+
+    def _entry(self, original_file):
+        hash = unwrap(original_file.hash)
+        hasher = self.hasher(original_file)
+        if not self.max_bytes or not hash or not hash.isalnum() or \
+                hasher is None:
+            return None
+        return os.path.join(
+            str(self.dir), "%s-%s" % (hasher.lower(), hash.lower()))
+
+    @locked
+    def open(self, original_file):
+        """
+        Returns an open file handle on the cached copy of original_file
+        or None if it is not in the cache.
+        """
+        entry = self._entry(original_file)
+        if entry is None or not os.path.exists(entry):
+            return None
+        os.utime(entry, None)  # Most recently used
+        return open(entry, 'rb')
+
+    def writer(self, original_file):
+        """
+        Returns a CacheWriter adding original_file to the cache or None
+        if it cannot be cached.
+        """
+        entry = self._entry(original_file)
+        if entry is None or os.path.exists(entry):
+            return None
+        try:
+            if not os.path.isdir(str(self.dir)):
+                os.makedirs(str(self.dir))
+            return CacheWriter(self, original_file, entry)
+        except (IOError, OSError):
+            log.warn("Unable to cache original file: %d" %
+                     original_file.id.val, exc_info=True)
+            return None
+
+    @locked
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(str(self.dir)):
+            if name.startswith('.'):
+                continue
+            entry = os.path.join(str(self.dir), name)
+            st = os.stat(entry)
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        entries.sort()
+        while entries and total > self.max_bytes:
+            mtime, size, entry = entries.pop(0)
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                log.debug("Failed to evict %s" % entry, exc_info=True)
+
+
+class CacheWriter(object):
+
+    """
+    Writes an original file to a temporary file in the cache directory,
+    moving it into place once its size and hash have been checked.
+    """
+
+    def __init__(self, cache, original_file, entry):
+        self.cache = cache
+        self.entry = entry
+        self.size = unwrap(original_file.size)
+        self.hash = unwrap(original_file.hash).lower()
+        self.hasher = cache.HASHERS[cache.hasher(original_file)]()
+        fd, self.tmp = tempfile.mkstemp(dir=str(cache.dir), prefix='.')
+        self.file = os.fdopen(fd, 'wb')
+        self.written = 0
+        self.failed = False
+
+    def write(self, data):
+        """Failing to write to the cache does not interrupt the download."""
+        if self.failed:
+            return
+        try:
+            self.file.write(data)
+        except (IOError, OSError):
+            log.warn("Failed to cache %s" % self.hash, exc_info=True)
+            self.abort()
+            return
+        self.hasher.update(data)
+        self.written += len(data)
+
+    def commit(self):
+        if self.failed:
+            return
+        if self.written != self.size or \
+                self.hasher.hexdigest() != self.hash:
+            log.warn("Not caching %s: size or hash mismatch" % self.hash)
+            self.abort()
+            return
+        try:
+            self.file.close()
+            os.chmod(self.tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(self.tmp, self.entry)
+        except (IOError, OSError):
+            log.warn("Failed to cache %s" % self.hash, exc_info=True)
+            self.abort()
+            return
+        self.cache.evict()
+
+    def abort(self):
+        self.failed = True
+        try:
+            self.file.close()
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+        except (IOError, OSError):
+            log.debug("Failed to remove %s" % self.tmp, exc_info=True)
+
+
+class OriginalFileStream(object):
+
+    """
+    Read-only file-like object over the content of an original file. A
+    background thread reads the file from its own raw file store, keeping
+    up to `readahead` blocks ahead of the reader, so that parsing with
+    csv.reader or iterparse proceeds while the data is still arriving.
+    """
+
+    def __init__(self, service_factory, original_file, buffer_size,
+                 readahead, writer=None):
+        self.original_file = original_file
+        self.size = unwrap(original_file.size)
+        self.buffer_size = buffer_size
+        self.writer = writer
+        self.raw_file_store = service_factory.createRawFileStore()
+        self.blocks = Queue(readahead)
+        self.stop = Event()
+        self.error = None
+        self.block = ''
+        self.offset = 0
+        self.eof = False
+        self.thread = Thread(target=self._download,
+                             name="OriginalFile-%d" % original_file.id.val)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, block):
+        while not self.stop.isSet():
+            try:
+                self.blocks.put(block, timeout=0.5)
+                return
+            except Full:
+                pass
+
+    def _download(self):
+        t0 = time.time()
+        writer = self.writer
+        try:
+            self.raw_file_store.setFileId(self.original_file.id.val)
+            position = 0
+            while position < self.size and not self.stop.isSet():
+                length = min(self.buffer_size, self.size - position)
+                data = self.raw_file_store.read(position, length)
+                if not data:
+                    raise IOError("Unexpected end of original file: %d" %
+                                  self.original_file.id.val)
+                position += len(data)
+                if writer is not None:
+                    writer.write(data)
+                self._put(data)
+            if writer is not None:
+                if self.stop.isSet():
+                    writer.abort()
+                else:
+                    writer.commit()
+            log.info("Downloaded original file %d (%d bytes) in %sms" %
+                     (self.original_file.id.val, position,
+                      int((time.time() - t0) * 1000)))
+        except Exception, e:
+            log.exception("Failed to download original file: %d" %
+                          self.original_file.id.val)
+            self.error = e
+            if writer is not None:
+                writer.abort()
+        finally:
+            try:
+                self.raw_file_store.close()
+            finally:
+                self._put(None)
+
+    def _next_block(self):
+        """Returns False once the end of the file has been reached."""
+        if self.eof:
+            return False
+        block = self.blocks.get()
+        if block is None:
+            self.eof = True
+            if self.error is not None:
+                raise IOError("Download of original file %d failed: %s" %
+                              (self.original_file.id.val, self.error))
+            return False
+        self.block = block
+        self.offset = 0
+        return True
+
+    def read(self, size=-1):
+        chunks = list()
+        while size != 0:
+            if self.offset >= len(self.block) and not self._next_block():
+                break
+            end = len(self.block)
+            if size > 0:
+                end = min(end, self.offset + size)
+                size -= end - self.offset
+            chunks.append(self.block[self.offset:end])
+            self.offset = end
+        return ''.join(chunks)
+
+    def readline(self):
+        chunks = list()
+        while True:
+            if self.offset >= len(self.block) and not self._next_block():
+                break
+            i = self.block.find('\n', self.offset)
+            end = i < 0 and len(self.block) or i + 1
+            chunks.append(self.block[self.offset:end])
+            self.offset = end
+            if i >= 0:
+                break
+        return ''.join(chunks)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+class StreamingOriginalFileProvider(object):
+
+    """
+    Provides original file data as OriginalFileStream instances, each
+    reading from a raw file store of its own, or from the local
+    OriginalFileCache if the file has been downloaded before.
+    """
+
+    # Raw file store buffer size
+    BUFFER_SIZE = 1024 * 1024  # 1MB
+
+    # Number of buffers read ahead of the parser
+    READAHEAD = 4
+
+    def __init__(self, service_factory, cache=None, readahead=READAHEAD):
+        self.service_factory = service_factory
+        if cache is None:
+            cache = get_original_file_cache()
+        self.cache = cache
+        self.readahead = readahead
+
+    def get_original_file_data(self, original_file):
+        """
+        Returns an open file-like object on the content of an original file.
+        The caller is responsible for closing it.
+        """
+        data = self.cache.open(original_file)
+        if data is not None:
+            log.info("Using cached original file: %d" % original_file.id.val)
+            return data
+        log.info("Streaming original file: %d" % original_file.id.val)
+        return OriginalFileStream(
+            self.service_factory, original_file, self.BUFFER_SIZE,
+            self.readahead, self.cache.writer(original_file))
+
+
+# Global cache of downloaded original files
+original_file_cache = None
+
+
+def get_original_file_cache():
+    global original_file_cache
+    if original_file_cache is None:
+        original_file_cache = OriginalFileCache()
+    return original_file_cache
+
+
 class AbstractPlateAnalysisCtx(object):
 
     """
@@ -178,7 +572,7 @@ class AbstractPlateAnalysisCtx(object):
     a given Plate.
     """
 
-    DEFAULT_ORIGINAL_FILE_PROVIDER = DownloadingOriginalFileProvider
+    DEFAULT_ORIGINAL_FILE_PROVIDER = StreamingOriginalFileProvider
 
     def __init__(self, images, original_files, original_file_image_map,
                  plate_id, service_factory):
@@ -492,6 +886,7 @@ class PlateAnalysisCtxFactory(object):
             'left outer join fetch img.annotationLinks as ia_links '
             'left outer join fetch ia_links.child as ia '
             'left outer join fetch ia.file as i_o_file '
+            'left outer join fetch i_o_file.hasher '
             'where p.id = %d' % plate_id, None)
         log.debug("Loading plate...")
         plate = self.query_service.findByQuery(
@@ -499,6 +894,7 @@ class PlateAnalysisCtxFactory(object):
             'left outer join fetch p.annotationLinks as pa_links '
             'left outer join fetch pa_links.child as pa '
             'left outer join fetch pa.file as p_o_file '
+            'left outer join fetch p_o_file.hasher '
             'where p.id = %d' % plate_id, None)
         log.debug("Linking plate and images...")
         for image in images:
@@ -594,6 +990,9 @@ class AbstractMeasurementCtx(object):
     # The number of ROI to have parsed before streaming them to the server
     ROI_UPDATE_LIMIT = 1000
 
+    # The number of table rows sent to the server at once
+    TABLE_UPDATE_LIMIT = 100000
+
     def __init__(self, analysis_ctx, service_factory, original_file_provider,
                  original_file, result_files):
         super(AbstractMeasurementCtx, self).__init__()
@@ -672,18 +1071,32 @@ class AbstractMeasurementCtx(object):
         plate_annotation_link = \
             self.update_service.saveAndReturnObject(plate_annotation_link)
         self.file_annotation = plate_annotation_link.child
+        self.write_table(columns)
 
+    def write_table(self, columns):
+        """
+        Initializes the table and adds the column data to it in blocks of
+        TABLE_UPDATE_LIMIT rows.
+        """
         t0 = int(time.time() * 1000)
         self.table.initialize(columns)
         log.debug("Table init took %sms" % (int(time.time() * 1000) - t0))
-        t0 = int(time.time() * 1000)
+        t0 = time.time()
         column_report = dict()
         for column in columns:
             column_report[column.name] = len(column.values)
         log.debug("Column report: %r" % column_report)
-        self.table.addData(columns)
+        n_rows = max(column_report.values() or [0])
+        for start in range(0, n_rows, self.TABLE_UPDATE_LIMIT):
+            end = start + self.TABLE_UPDATE_LIMIT
+            block = list()
+            for column in columns:
+                column = copy.copy(column)
+                column.values = column.values[start:end]
+                block.append(column)
+            self.table.addData(block)
         self.table.close()
-        log.info("Table update took %sms" % (int(time.time() * 1000) - t0))
+        log_throughput("Table update", n_rows, "rows", t0)
 
     def create_file_annotation(self, set_of_columns):
         """
@@ -708,6 +1121,38 @@ class AbstractMeasurementCtx(object):
                  (batch_no, int(time.time() * 1000) - t0))
         batches[batch_no] = roi_ids
 
+    def save_rois(self, rois):
+        """
+        Saves the ROI produced by the iterable rois in batches of
+        ROI_UPDATE_LIMIT, several batches at once on the thread pool, and
+        returns their IDs in order. ROI are created while earlier batches
+        are being saved.
+        """
+        t0 = time.time()
+        batches = dict()
+        batch = list()
+        n_batches = 0
+        for roi in rois:
+            batch.append(roi)
+            if len(batch) == self.ROI_UPDATE_LIMIT:
+                n_batches += 1
+                self.thread_pool.add_task(
+                    self.update_rois, batch, batches, n_batches)
+                batch = list()
+        if batch:
+            n_batches += 1
+            self.thread_pool.add_task(
+                self.update_rois, batch, batches, n_batches)
+        self.thread_pool.wait_completion()
+        roi_ids = list()
+        for batch_no in range(1, n_batches + 1):
+            if batch_no not in batches:
+                raise MeasurementError(
+                    "Failed to save ROI batch %d" % batch_no)
+            roi_ids += batches[batch_no]
+        log_throughput("ROI update", len(roi_ids), "ROI", t0)
+        return roi_ids
+
     def image_from_original_file(self, original_file):
         """Returns the image from which an original file has originated."""
         m = self.analysis_ctx.original_file_image_map
@@ -816,30 +1261,63 @@ class MIASMeasurementCtx(AbstractMeasurementCtx):
     def get_name(self, set_of_columns=None):
         return self.original_file.name.val[:-4]
 
-    def parse(self):
-        columns = None
+    def read_result_files(self):
+        """Yields each result file's image and content."""
         for result_file in self.result_files:
-            log.info("Parsing: %s" % result_file.name.val)
+            log.info("Reading: %s" % result_file.name.val)
             image = self.image_from_original_file(result_file)
             provider = self.original_file_provider
             data = provider.get_original_file_data(result_file)
             try:
-                rows = list(csv.reader(data, delimiter='\t'))
+                yield image, data.read()
             finally:
                 data.close()
-            rows.reverse()
+
+    def parse_result_files(self):
+        """
+        Yields each result file's image and parse_mias_detail() result, in
+        order. With a parse pool, a window of files is parsed by the pool
+        while the next window is being downloaded.
+        """
+        pool = get_parse_pool()
+        files = self.read_result_files()
+        if pool is None:
+            for image, text in files:
+                yield image, parse_mias_detail(text)
+            return
+        window = 2 * len(pool._pool)
+        previous = None
+        while True:
+            current = list(islice(files, window))
+            if current:
+                texts = [text for image, text in current]
+                current = (current, pool.map_async(parse_mias_detail, texts))
+            if previous is not None:
+                chunk, result = previous
+                for (image, text), parsed in zip(chunk, result.get()):
+                    yield image, parsed
+            if not current:
+                break
+            previous = current
+
+    def parse(self):
+        t0 = time.time()
+        n_rows = 0
+        columns = None
+        for image, (width, headers, rows) in self.parse_result_files():
             if columns is None:
-                columns = self.get_empty_columns(len(rows[0]))
+                if not width:
+                    continue
+                columns = self.get_empty_columns(width)
             for row in rows:
-                try:
-                    for i, value in enumerate(row):
-                        value = float(value)
-                        columns[i + 2].values.append(value)
-                    columns[self.IMAGE_COL].values.append(image.id.val)
-                except ValueError:
-                    for i, value in enumerate(row):
-                        columns[i + 2].name = value
-                    break
+                for i, value in enumerate(row):
+                    columns[i + 2].values.append(value)
+                columns[self.IMAGE_COL].values.append(image.id.val)
+            if headers is not None:
+                for i, value in enumerate(headers):
+                    columns[i + 2].name = value
+            n_rows += len(rows)
+        log_throughput("Parsing", n_rows, "rows", t0)
         log.debug("Returning %d columns" % len(columns))
         return MeasurementParsingResult([columns])
 
@@ -847,83 +1325,61 @@ class MIASMeasurementCtx(AbstractMeasurementCtx):
         """Parses out ROI from OmeroTables columns for 'NEO' datasets."""
         log.debug("Parsing %s NEO ROIs..." % (len(columns[0].values)))
         image_ids = columns[self.IMAGE_COL].values
-        rois = list()
         # Save our file annotation to the database so we can use an unloaded
         # annotation for the saveAndReturnIds that will be triggered below.
         self.file_annotation = \
             self.update_service.saveAndReturnObject(self.file_annotation)
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            roi = RoiI()
-            shape = EllipseI()
-            values = columns[6].values
-            diameter = rdouble(float(values[i]))
-            shape.theZ = rint(0)
-            shape.theT = rint(0)
-            values = columns[4].values
-            shape.x = rdouble(float(values[i]))
-            values = columns[3].values
-            shape.y = rdouble(float(values[i]))
-            shape.radiusX = diameter
-            shape.radiusY = diameter
-            roi.addShape(shape)
-            roi.image = unloaded_image
-            roi.linkAnnotation(unloaded_file_annotation)
-            rois.append(roi)
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                self.thread_pool.add_task(
-                    self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        self.thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        self.thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns[self.ROI_COL].values += batches[k]
+
+        def rois():
+            for i, image_id in enumerate(image_ids):
+                unloaded_image = ImageI(image_id, False)
+                roi = RoiI()
+                shape = EllipseI()
+                values = columns[6].values
+                diameter = rdouble(float(values[i]))
+                shape.theZ = rint(0)
+                shape.theT = rint(0)
+                values = columns[4].values
+                shape.x = rdouble(float(values[i]))
+                values = columns[3].values
+                shape.y = rdouble(float(values[i]))
+                shape.radiusX = diameter
+                shape.radiusY = diameter
+                roi.addShape(shape)
+                roi.image = unloaded_image
+                roi.linkAnnotation(unloaded_file_annotation)
+                yield roi
+        columns[self.ROI_COL].values += self.save_rois(rois())
 
     def _parse_mnu_roi(self, columns):
         """Parses out ROI from OmeroTables columns for 'MNU' datasets."""
         log.debug("Parsing %s MNU ROIs..." % (len(columns[0].values)))
         image_ids = columns[self.IMAGE_COL].values
-        rois = list()
         # Save our file annotation to the database so we can use an unloaded
         # annotation for the saveAndReturnIds that will be triggered below.
         self.file_annotation = \
             self.update_service.saveAndReturnObject(self.file_annotation)
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            roi = RoiI()
-            shape = PointI()
-            shape.theZ = rint(0)
-            shape.theT = rint(0)
-            values = columns[3].values
-            shape.x = rdouble(float(values[i]))
-            values = columns[2].values
-            shape.y = rdouble(float(values[i]))
-            roi.addShape(shape)
-            roi.image = unloaded_image
-            roi.linkAnnotation(unloaded_file_annotation)
-            rois.append(roi)
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                self.thread_pool.add_task(
-                    self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        self.thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        self.thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns[self.ROI_COL].values += batches[k]
+
+        def rois():
+            for i, image_id in enumerate(image_ids):
+                unloaded_image = ImageI(image_id, False)
+                roi = RoiI()
+                shape = PointI()
+                shape.theZ = rint(0)
+                shape.theT = rint(0)
+                values = columns[3].values
+                shape.x = rdouble(float(values[i]))
+                values = columns[2].values
+                shape.y = rdouble(float(values[i]))
+                roi.addShape(shape)
+                roi.image = unloaded_image
+                roi.linkAnnotation(unloaded_file_annotation)
+                yield roi
+        columns[self.ROI_COL].values += self.save_rois(rois())
 
     def parse_and_populate_roi(self, columns):
         names = [column.name for column in columns]
@@ -999,6 +1455,7 @@ class FlexMeasurementCtx(AbstractMeasurementCtx):
 
     def parse(self):
         log.info("Parsing: %s" % self.original_file.name.val)
+        t0 = time.time()
         provider = self.original_file_provider
         data = provider.get_original_file_data(self.original_file)
         try:
@@ -1037,6 +1494,7 @@ class FlexMeasurementCtx(AbstractMeasurementCtx):
                 for result in results:
                     name = result.get('name')
                     columns[name].values.append(float(result.text))
+        log_throughput("Parsing", len(columns['Well'].values), "wells", t0)
         return MeasurementParsingResult([columns.values()])
 
     def parse_and_populate_roi(self, columns):
@@ -1112,6 +1570,7 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
 
     def parse(self):
         log.info("Parsing: %s" % self.original_file.name.val)
+        t0 = time.time()
         provider = self.original_file_provider
         data = provider.get_original_file_data(self.original_file)
         try:
@@ -1187,6 +1646,7 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
             self.check_sparse_data(organelles_columns.values())
             log.info("Total ROI: %d" % n_roi)
             log.info("Total measurements: %d" % n_measurements)
+            log_throughput("Parsing", n_measurements, "measurements", t0)
             sets_of_columns = [cells_columns.values(), nuclei_columns.values(),
                                organelles_columns.values()]
             return MeasurementParsingResult(sets_of_columns)
@@ -1211,7 +1671,6 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
         for column in columns_as_list:
             columns[column.name] = column
         image_ids = columns['Image'].values
-        rois = list()
         # Save our file annotation to the database so we can use an unloaded
         # annotation for the saveAndReturnIds that will be triggered below.
         self.file_annotation = \
@@ -1219,54 +1678,37 @@ class InCellMeasurementCtx(AbstractMeasurementCtx):
         unloaded_file_annotation = \
             FileAnnotationI(self.file_annotation.id.val, False)
         # Parse and append ROI
-        batch_no = 1
-        batches = dict()
-        for i, image_id in enumerate(image_ids):
-            unloaded_image = ImageI(image_id, False)
-            if False in nuclei_expected:
-                # Cell centre of gravity
-                roi = RoiI()
-                shape = PointI()
-                shape.theZ = rint(0)
-                shape.theT = rint(0)
-                shape.x = rdouble(float(columns['Cell: cgX'].values[i]))
-                shape.y = rdouble(float(columns['Cell: cgY'].values[i]))
-                roi.addShape(shape)
-                roi.image = unloaded_image
-                roi.linkAnnotation(unloaded_file_annotation)
-                rois.append(roi)
-            elif False in cells_expected:
-                # Nucleus centre of gravity
+        if False in nuclei_expected:
+            # Cell centre of gravity
+            x, y = columns['Cell: cgX'].values, columns['Cell: cgY'].values
+        elif False in cells_expected:
+            # Nucleus centre of gravity
+            x = columns['Nucleus: cgX'].values
+            y = columns['Nucleus: cgY'].values
+        else:
+            raise MeasurementError('Not a nucleus or cell ROI')
+
+        def rois():
+            for i, image_id in enumerate(image_ids):
+                unloaded_image = ImageI(image_id, False)
                 roi = RoiI()
                 shape = PointI()
                 shape.theZ = rint(0)
                 shape.theT = rint(0)
-                shape.x = rdouble(float(columns['Nucleus: cgX'].values[i]))
-                shape.y = rdouble(float(columns['Nucleus: cgY'].values[i]))
+                shape.x = rdouble(float(x[i]))
+                shape.y = rdouble(float(y[i]))
                 roi.addShape(shape)
                 roi.image = unloaded_image
                 roi.linkAnnotation(unloaded_file_annotation)
-                rois.append(roi)
-            else:
-                raise MeasurementError('Not a nucleus or cell ROI')
-            if len(rois) == self.ROI_UPDATE_LIMIT:
-                self.thread_pool.add_task(
-                    self.update_rois, rois, batches, batch_no)
-                rois = list()
-                batch_no += 1
-        self.thread_pool.add_task(self.update_rois, rois, batches, batch_no)
-        self.thread_pool.wait_completion()
-        batch_keys = batches.keys()
-        batch_keys.sort()
-        for k in batch_keys:
-            columns['ROI'].values += batches[k]
+                yield roi
+        columns['ROI'].values += self.save_rois(rois())
 
     def populate(self, columns):
         self.update_table(columns)
 
 if __name__ == "__main__":
     try:
-        options, args = getopt(sys.argv[1:], "s:p:u:m:k:t:id")
+        options, args = getopt(sys.argv[1:], "s:p:u:m:k:t:w:c:id")
     except GetoptError, (msg, opt):
         usage(msg)
 
@@ -1283,7 +1725,7 @@ if __name__ == "__main__":
     info = False
     session_key = None
     logging_level = logging.INFO
-    thread_count = 1
+    thread_count = default_worker_count()
     for option, argument in options:
         if option == "-u":
             username = argument
@@ -1301,6 +1743,11 @@ if __name__ == "__main__":
             logging_level = logging.DEBUG
         if option == "-t":
             thread_count = int(argument)
+        if option == "-w":
+            parse_process_count = int(argument)
+        if option == "-c":
+            original_file_cache = OriginalFileCache(
+                int(argument) * 1024 * 1024)
     if session_key is None and username is None:
         usage("Username must be specified!")
     if session_key is None and hostname is None:
@@ -23,6 +23,9 @@ Utility methods for manipulating roi.
 """
 
 from numpy import asarray, int32, math, zeros, hstack, vstack
+from numpy import add, arange, concatenate, cumsum, float64, fromstring
+from numpy import maximum, minimum, where
+from omero.rtypes import rstring
 import omero.util.script_utils as script_utils
 
 
@@ -124,23 +127,157 @@ def get_line_data(pixels, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0):
     return asarray(cropped)
 
 
-def points_string_to_xy_list(string):
+def points_string_to_array(string):
     """
     Method for converting the string returned from
-    omero.model.ShapeI.getPoints() into list of (x,y) points (floats)
-    e.g. "points[309,427, 366,503, 190,491]"
+    omero.model.ShapeI.getPoints() into an N x 2 array of (x,y) points
+    (floats), parsed in a single pass by NumPy.
+    e.g. "309,427 366,503 190,491" or "points[309,427, 366,503, 190,491]"
     """
     point_lists = string.strip().split("points")
     if len(point_lists) < 2:
         if len(point_lists) == 1 and point_lists[0]:
-            xys = point_lists[0].split()
-            xy_list = [tuple(map(float, xy.split(','))) for xy in xys]
-            return xy_list
+            xys = point_lists[0]
+        else:
+            raise ValueError(
+                "Unrecognised ROI shape 'points' string: %s" % string)
+    else:
+        xys = point_lists[1].strip(" []")
+    xys = xys.replace(",", " ")
+    values = fromstring(xys, dtype=float64, sep=" ")
+    if len(values) % 2 or len(values) != len(xys.split()):
         raise ValueError("Unrecognised ROI shape 'points' string: %s" % string)
+    return values.reshape(-1, 2)
+
+
+def array_to_points_string(points):
+    """
+    Method for converting an N x 2 array of (x,y) points into a string
+    for omero.model.ShapeI.setPoints(), e.g. "309,427 366,503 190,491".
+    Integer arrays are formatted without a decimal point.
+    """
+    points = asarray(points)
+    if points.dtype.kind in "biu":
+        # %r would add an L suffix to longs, e.g. for uint64 values
+        fmt = "%d,%d "
+    else:
+        points = points.astype(float64)
+        fmt = "%r,%r "
+    values = points.ravel().tolist()
+    return (fmt * (len(values) // 2))[:-1] % tuple(values)
+
+
+def points_string_to_xy_list(string):
+    """
+    Method for converting the string returned from
+    omero.model.ShapeI.getPoints() into list of (x,y) points (floats)
+    e.g. "points[309,427, 366,503, 190,491]"
+    """
+    return map(tuple, points_string_to_array(string).tolist())
+
+
+def shapes_to_arrays(shapes):
+    """
+    Converts omero.model Polygon or Polyline shapes into a list of
+    N x 2 arrays of their points.
+    """
+    return [points_string_to_array(shape.getPoints().getValue())
+            for shape in shapes]
+
+
+def arrays_to_shapes(arrays, shape_class=None):
+    """
+    Creates an omero.model shape, by default a Polygon, with the points of
+    each N x 2 array.
+    """
+    if shape_class is None:
+        from omero.model import PolygonI
+        shape_class = PolygonI
+    shapes = []
+    for points in arrays:
+        shape = shape_class()
+        shape.setPoints(rstring(array_to_points_string(points)))
+        shapes.append(shape)
+    return shapes
 
-    first_list = point_lists[1]
-    xy_list = []
-    for xy in first_list.strip(" []").split(", "):
-        x, y = xy.split(",")
-        xy_list.append((float(x.strip()), float(y.strip())))
-    return xy_list
+
+def pack_arrays(arrays):
+    """
+    Concatenates a list of N x 2 arrays of points so that whole sets of
+    shapes can be processed at once. Returns the M x 2 array of all points
+    and the offsets of the first point of each shape, followed by M.
+    """
+    lengths = [len(points) for points in arrays]
+    offsets = concatenate(([0], cumsum(lengths))).astype(int)
+    if not arrays:
+        return zeros((0, 2)), offsets
+    return concatenate(arrays).reshape(-1, 2).astype(float64), offsets
+
+
+def _shoelace(points, offsets):
+    """
+    Returns the terms x[i] * y[i+1] - x[i+1] * y[i] of every point with the
+    next point of the same shape, wrapping around to its first point.
+    """
+    nxt = arange(1, len(points) + 1)
+    ends = offsets[1:] - 1
+    nonempty = offsets[1:] > offsets[:-1]
+    nxt[ends[nonempty]] = offsets[:-1][nonempty]
+    x, y = points[:, 0], points[:, 1]
+    return nxt, x * y[nxt] - x[nxt] * y
+
+
+def _reduce(ufunc, values, offsets):
+    """
+    Applies ufunc.reduceat to values for each shape, with 0 for shapes
+    without any points.
+    """
+    nonempty = offsets[1:] > offsets[:-1]
+    rv = zeros(len(offsets) - 1)
+    if nonempty.any():
+        rv[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+    return rv
+
+
+def polygon_areas(points, offsets):
+    """
+    Returns the area of each polygon of the packed points (see
+    pack_arrays) using the shoelace formula.
+    """
+    nxt, cross = _shoelace(points, offsets)
+    return abs(_reduce(add, cross, offsets)) / 2
+
+
+def polygon_centroids(points, offsets):
+    """
+    Returns a K x 2 array of the centroids of the polygons of the packed
+    points (see pack_arrays). The centroid of a polygon without area is the
+    mean of its points.
+    """
+    nxt, cross = _shoelace(points, offsets)
+    x, y = points[:, 0], points[:, 1]
+    area6 = _reduce(add, cross, offsets) * 3
+    cx = _reduce(add, (x + x[nxt]) * cross, offsets)
+    cy = _reduce(add, (y + y[nxt]) * cross, offsets)
+    counts = (offsets[1:] - offsets[:-1]).clip(1)
+    mx = _reduce(add, x, offsets) / counts
+    my = _reduce(add, y, offsets) / counts
+    flat = area6 == 0
+    area6[flat] = 1
+    rv = zeros((len(counts), 2))
+    rv[:, 0] = where(flat, mx, cx / area6)
+    rv[:, 1] = where(flat, my, cy / area6)
+    return rv
+
+
+def bounding_boxes(points, offsets):
+    """
+    Returns a K x 4 array of the bounding boxes (x,y,w,h) of the shapes of
+    the packed points (see pack_arrays).
+    """
+    x, y = points[:, 0], points[:, 1]
+    x0 = _reduce(minimum, x, offsets)
+    y0 = _reduce(minimum, y, offsets)
+    x1 = _reduce(maximum, x, offsets)
+    y1 = _reduce(maximum, y, offsets)
+    return vstack((x0, y0, x1 - x0, y1 - y0)).T
@@ -26,7 +26,9 @@ Library for managing user sessions.
 import omero.constants
 from omero.util import get_omero_userdir, make_logname
 from omero.rtypes import rlong
+from omero_ext import portalocker
 from path import path
+from contextlib import contextmanager
 
 try:
     from urllib.parse import quote, unquote
@@ -34,6 +36,7 @@ except ImportError:
     # Python2
     from urllib import quote, unquote
 
+import json
 import logging
 
 """
@@ -58,6 +61,17 @@ def _escape_host(host):
     return quote(host, safe='')
 
 
+def _to_str(obj):
+    """
+    Converts the unicode strings returned by json.loads back to str
+    """
+    if isinstance(obj, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in obj.items())
+    elif isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    return obj
+
+
 class SessionsStore(object):
 
     """
@@ -66,8 +80,18 @@ class SessionsStore(object):
     repository path.
 
     Use add() to add items to the repository
+
+    A JSON index of all sessions and their properties is kept
+    in the "._INDEX_" file and updated by add() and remove() so that
+    contents(), count() and walk() do not need to visit every file. The
+    index also records the modification time of every user directory so
+    that session files added or removed by other means are noticed. If the
+    index is missing, unreadable or out of date it is rebuilt from the
+    directory tree.
     """
 
+    INDEX_VERSION = 2
+
     def __init__(self, dir=None):
         """
         """
@@ -118,7 +142,11 @@ class SessionsStore(object):
         if not dhn.exists():
             dhn.makedirs()
 
-        (dhn / id).write_lines(lines)
+        def update(index):
+            (dhn / id).write_lines(lines)
+            index.setdefault(_escape_host(host), {}).setdefault(
+                name, {})[id] = dict((k, "%s" % v) for k, v in props.items())
+        self._update_index(update)
 
     def conflicts(self, host, name, id, new_props, ignore_nulls=False,
                   check_group=True):
@@ -163,11 +191,11 @@ class SessionsStore(object):
         if d.exists():
             f = d / uuid
             if f.exists():
-                f.remove()
+                self._remove_file(f)
                 self.logger.debug("Removed %s" % f)
             s = self.sess_file(host, name)
             if s and s.exists() and s.text().strip() == uuid:
-                s.remove()
+                self._update_dot_file(host, name, s.remove)
                 self.logger.debug("Removed %s" % s)
 
     def exists(self, host, name, uuid):
@@ -192,10 +220,8 @@ class SessionsStore(object):
         Returns the path to property files which are stored.
         Internal accounting files are not returned.
         """
-        d = self.dir / _escape_host(host) / name
-        if not d.exists():
-            return []
-        return [x.basename() for x in self.non_dot(d)]
+        sessions = self.index().get(_escape_host(host), {}).get(name, {})
+        return [path(x) for x in sessions]
 
     def set_current(self, host, name=None, uuid=None, props=None):
         """
@@ -210,7 +236,8 @@ class SessionsStore(object):
         if name is not None:
             self.user_file(host).write_text(name)
             if uuid is not None:
-                self.sess_file(host, name).write_text(uuid)
+                s = self.sess_file(host, name)
+                self._update_dot_file(host, name, lambda: s.write_text(uuid))
 
     def get_current(self):
         host = None
@@ -287,20 +314,15 @@ class SessionsStore(object):
         skipped.
         """
         rv = {}
-        Dhosts = self.dir.dirs()
-        for Dhost in Dhosts:
-            host = unquote(str(Dhost.basename()))
+        for host, names in self.index().items():
+            host = unquote(host)
             if host not in rv:
                 rv[host] = {}
-            Dnames = Dhost.dirs()
-            for Dname in Dnames:
-                name = str(Dname.basename())
+            for name, ids in names.items():
                 if name not in rv[host]:
                     rv[host][name] = {}
-                Dids = self.non_dot(Dname)
-                for Did in Dids:
-                    id = str(Did.basename())
-                    props = self.props(Did)
+                for id, props in ids.items():
+                    props = dict(props)
                     props["active"] = "unknown"
                     rv[host][name][id] = props
         return rv
@@ -319,13 +341,134 @@ class SessionsStore(object):
         """
         Applies func to all host, name, and session path-objects.
         """
+        for hS, names in sorted(self.index().items()):
+            if host is None or hS == host:
+                h = self.dir / hS
+                for nS, ids in sorted(names.items()):
+                    if name is None or nS == name:
+                        n = h / nS
+                        for sS in sorted(ids):
+                            if sess is None or sS == sess:
+                                func(h, n, n / sS)
+
+    #
+    # Index methods
+    #
+
+    def index(self):
+        """
+        Returns the session index: a map from escaped host to user name to
+        session uuid to the stored properties. The index is rebuilt from the
+        directory tree if necessary.
+        """
+        index = self._read_index()
+        if index is None:
+            index = self.rebuild_index()
+        return index
+
+    def rebuild_index(self):
+        """
+        Scans the directory tree and replaces the index with its contents
+        """
+        with self._index_lock():
+            index = self._scan_tree()
+            self._write_index(index)
+        return index
+
+    def _scan_tree(self):
+        index = {}
+        for h in self.dir.dirs():
+            names = index.setdefault(str(h.basename()), {})
+            for n in h.dirs():
+                ids = names.setdefault(str(n.basename()), {})
+                for s in self.non_dot(n):
+                    ids[str(s.basename())] = self.props(s)
+        return index
+
+    def _stamp(self):
+        """
+        Returns the modification time of every host/user directory. Adding
+        or removing a session file changes the time of its directory and
+        adding or removing a directory changes the keys.
+        """
+        stamp = {}
         for h in self.dir.dirs():
-            if host is None or str(h.basename()) == host:
-                for n in h.dirs():
-                    if name is None or str(n.basename()) == name:
-                        for s in self.non_dot(n):
-                            if sess is None or str(s.basename()) == sess:
-                                func(h, n, s)
+            for n in h.dirs():
+                stamp["%s/%s" % (h.basename(), n.basename())] = n.mtime
+        return stamp
+
+    def _read_index(self):
+        try:
+            data = json.loads(self.index_file().text())
+            if data["version"] != self.INDEX_VERSION:
+                self.logger.debug("Old session index version")
+            elif _to_str(data["stamp"]) != self._stamp():
+                self.logger.debug("Session index is out of date")
+            else:
+                return _to_str(data["sessions"])
+        except (IOError, OSError, ValueError, KeyError, TypeError), e:
+            self.logger.debug("Unusable session index: %s" % e)
+        return None
+
+    def _write_index(self, index):
+        """
+        Writes the index to a temporary file which is then renamed so
+        that readers never see a partially written index.
+        """
+        f = self.index_file()
+        tmp = f + ".tmp"
+        tmp.write_text(json.dumps(
+            {"version": self.INDEX_VERSION, "stamp": self._stamp(),
+             "sessions": index}))
+        tmp.rename(f)
+
+    def _update_index(self, func):
+        """
+        Applies func to the index while holding the index lock and
+        then writes the index back.
+        """
+        with self._index_lock():
+            index = self._read_index()
+            if index is None:
+                index = self._scan_tree()
+            func(index)
+            self._write_index(index)
+
+    @contextmanager
+    def _index_lock(self):
+        lock = open(self.index_file() + ".lock", "a")
+        try:
+            portalocker.lock(lock, portalocker.LOCK_EX)
+            yield
+        finally:
+            lock.close()
+
+    def _update_dot_file(self, host, name, func):
+        """
+        Applies func, which writes or removes a dot file in the directory
+        of host and name, while holding the index lock. Dot files are not
+        indexed but change the modification time of the directory, so a
+        valid index is stamped again afterwards.
+        """
+        with self._index_lock():
+            index = self._read_index()
+            func()
+            if index is not None:
+                index.setdefault(_escape_host(host), {}).setdefault(name, {})
+                self._write_index(index)
+
+    def _remove_file(self, s):
+        """
+        Removes the session file s and its entry in the index
+        """
+        def update(index):
+            if s.exists():
+                s.remove()
+            n = s.parent
+            h = n.parent
+            ids = index.get(str(h.basename()), {}).get(str(n.basename()), {})
+            ids.pop(str(s.basename()), None)
+        self._update_index(update)
 
     #
     # Server-requiring methods
@@ -430,7 +573,7 @@ class SessionsStore(object):
                 client.killSession()
             except Exception, e:
                 self.logger.debug("Exception on killSession: %s" % e)
-            s.remove()
+            self._remove_file(s)
             removed.append(s)
         self.walk(f, host, name, sess)
         return removed
@@ -447,6 +590,10 @@ class SessionsStore(object):
         """ Returns the path-object which stores the last active port """
         return self.dir / "._LASTPORT_"
 
+    def index_file(self):
+        """ Returns the path-object which stores the session index """
+        return self.dir / "._INDEX_"
+
     def user_file(self, host):
         """ Returns the path-object which stores the last active user """
         d = self.dir / _escape_host(host)
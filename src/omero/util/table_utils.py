@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2026 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Client-side helpers for OMERO.tables
+
+Unlike omero.tables these do not require PyTables to be installed.
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+import zipfile
+
+from collections import OrderedDict
+from Queue import Queue
+
+import omero
+import omero.cmd
+import omero.grid
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+try:
+    import pandas
+    has_pandas = True
+except ImportError:
+    has_pandas = False
+
+
+log = logging.getLogger("omero.util.table_utils")
+
+
+# Call context key which makes the Tables server export the result of
+# Table.read() to a new OriginalFile instead of returning the values
+EXPORT = "omero.tables.export"
+
+
+def export_table(table, fmt="npy", colNumbers=None, start=0, stop=0):
+    """
+    Asks the Tables server to write the given columns (default: all) and
+    rows [start, stop) of table into a new OriginalFile in the format
+    "npy", "arrow" or "parquet". Returns the id of the new file.
+    """
+    if colNumbers is None:
+        colNumbers = []
+    if start == 0 and stop == 0:
+        stop = table.getNumberOfRows()
+    data = table.read(colNumbers, start, stop, {EXPORT: fmt})
+    return data.columns[0].values[0]
+
+
+def load_export(client, file_id, fmt="npy", target_dir=None):
+    """
+    Downloads an exported table into target_dir (default: a new temporary
+    directory which the caller is responsible for removing) and maps it
+    into memory.
+
+    For "npy" an OrderedDict of column name to read-only memory-mapped
+    numpy array is returned, for "arrow" and "parquet" a pyarrow.Table
+    which can be converted with to_pandas(). Mask bytes are returned as
+    "column/bytes" and, for "npy", "column/bytes_offsets" from which the
+    bytes of row i are bytes[offsets[i]:offsets[i + 1]].
+    """
+    if target_dir is None:
+        target_dir = tempfile.mkdtemp(prefix="omero_table_")
+    target = os.path.join(target_dir, "%s.%s" % (file_id, fmt))
+    client.download(omero.model.OriginalFileI(file_id, False), target)
+
+    if fmt == "npy":
+        columns = OrderedDict()
+        with zipfile.ZipFile(target) as zf:
+            names = zf.namelist()
+            zf.extractall(target_dir)
+        os.remove(target)
+        for name in names:
+            columns[name[:-len(".npy")]] = numpy.load(
+                os.path.join(target_dir, name), mmap_mode="r")
+        return columns
+
+    import pyarrow
+    if fmt == "arrow":
+        reader = pyarrow.RecordBatchFileReader(pyarrow.memory_map(target))
+        return reader.read_all()
+    elif fmt == "parquet":
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(target, memory_map=True)
+    raise omero.ClientError("Unknown export format: %s" % fmt)
+
+
+def download_table(client, file_id, fmt="npy", target_dir=None, **kwargs):
+    """
+    Exports the table stored in the OriginalFile file_id and loads it with
+    load_export(). kwargs are passed to export_table().
+    """
+    resources = client.sf.sharedResources()
+    table = resources.openTable(
+        omero.model.OriginalFileI(file_id, False), client.getContext(
+            group=-1))
+    if table is None:
+        raise omero.ClientError("Cannot open table %s" % file_id)
+    try:
+        export_id = export_table(table, fmt, **kwargs)
+    finally:
+        table.close()
+    try:
+        return load_export(client, export_id, fmt, target_dir)
+    finally:
+        delete = omero.cmd.Delete2(
+            targetObjects={"OriginalFile": [export_id]})
+        client.submit(delete, ctx=client.getContext(group=-1)).close(True)
+
+
+# Target size of each read() or addData() call. Large enough to amortize the
+# round trip, small enough to stay well below Ice.MessageSizeMax
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Estimated size of a mask's bytes, which are stored outside the main table
+MASK_BYTES = 1024
+
+# Fields of a MaskColumn, see omero.columns.MaskColumnI
+MASK_FIELDS = (("imageId", "i", "int64"), ("theZ", "z", "int32"),
+               ("theT", "t", "int32"), ("x", "x", "float64"),
+               ("y", "y", "float64"), ("w", "w", "float64"),
+               ("h", "h", "float64"))
+
+# Scalar column types and the numpy dtype of their values
+SCALAR_DTYPES = (
+    (omero.grid.BoolColumn, "bool"),
+    (omero.grid.DoubleColumn, "float64"),
+    (omero.grid.LongColumn, "int64"),
+    (omero.grid.FileColumn, "int64"),
+    (omero.grid.ImageColumn, "int64"),
+    (omero.grid.RoiColumn, "int64"),
+    (omero.grid.WellColumn, "int64"),
+    (omero.grid.PlateColumn, "int64"),
+    (omero.grid.DatasetColumn, "int64"),
+)
+
+ARRAY_DTYPES = (
+    (omero.grid.FloatArrayColumn, "float32"),
+    (omero.grid.DoubleArrayColumn, "float64"),
+    (omero.grid.LongArrayColumn, "int64"),
+)
+
+
+def column_dtype(col):
+    """
+    Returns the numpy dtype for the values of the given column header. Array
+    columns have a sub-array dtype, masks a structured dtype of the fields
+    in MASK_FIELDS plus an object field holding the mask bytes.
+    """
+    for kls, dtype in SCALAR_DTYPES:
+        if isinstance(col, kls):
+            return numpy.dtype(dtype)
+    for kls, dtype in ARRAY_DTYPES:
+        if isinstance(col, kls):
+            return numpy.dtype((dtype, (max(col.size, 1),)))
+    if isinstance(col, omero.grid.StringColumn):
+        # Variable-length and dictionary encoded columns have no size
+        if col.size < 1:
+            return numpy.dtype(object)
+        return numpy.dtype("S%d" % col.size)
+    if isinstance(col, omero.grid.MaskColumn):
+        return numpy.dtype([(f, t) for a, f, t in MASK_FIELDS] +
+                           [("bytes", object)])
+    raise omero.ClientError("Unknown column type: %s" % type(col))
+
+
+def row_bytes(headers):
+    """
+    Estimates the number of bytes per row for the given column headers
+    """
+    total = 0
+    for col in headers:
+        total += column_dtype(col).itemsize
+        if isinstance(col, omero.grid.MaskColumn):
+            total += MASK_BYTES
+    return max(total, 1)
+
+
+def column_values(col, dtype):
+    """
+    Converts the values of a column returned by Table.read() into a numpy
+    array of the given dtype
+    """
+    if isinstance(col, omero.grid.MaskColumn):
+        arr = numpy.empty(len(col.imageId), dtype=dtype)
+        for attr, field, t in MASK_FIELDS:
+            arr[field] = getattr(col, attr)
+        arr["bytes"] = col.bytes
+        return arr
+    if dtype.subdtype:
+        base, shape = dtype.subdtype
+        return numpy.array(col.values, dtype=base).reshape((-1,) + shape)
+    return numpy.array(col.values, dtype=dtype)
+
+
+def read_table(table, colNumbers=None, start=0, stop=None,
+               chunk_bytes=DEFAULT_CHUNK_BYTES, tables=None):
+    """
+    Reads rows [start, stop) of the given columns (default: all) of an
+    omero.grid.Table into an OrderedDict of column name to numpy array.
+
+    Rows are requested in chunks of roughly chunk_bytes. The chunk size is
+    adapted to the measured size of the rows that have been read so far.
+    If tables contains further proxies for the same table, e.g. from
+    open_tables(), the chunks are read in parallel with one thread per
+    proxy.
+    """
+    if not has_numpy:
+        raise ImportError("numpy is required")
+    headers = table.getHeaders()
+    if not colNumbers:
+        colNumbers = range(len(headers))
+    if stop is None:
+        stop = table.getNumberOfRows()
+    headers = [headers[i] for i in colNumbers]
+    dtypes = [column_dtype(h) for h in headers]
+    n = max(stop - start, 0)
+    columns = OrderedDict(
+        (h.name, numpy.empty(n, dtype=d)) for h, d in zip(headers, dtypes))
+    reader = _ChunkReader(columns, dtypes, colNumbers, start)
+
+    estimate = row_bytes(headers)
+    rows = max(int(chunk_bytes // estimate), 1)
+    begin = time.time()
+    offset = start
+    if offset < stop:
+        # The first chunk calibrates the size of the following ones
+        first = min(offset + rows, stop)
+        nbytes = reader.read(table, offset, first)
+        rows = max(int(chunk_bytes * (first - offset) // max(nbytes, 1)), 1)
+        offset = first
+
+    if not tables:
+        while offset < stop:
+            end = min(offset + rows, stop)
+            nbytes = reader.read(table, offset, end)
+            rows = max(int(chunk_bytes * (end - offset) // max(nbytes, 1)), 1)
+            offset = end
+    else:
+        queue = Queue()
+        for chunk_start in range(offset, stop, rows):
+            queue.put((chunk_start, min(chunk_start + rows, stop)))
+        threads = [threading.Thread(target=reader.worker, args=(prx, queue))
+                   for prx in [table] + list(tables)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if reader.errors:
+            raise reader.errors[0]
+
+    elapsed = time.time() - begin
+    log.debug("Read %s rows (%s bytes) in %.2fs", n, reader.nbytes, elapsed)
+    return columns
+
+
+class _ChunkReader(object):
+    """
+    Copies chunks returned by Table.read() into the preallocated arrays
+    """
+
+    def __init__(self, columns, dtypes, colNumbers, start):
+        self.arrays = columns.values()
+        self.dtypes = dtypes
+        self.colNumbers = colNumbers
+        self.start = start
+        self.nbytes = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def read(self, table, begin, end):
+        data = table.read(self.colNumbers, begin, end)
+        nbytes = 0
+        for arr, dtype, col in zip(self.arrays, self.dtypes, data.columns):
+            values = column_values(col, dtype)
+            arr[begin - self.start:end - self.start] = values
+            nbytes += values.nbytes
+            if isinstance(col, omero.grid.MaskColumn):
+                nbytes += sum(len(b) for b in col.bytes)
+        with self._lock:
+            self.nbytes += nbytes
+        return nbytes
+
+    def worker(self, table, queue):
+        while not queue.empty():
+            try:
+                begin, end = queue.get_nowait()
+            except Exception:
+                return
+            try:
+                self.read(table, begin, end)
+            except Exception, e:
+                with self._lock:
+                    self.errors.append(e)
+                return
+
+
+def open_tables(client, file_id, count):
+    """
+    Opens count proxies for the table stored in the OriginalFile file_id
+    for use with read_table(). The caller must close them.
+    """
+    resources = client.sf.sharedResources()
+    ofile = omero.model.OriginalFileI(file_id, False)
+    rv = []
+    for i in range(count):
+        table = resources.openTable(ofile, client.getContext(group=-1))
+        if table is None:
+            for t in rv:
+                t.close()
+            raise omero.ClientError("Cannot open table %s" % file_id)
+        rv.append(table)
+    return rv
+
+
+def to_dataframe(columns):
+    """
+    Converts the result of read_table() into a pandas.DataFrame. Array
+    columns hold one numpy array per row and masks are split into one
+    column per field named "column/field".
+    """
+    if not has_pandas:
+        raise ImportError("pandas is required")
+    data = OrderedDict()
+    for name, arr in columns.items():
+        if arr.dtype.names:
+            for field in arr.dtype.names:
+                data["%s/%s" % (name, field)] = arr[field]
+        elif arr.ndim > 1:
+            data[name] = list(arr)
+        else:
+            data[name] = arr
+    return pandas.DataFrame(data, columns=data.keys())
+
+
+def dataframe_columns(df):
+    """
+    Returns empty omero.grid columns matching the dtypes of a DataFrame
+    """
+    cols = []
+    for name in df.columns:
+        series = df[name]
+        kind = series.dtype.kind
+        name = str(name)
+        if kind == "b":
+            cols.append(omero.grid.BoolColumn(name, "", []))
+        elif kind in "iu":
+            cols.append(omero.grid.LongColumn(name, "", []))
+        elif kind == "f":
+            cols.append(omero.grid.DoubleColumn(name, "", []))
+        elif kind in "OSU":
+            values = series.astype(str)
+            size = max(int(values.str.len().max() or 0), 1)
+            cols.append(omero.grid.StringColumn(name, "", size, []))
+        else:
+            raise omero.ClientError(
+                "Unsupported dtype %s for column %s" % (series.dtype, name))
+    return cols
+
+
+def write_dataframe(table, df, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                    initialize=True):
+    """
+    Writes a pandas.DataFrame to an omero.grid.Table. If initialize is
+    True, the table is initialized with columns matching the dtypes of
+    the DataFrame, otherwise the rows are appended to the existing
+    columns. Rows are sent with addData() in batches of roughly
+    chunk_bytes. Returns the number of rows written.
+    """
+    if not has_pandas:
+        raise ImportError("pandas is required")
+    cols = dataframe_columns(df)
+    if initialize:
+        table.initialize(cols)
+    else:
+        cols = table.getHeaders()
+
+    values = []
+    for col, name in zip(cols, df.columns):
+        series = df[name]
+        if isinstance(col, omero.grid.StringColumn):
+            values.append(series.astype(str).values)
+        elif isinstance(col, omero.grid.BoolColumn):
+            values.append(series.values.astype(bool))
+        elif isinstance(col, omero.grid.DoubleColumn):
+            values.append(series.values.astype("float64"))
+        else:
+            values.append(series.values.astype("int64"))
+
+    rows = max(int(chunk_bytes // row_bytes(cols)), 1)
+    total = len(df)
+    begin = time.time()
+    for offset in range(0, total, rows):
+        for col, arr in zip(cols, values):
+            col.values = arr[offset:offset + rows].tolist()
+        table.addData(cols)
+    log.debug("Wrote %s rows in %.2fs", total, time.time() - begin)
+    return total
@@ -7,6 +7,13 @@
 
 """
 
+import time
+import logging
+import threading
+import Queue
+
+logger = logging.getLogger("omero.util.tiles")
+
 
 class TileLoopIteration(object):
     """
@@ -170,7 +177,8 @@ class RPSTileLoop(TileLoop):
         rps.setPixelsId(self.getPixels().getId().getValue(), False)
         return data
 
-    def forEachTile(self, tileWidth, tileHeight, iteration):
+    def forEachTile(self, tileWidth, tileHeight, iteration, workers=1,
+                    callback=None, ordered=True, maxInFlight=None):
         """
         Iterates over every tile in a given Pixels object based on the
         over arching dimensions and a requested maximum tile width and height.
@@ -181,6 +189,11 @@ class RPSTileLoop(TileLoop):
         The tile request itself will be smaller if
         <code>y + tileHeight > sizeY</code>.
         :param iteration: Invoker to call for each tile.
+        :param workers: Number of RawPixelsStore instances used at once.
+        If more than one, see {@link ParallelTileLoop}.
+        :param callback: Called with each tile and its iteration result.
+        :param ordered: Whether callback is called in tile order.
+        :param maxInFlight: Maximum number of tiles being processed.
         @return The total number of tiles iterated over.
         """
 
@@ -202,6 +215,279 @@ class RPSTileLoop(TileLoop):
         sizeC = self.pixels.getSizeC().getValue()
         sizeT = self.pixels.getSizeT().getValue()
 
+        if workers > 1 or callback is not None:
+            parallel = ParallelTileLoop(self, workers, maxInFlight)
+            return parallel.forEachTile(
+                sizeX, sizeY, sizeZ, sizeC, sizeT,
+                tileWidth, tileHeight, iteration, callback, ordered)
+
         return TileLoop.forEachTile(
             self, sizeX, sizeY, sizeZ, sizeC, sizeT,
             tileWidth, tileHeight, iteration)
+
+
+def tile_index(sizeX, sizeY, sizeZ, sizeC, sizeT, tileWidth, tileHeight):
+    """
+    Returns every tile of the given dimensions as a numpy array with
+    one row (z, c, t, x, y, w, h) per tile, in the order used by
+    TileLoop.forEachTile: T, then C, then Z, then tile rows and columns.
+    """
+    import numpy
+    t, c, z, y, x = [a.ravel() for a in numpy.meshgrid(
+        numpy.arange(sizeT), numpy.arange(sizeC), numpy.arange(sizeZ),
+        numpy.arange(0, sizeY, tileHeight), numpy.arange(0, sizeX, tileWidth),
+        indexing="ij")]
+    w = numpy.minimum(tileWidth, sizeX - x)
+    h = numpy.minimum(tileHeight, sizeY - y)
+    return numpy.column_stack((z, c, t, x, y, w, h)).astype(numpy.int64)
+
+
+class ParallelTileLoop(object):
+    """
+    Runs a TileLoopIteration over all tiles using several TileData
+    instances (e.g. one RawPixelsStore each) from worker threads.
+
+    loop.createData() is called once per worker. At most maxInFlight
+    tiles (by default twice the number of workers) are queued or
+    awaiting their callback at any time. If given, callback(tile,
+    result) is called from the calling thread with each row of
+    tile_index and the return value of iteration.run, either in tile
+    order or as tiles complete.
+
+    Writing through several RawPixelsStore instances is only suitable
+    for pixel buffers which accept tiles in any order, i.e. not for
+    pyramids.
+    """
+
+    def __init__(self, loop, workers=4, maxInFlight=None):
+        self.loop = loop
+        self.workers = max(1, workers)
+        if maxInFlight is None:
+            maxInFlight = 2 * self.workers
+        self.maxInFlight = max(1, maxInFlight)
+        self.tileCount = 0
+        self.elapsed = 0.0
+
+    def tilesPerSecond(self):
+        if not self.elapsed:
+            return 0.0
+        return self.tileCount / self.elapsed
+
+    def _work(self, data, iteration, work, results):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            i, tile = item
+            try:
+                z, c, t, x, y, w, h = tile
+                rv = iteration.run(data, z, c, t, x, y, w, h, i)
+                results.put((i, tile, rv, None))
+            except Exception, e:
+                results.put((i, tile, None, e))
+
+    def forEachTile(self, sizeX, sizeY, sizeZ, sizeC, sizeT,
+                    tileWidth, tileHeight, iteration, callback=None,
+                    ordered=True):
+        """
+        See TileLoop.forEachTile. Returns the number of tiles iterated
+        over; the rate achieved is available from tilesPerSecond().
+        """
+        index = tile_index(sizeX, sizeY, sizeZ, sizeC, sizeT,
+                           tileWidth, tileHeight)
+        start = time.time()
+        work = Queue.Queue()
+        results = Queue.Queue()
+        datas = []
+        threads = []
+        pending = {}
+        state = {"next": 0, "error": None}
+
+        def consume():
+            """
+            Handles one result and returns the number of tiles which
+            are now finished.
+            """
+            i, tile, rv, exc = results.get()
+            if exc is not None and state["error"] is None:
+                state["error"] = exc
+            if not ordered:
+                if callback is not None and state["error"] is None:
+                    callback(tile, rv)
+                return 1
+            pending[i] = (tile, rv)
+            done = 0
+            while state["next"] in pending:
+                tile, rv = pending.pop(state["next"])
+                if callback is not None and state["error"] is None:
+                    callback(tile, rv)
+                state["next"] += 1
+                done += 1
+            return done
+
+        submitted = 0
+        inflight = 0
+        try:
+            for x in range(min(self.workers, max(1, len(index)))):
+                data = self.loop.createData()
+                datas.append(data)
+                thread = threading.Thread(
+                    target=self._work, args=(data, iteration, work, results),
+                    name="ParallelTileLoop-%s" % x)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            for i, tile in enumerate(index.tolist()):
+                while inflight >= self.maxInFlight:
+                    inflight -= consume()
+                if state["error"] is not None:
+                    break
+                work.put((i, tile))
+                submitted += 1
+                inflight += 1
+
+            while inflight:
+                inflight -= consume()
+        finally:
+            for thread in threads:
+                work.put(None)
+            for thread in threads:
+                thread.join()
+            for data in datas:
+                data.close()
+
+        if state["error"] is not None:
+            raise state["error"]
+
+        self.tileCount = submitted
+        self.elapsed = time.time() - start
+        logger.info("%s tiles in %.2fs (%.1f tiles/s) with %s workers",
+                    self.tileCount, self.elapsed, self.tilesPerSecond(),
+                    len(threads))
+        return self.tileCount
+
+
+def big_endian(array, dtype=None):
+    """
+    Returns the bytes of array converted to dtype (by default its own
+    type) in the big-endian order expected by RawPixelsStore, making at
+    most one copy.
+    """
+    import numpy
+    if dtype is None:
+        dtype = array.dtype
+    dtype = numpy.dtype(dtype).newbyteorder(">")
+    return numpy.ascontiguousarray(array, dtype=dtype).tostring()
+
+
+class PixelsWriter(object):
+    """
+    Writes array data to a RawPixelsStore tile by tile.
+
+    The source may be a NumPy array, a memmap or any object with a
+    shape of (sizeZ, sizeC, sizeT, sizeY, sizeX) whose __getitem__
+    accepts ``[z, c, t, y0:y1, x0:x1]``. Only one tile is held in
+    memory at a time per queue slot, so images larger than the
+    server's maximum plane size can be written.
+
+    Tiles are converted to big-endian bytes in the calling thread
+    while a background thread sends the previous ones with setTile,
+    at most queueSize tiles ahead. The minimum and maximum of each
+    channel are accumulated as tiles are converted.
+    """
+
+    def __init__(self, rps, sizeX, sizeY, sizeZ, sizeC, sizeT, dtype,
+                 tileWidth=None, tileHeight=None, queueSize=4, ctx=None):
+        import numpy
+        self.rps = rps
+        self.sizeX = sizeX
+        self.sizeY = sizeY
+        self.sizeZ = sizeZ
+        self.sizeC = sizeC
+        self.sizeT = sizeT
+        self.dtype = numpy.dtype(dtype)
+        if tileWidth is None or tileHeight is None:
+            tileWidth, tileHeight = rps.getTileSize()
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        self.queueSize = queueSize
+        self.ctx = ctx
+        self.mins = [None] * sizeC
+        self.maxs = [None] * sizeC
+        self.tileCount = 0
+
+    def tiles(self):
+        """
+        Yields (z, c, t, x, y, w, h) for every tile in the order in
+        which they are written, which is that of tile_index() and
+        TileLoop.forEachTile: T, then C, then Z, then tile rows and
+        columns. Pyramid pixel buffers require this order.
+        """
+        for tile in tile_index(self.sizeX, self.sizeY, self.sizeZ,
+                               self.sizeC, self.sizeT,
+                               self.tileWidth, self.tileHeight):
+            yield tuple(int(v) for v in tile)
+
+    def _update(self, c, tile):
+        lo = tile.min()
+        hi = tile.max()
+        if self.mins[c] is None or lo < self.mins[c]:
+            self.mins[c] = lo
+        if self.maxs[c] is None or hi > self.maxs[c]:
+            self.maxs[c] = hi
+
+    def _send(self, queue, errors):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if errors:
+                continue  # Drain so that the writer is not blocked
+            buf, z, c, t, x, y, w, h = item
+            try:
+                if self.ctx is None:
+                    self.rps.setTile(buf, z, c, t, x, y, w, h)
+                else:
+                    self.rps.setTile(buf, z, c, t, x, y, w, h, self.ctx)
+            except Exception, e:
+                errors.append(e)
+
+    def write(self, data):
+        """
+        Writes all tiles of data. Returns the number of tiles written.
+        """
+        import numpy
+        shape = (self.sizeZ, self.sizeC, self.sizeT, self.sizeY, self.sizeX)
+        if tuple(data.shape) != shape:
+            raise ValueError("Expected shape %s, found %s"
+                             % (shape, tuple(data.shape)))
+
+        errors = []
+        queue = Queue.Queue(maxsize=max(1, self.queueSize))
+        sender = threading.Thread(
+            target=self._send, args=(queue, errors), name="PixelsWriter")
+        sender.daemon = True
+        sender.start()
+        try:
+            for z, c, t, x, y, w, h in self.tiles():
+                if errors:
+                    break
+                tile = numpy.asarray(data[z, c, t, y:y+h, x:x+w])
+                if tile.dtype != self.dtype:
+                    tile = tile.astype(self.dtype)
+                self._update(c, tile)
+                queue.put((big_endian(tile), z, c, t, x, y, w, h))
+                self.tileCount += 1
+        finally:
+            queue.put(None)
+            sender.join()
+        if errors:
+            raise errors[0]
+        return self.tileCount
+
+    def minmax(self):
+        """
+        Returns a list of (min, max) per channel of the data written.
+        """
+        return zip(self.mins, self.maxs)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+# Use is subject to license terms supplied in LICENSE.txt
+#
+
+"""
+Pre-forked interpreter ("zygote") for running OMERO scripts.
+
+A zygote is a long-lived interpreter which has already imported omero,
+Ice and NumPy. Each job is started by forking the zygote, so that the
+child begins with those modules loaded instead of paying for a fresh
+interpreter start-up. The child is otherwise equivalent to running
+``interpreter ./script`` in the job directory: it gets its own session
+(and process group), working directory, environment and output files.
+
+The zygote listens on a unix socket in a private temporary directory.
+For every connection it reads one request, forks, and replies with the
+pid of the child followed, once the child has been reaped, by its
+return code. The zygote exits when the pipe to its parent is closed.
+
+Only POSIX platforms are supported.
+"""
+
+import os
+import sys
+import errno
+import atexit
+import select
+import signal
+import socket
+import logging
+import tempfile
+import threading
+import traceback
+import subprocess
+import cPickle as pickle
+
+from omero_ext import killableprocess
+
+
+PRELOAD = ("Ice", "omero", "omero.clients", "omero.rtypes",
+           "omero.scripts", "omero.util", "numpy")
+"""Modules imported by the zygote before it starts forking."""
+
+START_TIMEOUT = 60
+"""Seconds to wait for a new zygote to begin listening."""
+
+logger = logging.getLogger("omero.util.zygote")
+
+
+def _send(f, obj):
+    pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    f.flush()
+
+
+def _close(f):
+    try:
+        f.close()
+    except socket.error:
+        pass
+
+
+def _returncode(status):
+    """
+    Converts a waitpid status into a subprocess-style return code.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+#
+# Server side (runs inside the zygote)
+#
+
+def preload(modules=PRELOAD):
+    for name in modules:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def _child(request):
+    """
+    Runs the script described by request in a freshly forked child.
+    Never returns.
+    """
+    rc = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        cwd = request["cwd"]
+        if cwd:
+            os.chdir(cwd)
+        env = request["env"]
+        if env is not None:
+            os.environ.clear()
+            os.environ.update(env)
+            paths = env.get("PYTHONPATH", "").split(os.pathsep)
+            for p in reversed([p for p in paths if p]):
+                if p not in sys.path:
+                    sys.path.insert(0, p)
+
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        for fd, name in ((1, request["stdout"]), (2, request["stderr"])):
+            if name:
+                os.dup2(os.open(name, flags, 0644), fd)
+
+        script = os.path.abspath(request["args"][1])
+        sys.argv = [script] + list(request["args"][2:])
+        sys.path.insert(0, os.path.dirname(script))
+
+        import runpy
+        try:
+            runpy.run_path(script, run_name="__main__")
+            rc = 0
+        except SystemExit, se:
+            if se.code is None:
+                rc = 0
+            elif isinstance(se.code, (int, long)):
+                rc = se.code
+            else:
+                print >>sys.stderr, se.code
+                rc = 1
+        except Exception, e:
+            # The traceback goes to the script's stderr
+            traceback.print_exc()
+            logger.info("Script %s failed: %s", script, e)
+            rc = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(rc)
+
+
+def serve(address, control=sys.stdin, ready=sys.stdout):
+    """
+    Listens on the unix socket at address until control is closed.
+    A line is written to ready once the socket is accepting.
+    """
+    preload()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(address)
+    os.chmod(address, 0600)
+    server.listen(32)
+    ready.write("ready %s\n" % os.getpid())
+    ready.flush()
+
+    children = {}  # pid to reply file
+    try:
+        while True:
+            try:
+                readable = select.select([server, control], [], [], 0.5)[0]
+            except select.error, se:
+                if se.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if control in readable and not os.read(control.fileno(), 1024):
+                break
+
+            if server in readable:
+                conn, _ = server.accept()
+                f = conn.makefile("rwb")
+                try:
+                    request = pickle.load(f)
+                except Exception:
+                    f.close()
+                    conn.close()
+                    continue
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    for other in children.values():
+                        _close(other)
+                    f.close()
+                    _child(request)
+                conn.close()
+                children[pid] = f
+                try:
+                    _send(f, {"pid": pid})
+                except socket.error:
+                    pass
+
+            while children:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except OSError:
+                    break
+                if not pid:
+                    break
+                f = children.pop(pid, None)
+                if f is not None:
+                    try:
+                        _send(f, {"rcode": _returncode(status)})
+                    except socket.error:
+                        pass
+                    _close(f)
+    finally:
+        server.close()
+        for f in children.values():
+            _close(f)
+
+
+def main():
+    serve(sys.argv[1])
+
+
+#
+# Client side (runs inside the processor)
+#
+
+class ZygotePopen(object):
+    """
+    Handle on a job forked by a Zygote. Provides the subset of the
+    killableprocess.Popen interface used by omero.processor.ProcessI.
+    """
+
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.file = conn.makefile("rb")
+        self.pid = pid
+        self.returncode = None
+
+    def _read(self):
+        try:
+            rv = pickle.load(self.file)
+            self.returncode = rv["rcode"]
+        except (EOFError, socket.error, pickle.UnpicklingError):
+            logger.warn("Lost zygote connection for pid=%s", self.pid)
+            self.returncode = -1
+        self.file.close()
+        self.conn.close()
+
+    def poll(self):
+        if self.returncode is None:
+            if select.select([self.conn], [], [], 0)[0]:
+                self._read()
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self._read()
+        return self.returncode
+
+    def kill(self, group=True):
+        if group:
+            os.killpg(self.pid, signal.SIGKILL)
+        else:
+            os.kill(self.pid, signal.SIGKILL)
+        self.returncode = -9
+        self.file.close()
+        self.conn.close()
+
+
+class Zygote(object):
+    """
+    Manages a single zygote process for the given launcher. The
+    zygote is started on first use and restarted if it has died.
+    """
+
+    def __init__(self, launcher=sys.executable, timeout=START_TIMEOUT):
+        self.launcher = launcher
+        self.timeout = timeout
+        self.popen = None
+        self.dir = None
+        self.address = None
+        self._lock = threading.RLock()
+
+    def isAlive(self):
+        return self.popen is not None and self.popen.poll() is None
+
+    def start(self):
+        self._lock.acquire()
+        try:
+            if self.isAlive():
+                return
+            self.stop()
+            self.dir = tempfile.mkdtemp(prefix="omero-zygote-")
+            self.address = os.path.join(self.dir, "socket")
+            self.popen = killableprocess.Popen(
+                [self.launcher, "-c",
+                 "import omero.util.zygote as z; z.main()", self.address],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                close_fds=True)
+            ready = select.select(
+                [self.popen.stdout], [], [], self.timeout)[0]
+            line = ready and self.popen.stdout.readline() or ""
+            if not line.startswith("ready"):
+                self.stop()
+                raise Exception("Zygote failed to start: %s" % self.launcher)
+            logger.info("Started zygote %s for %s",
+                        self.popen.pid, self.launcher)
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        self._lock.acquire()
+        try:
+            if self.popen is not None:
+                try:
+                    self.popen.stdin.close()
+                    self.popen.wait(timeout=5)
+                except Exception:
+                    logger.debug("Error stopping zygote", exc_info=True)
+                self.popen = None
+            if self.dir is not None:
+                for name in os.listdir(self.dir):
+                    os.remove(os.path.join(self.dir, name))
+                os.rmdir(self.dir)
+                self.dir = None
+        finally:
+            self._lock.release()
+
+    def spawn(self, args, cwd=None, env=None, stdout=None, stderr=None):
+        """
+        Starts args (interpreter, script, ...) in a child of the zygote.
+        stdout and stderr are file names which will be appended to.
+        """
+        self.start()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.address)
+            f = conn.makefile("wb")
+            _send(f, {"args": list(args), "cwd": cwd, "env": env,
+                      "stdout": stdout, "stderr": stderr})
+            f.close()
+            popen = ZygotePopen(conn, None)
+            popen.pid = pickle.load(popen.file)["pid"]
+            return popen
+        except Exception:
+            logger.debug("Failed to spawn %s", args, exc_info=True)
+            conn.close()
+            raise
+
+
+_zygotes = {}
+_zygotes_lock = threading.Lock()
+
+
+def get_zygote(launcher=sys.executable):
+    """
+    Returns the shared Zygote for the given launcher.
+    """
+    _zygotes_lock.acquire()
+    try:
+        zygote = _zygotes.get(launcher)
+        if zygote is None:
+            zygote = Zygote(launcher)
+            _zygotes[launcher] = zygote
+        return zygote
+    finally:
+        _zygotes_lock.release()
+
+
+def stop_all():
+    _zygotes_lock.acquire()
+    try:
+        for zygote in _zygotes.values():
+            zygote.stop()
+        _zygotes.clear()
+    finally:
+        _zygotes_lock.release()
+
+
+atexit.register(stop_all)
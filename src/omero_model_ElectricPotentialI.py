@@ -36,6 +36,7 @@ from omero_model_UnitBase import UnitBase
 from omero.model.enums import UnitsElectricPotential
 
 from omero.conversions import Add  # nopep8
+from omero.conversions import ConversionTable  # nopep8
 from omero.conversions import Int  # nopep8
 from omero.conversions import Mul  # nopep8
 from omero.conversions import Pow  # nopep8
@@ -43,11 +44,12 @@ from omero.conversions import Rat  # nopep8
 from omero.conversions import Sym  # nopep8
 
 
-class ElectricPotentialI(_omero_model.ElectricPotential, UnitBase):
-
-    UNIT_VALUES = sorted(UnitsElectricPotential._enumerators.values())
+def _conversions():
+    """
+    Builds the ElectricPotentialI.CONVERSIONS table on first use
+    """
     CONVERSIONS = dict()
-    for val in UNIT_VALUES:
+    for val in UnitsElectricPotential._enumerators.values():
         CONVERSIONS[val] = dict()
     CONVERSIONS[UnitsElectricPotential.ATTOVOLT][UnitsElectricPotential.CENTIVOLT] = \
         Mul(Rat(Int(1), Pow(10, 16)), Sym("attov"))  # nopep8
@@ -889,7 +891,13 @@ class ElectricPotentialI(_omero_model.ElectricPotential, UnitBase):
         Mul(Rat(Int(1), Int(1000)), Sym("zettav"))  # nopep8
     CONVERSIONS[UnitsElectricPotential.ZETTAVOLT][UnitsElectricPotential.ZEPTOVOLT] = \
         Mul(Pow(10, 42), Sym("zettav"))  # nopep8
-    del val
+    return CONVERSIONS
+
+
+class ElectricPotentialI(_omero_model.ElectricPotential, UnitBase):
+
+    UNIT_VALUES = sorted(UnitsElectricPotential._enumerators.values())
+    CONVERSIONS = ConversionTable(_conversions)
 
     SYMBOLS = dict()
     SYMBOLS["ATTOVOLT"] = "aV"
@@ -942,7 +950,7 @@ class ElectricPotentialI(_omero_model.ElectricPotential, UnitBase):
                 self.setValue(value.getValue())
                 self.setUnit(source)
             else:
-                c = self.CONVERSIONS.get(source).get(target)
+                c = self.CONVERSIONS.compiled(source, target)
                 if c is None:
                     t = (value.getValue(), source, target)
                     msg = "%s %s cannot be converted to %s" % t
@@ -36,6 +36,7 @@ from omero_model_UnitBase import UnitBase
 from omero.model.enums import UnitsLength
 
 from omero.conversions import Add  # nopep8
+from omero.conversions import ConversionTable  # nopep8
 from omero.conversions import Int  # nopep8
 from omero.conversions import Mul  # nopep8
 from omero.conversions import Pow  # nopep8
@@ -43,11 +44,12 @@ from omero.conversions import Rat  # nopep8
 from omero.conversions import Sym  # nopep8
 
 
-class LengthI(_omero_model.Length, UnitBase):
-
-    UNIT_VALUES = sorted(UnitsLength._enumerators.values())
+def _conversions():
+    """
+    Builds the LengthI.CONVERSIONS table on first use
+    """
     CONVERSIONS = dict()
-    for val in UNIT_VALUES:
+    for val in UnitsLength._enumerators.values():
         CONVERSIONS[val] = dict()
     CONVERSIONS[UnitsLength.ANGSTROM][UnitsLength.ASTRONOMICALUNIT] = \
         Mul(Rat(Int(1), Mul(Int(1495978707), Pow(10, 12))), Sym("ang"))  # nopep8
@@ -2033,7 +2035,13 @@ class LengthI(_omero_model.Length, UnitBase):
         Mul(Rat(Int(1), Int(1000)), Sym("zettam"))  # nopep8
     CONVERSIONS[UnitsLength.ZETTAMETER][UnitsLength.ZEPTOMETER] = \
         Mul(Pow(10, 42), Sym("zettam"))  # nopep8
-    del val
+    return CONVERSIONS
+
+
+class LengthI(_omero_model.Length, UnitBase):
+
+    UNIT_VALUES = sorted(UnitsLength._enumerators.values())
+    CONVERSIONS = ConversionTable(_conversions)
 
     SYMBOLS = dict()
     SYMBOLS["ANGSTROM"] = "Å"
@@ -2099,7 +2107,7 @@ class LengthI(_omero_model.Length, UnitBase):
                 self.setValue(value.getValue())
                 self.setUnit(source)
             else:
-                c = self.CONVERSIONS.get(source).get(target)
+                c = self.CONVERSIONS.compiled(source, target)
                 if c is None:
                     t = (value.getValue(), source, target)
                     msg = "%s %s cannot be converted to %s" % t
@@ -36,6 +36,7 @@ from omero_model_UnitBase import UnitBase
 from omero.model.enums import UnitsPressure
 
 from omero.conversions import Add  # nopep8
+from omero.conversions import ConversionTable  # nopep8
 from omero.conversions import Int  # nopep8
 from omero.conversions import Mul  # nopep8
 from omero.conversions import Pow  # nopep8
@@ -43,11 +44,12 @@ from omero.conversions import Rat  # nopep8
 from omero.conversions import Sym  # nopep8
 
 
-class PressureI(_omero_model.Pressure, UnitBase):
-
-    UNIT_VALUES = sorted(UnitsPressure._enumerators.values())
+def _conversions():
+    """
+    Builds the PressureI.CONVERSIONS table on first use
+    """
     CONVERSIONS = dict()
-    for val in UNIT_VALUES:
+    for val in UnitsPressure._enumerators.values():
         CONVERSIONS[val] = dict()
     CONVERSIONS[UnitsPressure.ATMOSPHERE][UnitsPressure.ATTOPASCAL] = \
         Mul(Mul(Int(101325), Pow(10, 18)), Sym("atm"))  # nopep8
@@ -2033,7 +2035,13 @@ class PressureI(_omero_model.Pressure, UnitBase):
         Mul(Rat(Int(1), Int(1000)), Sym("zettapa"))  # nopep8
     CONVERSIONS[UnitsPressure.ZETTAPASCAL][UnitsPressure.ZEPTOPASCAL] = \
         Mul(Pow(10, 42), Sym("zettapa"))  # nopep8
-    del val
+    return CONVERSIONS
+
+
+class PressureI(_omero_model.Pressure, UnitBase):
+
+    UNIT_VALUES = sorted(UnitsPressure._enumerators.values())
+    CONVERSIONS = ConversionTable(_conversions)
 
     SYMBOLS = dict()
     SYMBOLS["ATMOSPHERE"] = "atm"
@@ -2097,7 +2105,7 @@ class PressureI(_omero_model.Pressure, UnitBase):
                 self.setValue(value.getValue())
                 self.setUnit(source)
             else:
-                c = self.CONVERSIONS.get(source).get(target)
+                c = self.CONVERSIONS.compiled(source, target)
                 if c is None:
                     t = (value.getValue(), source, target)
                     msg = "%s %s cannot be converted to %s" % t
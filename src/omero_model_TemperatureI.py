@@ -36,6 +36,7 @@ from omero_model_UnitBase import UnitBase
 from omero.model.enums import UnitsTemperature
 
 from omero.conversions import Add  # nopep8
+from omero.conversions import ConversionTable  # nopep8
 from omero.conversions import Int  # nopep8
 from omero.conversions import Mul  # nopep8
 from omero.conversions import Pow  # nopep8
@@ -43,11 +44,12 @@ from omero.conversions import Rat  # nopep8
 from omero.conversions import Sym  # nopep8
 
 
-class TemperatureI(_omero_model.Temperature, UnitBase):
-
-    UNIT_VALUES = sorted(UnitsTemperature._enumerators.values())
+def _conversions():
+    """
+    Builds the TemperatureI.CONVERSIONS table on first use
+    """
     CONVERSIONS = dict()
-    for val in UNIT_VALUES:
+    for val in UnitsTemperature._enumerators.values():
         CONVERSIONS[val] = dict()
     CONVERSIONS[UnitsTemperature.CELSIUS][UnitsTemperature.FAHRENHEIT] = \
         Add(Mul(Rat(Int(9), Int(5)), Sym("c")), Int(32))  # nopep8
@@ -73,7 +75,13 @@ class TemperatureI(_omero_model.Temperature, UnitBase):
         Add(Sym("r"), Rat(Int(-45967), Int(100)))  # nopep8
     CONVERSIONS[UnitsTemperature.RANKINE][UnitsTemperature.KELVIN] = \
         Mul(Rat(Int(5), Int(9)), Sym("r"))  # nopep8
-    del val
+    return CONVERSIONS
+
+
+class TemperatureI(_omero_model.Temperature, UnitBase):
+
+    UNIT_VALUES = sorted(UnitsTemperature._enumerators.values())
+    CONVERSIONS = ConversionTable(_conversions)
 
     SYMBOLS = dict()
     SYMBOLS["CELSIUS"] = "°C"
@@ -109,7 +117,7 @@ class TemperatureI(_omero_model.Temperature, UnitBase):
                 self.setValue(value.getValue())
                 self.setUnit(source)
             else:
-                c = self.CONVERSIONS.get(source).get(target)
+                c = self.CONVERSIONS.compiled(source, target)
                 if c is None:
                     t = (value.getValue(), source, target)
                     msg = "%s %s cannot be converted to %s" % t
@@ -36,6 +36,7 @@ from omero_model_UnitBase import UnitBase
 from omero.model.enums import UnitsTime
 
 from omero.conversions import Add  # nopep8
+from omero.conversions import ConversionTable  # nopep8
 from omero.conversions import Int  # nopep8
 from omero.conversions import Mul  # nopep8
 from omero.conversions import Pow  # nopep8
@@ -43,11 +44,12 @@ from omero.conversions import Rat  # nopep8
 from omero.conversions import Sym  # nopep8
 
 
-class TimeI(_omero_model.Time, UnitBase):
-
-    UNIT_VALUES = sorted(UnitsTime._enumerators.values())
+def _conversions():
+    """
+    Builds the TimeI.CONVERSIONS table on first use
+    """
     CONVERSIONS = dict()
-    for val in UNIT_VALUES:
+    for val in UnitsTime._enumerators.values():
         CONVERSIONS[val] = dict()
     CONVERSIONS[UnitsTime.ATTOSECOND][UnitsTime.CENTISECOND] = \
         Mul(Rat(Int(1), Pow(10, 16)), Sym("attos"))  # nopep8
@@ -1153,7 +1155,13 @@ class TimeI(_omero_model.Time, UnitBase):
         Mul(Rat(Int(1), Int(1000)), Sym("zettas"))  # nopep8
     CONVERSIONS[UnitsTime.ZETTASECOND][UnitsTime.ZEPTOSECOND] = \
         Mul(Pow(10, 42), Sym("zettas"))  # nopep8
-    del val
+    return CONVERSIONS
+
+
+class TimeI(_omero_model.Time, UnitBase):
+
+    UNIT_VALUES = sorted(UnitsTime._enumerators.values())
+    CONVERSIONS = ConversionTable(_conversions)
 
     SYMBOLS = dict()
     SYMBOLS["ATTOSECOND"] = "as"
@@ -1209,7 +1217,7 @@ class TimeI(_omero_model.Time, UnitBase):
                 self.setValue(value.getValue())
                 self.setUnit(source)
             else:
-                c = self.CONVERSIONS.get(source).get(target)
+                c = self.CONVERSIONS.compiled(source, target)
                 if c is None:
                     t = (value.getValue(), source, target)
                     msg = "%s %s cannot be converted to %s" % t
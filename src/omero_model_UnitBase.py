@@ -31,3 +31,27 @@ class UnitBase(object):
         if v is not None:
             return "%s %s" % (v, str(u))
         return ""
+
+    @classmethod
+    def _lookup_unit(cls, unit):
+        for value in cls.UNIT_VALUES:
+            if unit == value or str(unit) == str(value):
+                return value
+        raise Exception("Unknown unit: %s (%s)" % (unit, type(unit)))
+
+    @classmethod
+    def convertArray(cls, values, source, target):
+        """
+        Converts a sequence or numpy array of values from the source unit
+        to the target unit (enums or their names) in a single vectorized
+        operation and returns a float64 numpy array.
+        """
+        import numpy
+        source = cls._lookup_unit(source)
+        target = cls._lookup_unit(target)
+        if source == target:
+            return numpy.array(values, dtype=numpy.float64)
+        c = cls.CONVERSIONS.compiled(source, target)
+        if c is None:
+            raise Exception("%s cannot be converted to %s" % (source, target))
+        return c.array(values)
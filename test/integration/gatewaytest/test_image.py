@@ -408,6 +408,20 @@ class TestImage (object):
         img = self.image.renderJpegRegion(0, 0, 0, 0, width, height, level=1)
         assert img is None
 
+    def testRenderBatch(self, gatewaywrapper):
+        sizeX = self.image.getSizeX()
+        sizeY = self.image.getSizeY()
+        active = [ch.isActive() for ch in self.image.getChannels()]
+        requests = [(0, 0, None, None), (0, 0, [1], None),
+                    (0, 0, [2], (0, 0, 10, 10))]
+        for workers in (1, 2):
+            full, first, region = self.image.renderBatch(requests, workers)
+            assert full.shape == (sizeY, sizeX, 3)
+            assert first.shape == (sizeY, sizeX, 3)
+            assert region.shape == (10, 10, 3)
+            assert (full != first).any()
+        assert active == [ch.isActive() for ch in self.image.getChannels()]
+
     def testRenderBirdsEyeView(self, gatewaywrapper):
         img = self.image.renderBirdsEyeView(None)
         ifile = StringIO(img)
@@ -152,3 +152,42 @@ class TestCmdCallback(ITest):
         cb.loop(5, 1000)
         cb.assertFinished()
         # For some reason the number of steps is varying between 10 and 15
+
+    # CmdCallbackManager
+    # =========================================================================
+
+    def testManagerFuturesComplete(self):
+        client = self.new_client(perms="rw----")
+        manager = omero.callbacks.CmdCallbackManager(client)
+        try:
+            futures = [manager.submit(omero.cmd.Timing(25, 4 * 10))
+                       for x in range(5)]
+            done, not_done = manager.wait(futures, timeout=10)
+            assert 5 == len(done)
+            assert not not_done
+            for future in manager.as_completed(futures):
+                assert not isinstance(future.result(), omero.cmd.ERR)
+        finally:
+            manager.close()
+
+    def testManagerDoneCallback(self):
+        client = self.new_client(perms="rw----")
+        manager = omero.callbacks.CmdCallbackManager(client)
+        called = []
+        try:
+            future = manager.submit(omero.cmd.Timing(25, 4 * 10))
+            future.add_done_callback(called.append)
+            future.result(timeout=10)
+            assert [future] == called
+        finally:
+            manager.close()
+
+    def testManagerDoNothingCancelled(self):
+        client = self.new_client(perms="rw----")
+        manager = omero.callbacks.CmdCallbackManager(client)
+        try:
+            future = manager.submit(omero.cmd.DoAll())
+            assert future.wait(5)
+            assert future.cancelled()
+        finally:
+            manager.close()
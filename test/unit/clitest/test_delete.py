@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2026 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+
+import pytest
+import omero.callbacks
+import omero.cmd
+
+from argparse import Namespace
+from omero.cli import CLI, GraphArg, NonZeroReturnCode
+from omero.plugins.delete import DeleteControl
+
+
+class MockFuture(object):
+
+    def __init__(self, manager, req):
+        self.manager = manager
+        self.req = req
+        self.steps = (0, 0)
+        self.cancelled = False
+
+    def done(self):
+        return False
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+    def close(self, closeHandle=True):
+        self.manager.closed.append((self, closeHandle))
+
+
+class MockManager(object):
+    """
+    Stands in for CmdCallbackManager. No command ever completes and
+    wait() either times out or raises KeyboardInterrupt as Ctrl-C would.
+    """
+
+    interrupt = True
+
+    def __init__(self, client):
+        self.futures = []
+        self.closed = []
+
+    def submit(self, req):
+        self.futures.append(MockFuture(self, req))
+        return self.futures[-1]
+
+    def wait(self, futures, timeout=None, return_when=None):
+        if self.interrupt:
+            raise KeyboardInterrupt()
+        time.sleep(0.01)
+        return set(), set(futures)
+
+    def close(self, closeHandles=True):
+        self.closed.append((None, closeHandles))
+
+
+class TestDelete(object):
+
+    def setup_method(self, method):
+        self.cli = CLI()
+        self.cli.register("delete", DeleteControl, "TEST")
+        self.args = ["delete"]
+        self.control = self.cli.controls["delete"]
+        self.arg = GraphArg(omero.cmd.Delete2)
+
+    def testHelp(self):
+        self.args += ["-h"]
+        self.cli.invoke(self.args, strict=True)
+
+    def testOrderedParallel(self):
+        self.args += ["Image:1", "--ordered", "--parallel", "2"]
+        with pytest.raises(NonZeroReturnCode):
+            self.cli.invoke(self.args, strict=True)
+
+    def testSplitRequest(self):
+        req, force = self.arg("Image:1-5")
+        req.dryRun = True
+        batches = self.control.split_request(req, 2)
+        assert [b.targetObjects for b in batches] == [
+            {"Image": [1, 2]}, {"Image": [3, 4]}, {"Image": [5]}]
+        assert all(b.dryRun for b in batches)
+        assert req.targetObjects == {"Image": [1, 2, 3, 4, 5]}
+
+    def testSplitDoAll(self):
+        image, force = self.arg("Image:1-3")
+        dataset, force = self.arg("Dataset:7")
+        batches = self.control.split_request(
+            omero.cmd.DoAll([image, dataset]), 2)
+        assert [b.targetObjects for b in batches] == [
+            {"Image": [1, 2]}, {"Image": [3]}, {"Dataset": [7]}]
+
+    def testSplitSkipHead(self):
+        req, force = self.arg("Project/Image:1,2,3")
+        batches = self.control.split_request(req, 2)
+        assert len(batches) == 2
+        for batch in batches:
+            assert isinstance(batch, omero.cmd.SkipHead)
+            assert batch.startFrom == ["Image"]
+            assert batch.request.targetObjects == batch.targetObjects
+        assert batches[1].targetObjects == {"Project": [3]}
+
+    def batches(self, monkeypatch, wait):
+        managers = []
+
+        def manager(client):
+            managers.append(MockManager(client))
+            return managers[-1]
+        monkeypatch.setattr(omero.callbacks, "CmdCallbackManager", manager)
+        req, force = self.arg("Image:1-5")
+        batches = self.control.split_request(req, 2)
+        args = Namespace(parallel=2, wait=wait, report=False)
+        return managers, batches, args
+
+    def testBatchesNoWait(self, monkeypatch):
+        managers, batches, args = self.batches(monkeypatch, 0)
+        self.control.process_batches(batches, args, None)
+        manager = managers[0]
+        assert batches == [f.req for f in manager.futures]
+        assert [(None, False)] == manager.closed
+
+    def testBatchesInterrupted(self, monkeypatch):
+        managers, batches, args = self.batches(monkeypatch, -1)
+        with pytest.raises(NonZeroReturnCode):
+            self.control.process_batches(batches, args, None)
+        manager = managers[0]
+        # Only the running batches were submitted and they are cancelled
+        assert batches[:2] == [f.req for f in manager.futures]
+        assert all(f.cancelled for f in manager.futures)
+        assert [(None, True)] == manager.closed
+
+    def testBatchesTimeout(self, monkeypatch):
+        monkeypatch.setattr(MockManager, "interrupt", False)
+        managers, batches, args = self.batches(monkeypatch, 0.001)
+        with pytest.raises(NonZeroReturnCode):
+            self.control.process_batches(batches, args, None)
+        manager = managers[0]
+        # Unfinished batches are cancelled before their handles are closed
+        assert batches == [f.req for f in manager.futures]
+        assert all(f.cancelled for f in manager.futures)
+        assert set((f, True) for f in manager.futures) == \
+            set(c for c in manager.closed if c[0] is not None)
@@ -271,6 +271,65 @@ class TestStore(object):
             "omero.sess": "c"}
         assert expect == rv
 
+    def testIndexIsMaintained(self, tmpdir):
+        s = self.store(tmpdir)
+        s.add("a", "b", "c", {"foo": "1"})
+        s.add("a", "b", "d", {})
+        s.remove("a", "b", "c")
+        assert (tmpdir / "._INDEX_").exists()
+        index = s.index()
+        assert ["d"] == index["a"]["b"].keys()
+        assert "b" == index["a"]["b"]["d"]["omero.user"]
+        assert index == s._scan_tree()
+
+    @pytest.mark.parametrize("corrupt", [True, False])
+    def testIndexIsRebuilt(self, tmpdir, corrupt):
+        s = self.store(tmpdir)
+        s.add("a", "b", "c", {"foo": "1"})
+        index = tmpdir / "._INDEX_"
+        if corrupt:
+            index.write("{not json")
+        else:
+            index.remove()
+        assert 1 == s.count()
+        assert "1" == s.contents()["a"]["b"]["c"]["foo"]
+        assert index.exists()
+
+    def testIndexIsRefreshed(self, tmpdir):
+        s = self.store(tmpdir)
+        s.add("a", "b", "c", {"foo": "1"})
+        assert 1 == s.count()
+        # Session files written by older clients do not update the index.
+        # Explicit times keep the test independent of timestamp granularity
+        userdir = tmpdir / "a" / "b"
+        (userdir / "d").write("foo=2\n")
+        os.utime(str(userdir), (1, 1))
+        assert 2 == s.count()
+        assert "2" == s.contents()["a"]["b"]["d"]["foo"]
+        (userdir / "c").remove()
+        os.utime(str(userdir), (2, 2))
+        assert ["d"] == s.index()["a"]["b"].keys()
+        (tmpdir / "e" / "f").ensure("g")
+        assert 2 == s.count()
+
+    def testLoginLogoutKeepsIndex(self, tmpdir, monkeypatch):
+        s = self.store(tmpdir)
+        s.add("a", "b", "c", {"foo": "1"})
+        s.set_current("a", "b", "c")
+        assert 1 == s.count()
+
+        def scan():
+            raise AssertionError("Session directory rescanned")
+        monkeypatch.setattr(s, "_scan_tree", scan)
+        # The current session file is kept next to the session files
+        s.remove("a", "b", "c")
+        assert not s.sess_file("a", "b").exists()
+        assert 0 == s.count()
+        s.add("a", "b", "d", {"foo": "2"})
+        s.set_current("a", "b", "d")
+        assert 1 == s.count()
+        assert ("a", "b", "d") == s.get_current()[:3]
+
     @pytest.mark.parametrize("ignore_nulls", [True, False])
     def testGroupConflicts(self, ignore_nulls):
         s = self.store()
@@ -21,6 +21,7 @@ from omero.scripts import (
     MissingInputs, ParseExit, compare_proto)
 from omero.scripts import client, parse_inputs, validate_inputs, parse_text
 from omero.scripts import parse_file, group_params, rlong, rint, wrap, unwrap
+from omero.scripts import parse_static
 
 SCRIPTS = path(".") / "scripts" / "omero"
 
@@ -190,6 +191,71 @@ if True:
             except Exception, e:
                 assert False, "%s\n%s" % (script, e)
 
+    def testParseStatic(self):
+        params = parse_static("""
+import omero.scripts as scripts
+from omero.rtypes import rstring, rlong
+
+def run_script():
+    types = [rstring("Dataset"), rstring("Image")]
+    client = scripts.client(
+        "static", "Parsed " + "statically",
+        scripts.String("Data_Type", values=types, default="Image"),
+        scripts.List("IDs", optional=False).ofType(rlong(0)),
+        scripts.Long("Count", min=1, max=10).out(),
+        authors=["A"], version="1.0")
+
+if __name__ == "__main__":
+    run_script()
+""")
+        assert "static" == params.name
+        assert "Parsed statically" == params.description
+        assert ["Data_Type", "IDs"] == sorted(params.inputs)
+        assert ["Count"] == sorted(params.outputs)
+        assert 2 == len(params.inputs["Data_Type"].values.val)
+        assert isinstance(params.inputs["IDs"].prototype, omero.RList)
+        assert "1.0" == params.version
+
+    @pytest.mark.parametrize("script", [
+        "import os\nimport omero.scripts as s\n"
+        "c = s.client('a', 'b', s.Long('x', default=rlong(os.getpid())))",
+        "import omero.scripts as s\nn = 1\nn = 2\n"
+        "c = s.client('a', 'b', s.Long('x', max=n))",
+        "import omero.scripts as s\nv = [1]\nv.append(2)\n"
+        "c = s.client('a', 'b', s.List('x', values=v))",
+        "import omero.scripts as s\n"
+        "c = s.client('a', 'b', s.Long('x').__class__)",
+        "import omero.scripts as s\nc = s.client('a')\nd = s.client('b')",
+        "import omero.scripts as s\nc = s.client(*args)",
+        "import omero.scripts as s\nc = s.client('a', 'b' * 1000000000)",
+        "import omero.scripts as s\nc = s.client('a', [0] * 1000)",
+        "import omero.scripts as s\nc = s.client('a', '%999999999d' % 1)",
+        "import omero.scripts as s\nc = s.client('a', '{0}'.format(1))",
+        # Each line doubles the size of the previous value
+        "import omero.scripts as s\na0 = 'xxxxxxxxxx'\n" +
+        "".join("a%d = a%d + a%d\n" % (i + 1, i, i) for i in range(40)) +
+        "c = s.client('a', a40)",
+        "import omero.scripts as s\na0 = ['x']\n" +
+        "".join("a%d = a%d + a%d\n" % (i + 1, i, i) for i in range(40)) +
+        "c = s.client('a', a40)",
+        "import omero.scripts as s\na0 = 1000000\n" +
+        "".join("a%d = a%d * a%d\n" % (i + 1, i, i) for i in range(40)) +
+        "c = s.client('a', s.Long('x', max=a40))",
+        "import omero.scripts as s\nc = s.client('a', '%s'.replace('', '%s'))"
+        % ("x" * 300, "y" * 300),
+        "def broken(:",
+    ])
+    def testParseStaticFallsBack(self, script):
+        assert parse_static(script) is None
+
+    def testParseStaticMatchesOfficialScripts(self):
+        for script in SCRIPTS.walk("*.py"):
+            params = parse_static(script.text())
+            if params is not None:
+                expected = parse_file(str(script))
+                assert expected.name == params.name, script
+                assert sorted(expected.inputs) == sorted(params.inputs)
+
     def testValidateRoiMovieCall(self):
         script = SCRIPTS / "figure_scripts" / "Movie_ROI_Figure.py"
         params = parse_file(str(script))
@@ -79,6 +79,22 @@ class MockPopen(object):
         return self.rcode
 
 
+class MockSession(object):
+    """ Records the keep-alive calls made by ProcessI.check """
+
+    def __init__(self):
+        self.pinged = []
+        self.alive = True
+
+    def getSessionService(self):
+        return self
+
+    def getSession(self, uuid):
+        if not self.alive:
+            raise Exception("session closed")
+        self.pinged.append(uuid)
+
+
 def with_process(func, Popen=MockPopen):
     """ Decorator for running a test with a Process """
     def handler(*args, **kwargs):
@@ -176,6 +192,29 @@ class TestProcess(object):
         self.process.allcallbacks("processCancelled", True)
         assert callback._cancelled
 
+    @with_process
+    def testCheckKeepsQueuedSessionAlive(self):
+        session = MockSession()
+        self.ctx.getSession = lambda: session
+        # Not yet submitted
+        assert self.process.check()
+        assert [] == session.pinged
+
+        scheduler = omero.processor.JobScheduler(
+            max_jobs=1, stop_event=self.ctx.stop_event)
+        scheduler.submit(MockScheduled("running"), "u", 1)
+        assert not scheduler.submit(self.process, "u", 1)
+        assert self.process.check()
+        assert self.process.check()
+        assert ["sessionId", "sessionId"] == session.pinged
+        assert not self.process.wasActivated()
+
+        session.alive = False
+        assert not self.process.check()
+        self.process.cleanup()
+        assert 0 == len(scheduler)
+        assert "Cancelled" == self.process.final_status
+
     #
     # Real calls
     #
@@ -214,3 +253,154 @@ client = s.client("name","description",s.Long("l"))
         assert not self.process.poll()
         self.process.cleanup()
     testKillProcess = with_process(testKillProcess, subprocess.Popen)
+
+    #
+    # Zygote
+    #
+
+    def testZygoteProcess(self):
+        self.process = omero.processor.ZygoteProcessI(
+            self.ctx, sys.executable, self.props(), self.params(),
+            callback_cast=pass_through)
+        try:
+            f = open(str(self.process.script_path), "w")
+            f.write("import sys\n")
+            f.write("print 'Hello'\n")
+            f.write("sys.exit(3)\n")
+            f.close()
+            self.process.activate()
+            assert self.process.pid
+            assert 3 == self.process.wait()
+            assert 3 == self.process.poll().val
+        finally:
+            self.process.cleanup()
+
+    def testZygoteKillProcess(self):
+        self.process = omero.processor.ZygoteProcessI(
+            self.ctx, sys.executable, self.props(), self.params(),
+            callback_cast=pass_through)
+        try:
+            f = open(str(self.process.script_path), "w")
+            f.write("import time\n")
+            f.write("time.sleep(100)\n")
+            f.close()
+            self.process.activate()
+            assert not self.process.poll()
+        finally:
+            self.process.cleanup()
+
+
+class MockScheduled(object):
+    """ Minimal stand-in for ProcessI as seen by JobScheduler """
+
+    def __init__(self, name):
+        self.uuid = name
+        self.popen = None
+        self.launched = False
+        self.abandoned = None
+
+    def launch(self):
+        self.launched = True
+
+    def abandon(self, status):
+        self.abandoned = status
+
+
+class TestJobScheduler(object):
+
+    def setup_method(self, method):
+        self.stop_event = omero.util.concurrency.get_event()
+
+    def teardown_method(self, method):
+        self.stop_event.set()
+
+    def scheduler(self, **kwargs):
+        return omero.processor.JobScheduler(
+            stop_event=self.stop_event, **kwargs)
+
+    def testAdmitsUntilFull(self):
+        scheduler = self.scheduler(max_jobs=2)
+        jobs = [MockScheduled("p%s" % x) for x in range(3)]
+        assert scheduler.submit(jobs[0], 1, 1)
+        assert scheduler.submit(jobs[1], 1, 1)
+        assert not scheduler.submit(jobs[2], 1, 1)
+        assert 1 == len(scheduler)
+        scheduler.release(jobs[0])
+        assert jobs[2].launched
+        m = scheduler.metrics()
+        assert 0 == m["queued"]
+        assert 2 == m["running"]
+        assert 3 == m["started"]
+        assert 1 == m["finished"]
+
+    def testFairShare(self):
+        scheduler = self.scheduler(max_jobs=1)
+        busy = [MockScheduled("busy%s" % x) for x in range(3)]
+        other = MockScheduled("other")
+        for process in busy:
+            scheduler.submit(process, "busy", 1)
+        scheduler.submit(other, "other", 1)
+        # The first busy job holds the only slot. The other user's job
+        # is started next, even though it was submitted last.
+        scheduler.release(busy[0])
+        assert other.launched
+        assert not busy[1].launched
+        scheduler.release(other)
+        assert busy[1].launched
+
+    def testUserLimit(self):
+        scheduler = self.scheduler(max_user_jobs=1)
+        a = [MockScheduled("a%s" % x) for x in range(2)]
+        b = MockScheduled("b")
+        assert scheduler.submit(a[0], "a", 1)
+        assert not scheduler.submit(a[1], "a", 1)
+        assert scheduler.submit(b, "b", 1)
+        scheduler.release(a[0])
+        assert a[1].launched
+
+    def testPriority(self):
+        scheduler = self.scheduler(max_jobs=1)
+        first, low, high = [MockScheduled(x) for x in ("f", "l", "h")]
+        scheduler.submit(first, "u", 1)
+        scheduler.submit(low, "u", 1, priority=0)
+        scheduler.submit(high, "u", 1, priority=5)
+        scheduler.release(first)
+        assert high.launched
+        assert not low.launched
+
+    def testRemove(self):
+        scheduler = self.scheduler(max_jobs=1)
+        first, second = MockScheduled("f"), MockScheduled("s")
+        scheduler.submit(first, "u", 1)
+        scheduler.submit(second, "u", 1)
+        assert scheduler.remove(second)
+        assert not scheduler.remove(second)
+        scheduler.release(first)
+        assert not second.launched
+        assert 1 == scheduler.metrics()["cancelled"]
+
+
+class TestScriptCache(object):
+
+    def testFetchAndEvict(self, tmpdir):
+        cache = omero.processor.ScriptCache(10, str(tmpdir.mkdir("cache")))
+        source = tmpdir.join("source")
+        source.write("123456")
+        target = tmpdir.join("target")
+        assert not cache.fetch("abc", str(target))
+        cache.store("abc", str(source))
+        assert cache.fetch("abc", str(target))
+        assert "123456" == target.read()
+        assert 1 == cache.hits
+
+        # A second entry exceeds max_bytes so the older one goes
+        cache.store("def", str(source))
+        assert not cache.fetch("abc", str(tmpdir.join("other")))
+        assert cache.fetch("def", str(tmpdir.join("other")))
+
+    def testDisabled(self, tmpdir):
+        cache = omero.processor.ScriptCache(0, str(tmpdir))
+        source = tmpdir.join("source")
+        source.write("x")
+        cache.store("abc", str(source))
+        assert not cache.fetch("abc", str(tmpdir.join("target")))
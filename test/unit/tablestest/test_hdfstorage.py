@@ -9,6 +9,7 @@
 
 """
 
+import os
 import time
 import pytest
 import omero.columns
@@ -17,6 +18,7 @@ import tables
 import threading
 import Ice
 
+from omero_ext import portalocker
 from omero_ext.mox import Mox
 from omero.rtypes import rint, rstring
 
@@ -235,6 +237,209 @@ class TestHdfStorage(TestCase):
 
         hdf.cleanup()
 
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage options require hdfstorageV2")
+    def testCompressedInitialize(self):
+        p = self.hdfpath()
+        hdf = HdfStorage(p, self.lock)
+        options = {"compression": "zlib", "compression_level": "3",
+                   "expected_rows": "1000", "chunk_rows": "64"}
+        hdf.initialize(self.cols(), options=options)
+        self.append(hdf, {"a": 1, "b": 2, "c": 3})
+        hdf.cleanup()
+
+        f = tables.open_file(str(p), mode="r")
+        try:
+            mea = f.root.OME.Measurements
+            assert mea.filters.complib == "zlib"
+            assert mea.filters.complevel == 3
+            assert mea.filters.shuffle
+            assert mea.chunkshape == (64,)
+        finally:
+            f.close()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage options require hdfstorageV2")
+    def testRepack(self):
+        p = self.hdfpath()
+        hdf = HdfStorage(p, self.lock)
+        self.init(hdf, True)
+        for i in range(100):
+            self.append(hdf, {"a": i, "b": 2, "c": 3})
+        hdf.cleanup()
+
+        options = {"compression": "zlib"}
+        assert storage_module.repack(p, options) == p.size
+        assert storage_module.repack(p, options) is None
+        # A different chunk size alone also requires a copy
+        options["chunk_rows"] = "32"
+        assert storage_module.repack(p, options) == p.size
+        assert storage_module.repack(p, options) is None
+
+        hdf = HdfStorage(p, self.lock, read_only=True)
+        try:
+            assert hdf.get_meta_map()["analysisB"] == rstring("param")
+            data = hdf.readCoordinates(hdf._stamp, range(100), self.current)
+            assert range(100) == data.columns[0].values
+        finally:
+            hdf.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage options require hdfstorageV2")
+    def testRepackFailure(self, monkeypatch):
+        p = self.hdfpath()
+        hdf = HdfStorage(p, self.lock)
+        self.init(hdf, True)
+        hdf.cleanup()
+        size = p.size
+
+        def copy_file(this, dstfilename, **kwargs):
+            path(dstfilename).write_text("partial")
+            raise IOError("disk full")
+        monkeypatch.setattr(tables.File, "copy_file", copy_file)
+        with pytest.raises(IOError):
+            storage_module.repack(p, {"compression": "zlib"})
+        assert not (p.parent / ".test.h5.repack").exists()
+        assert size == p.size
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage options require hdfstorageV2")
+    def testBadCompression(self):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        with pytest.raises(omero.ApiUsageException):
+            hdf.initialize(self.cols(), options={"compression": "unknown"})
+        hdf.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage cache requires hdfstorageV2")
+    def testCachedReopen(self, monkeypatch):
+        hdflist = HdfList()
+        monkeypatch.setattr(storage_module, 'HDFLIST', hdflist)
+        tmp = str(self.hdfpath())
+        hdf = hdflist.getOrCreate(tmp)
+        self.init(hdf, False)
+        hdf.cleanup()
+
+        # Read-only storage is kept open after the last table detaches
+        hdf1 = hdflist.getOrCreate(tmp, read_only=True)
+        hdf1.incr(self)
+        hdf1.decr(self)
+        hdf2 = hdflist.getOrCreate(tmp, read_only=True)
+        assert hdf1 is hdf2
+        assert 1 == hdflist.hits
+
+        # but not if the file changed on disk
+        hdf2.incr(self)
+        hdf2.decr(self)
+        os.utime(tmp, (0, 0))
+        hdf3 = hdflist.getOrCreate(tmp, read_only=True)
+        assert hdf3 is not hdf2
+
+        # Idle instances are closed
+        hdf3.incr(self)
+        hdf3.decr(self)
+        hdflist.evict(now=time.time() + hdflist.cache_idle + 1)
+        hdf4 = hdflist.getOrCreate(tmp, read_only=True)
+        assert hdf4 is not hdf3
+
+        # and not reused for writing
+        hdf4.incr(self)
+        hdf4.decr(self)
+        hdf5 = hdflist.getOrCreate(tmp)
+        assert hdf5 is not hdf4
+        with open(tmp) as f:
+            with pytest.raises(portalocker.LockException):
+                portalocker.lock(
+                    f, portalocker.LOCK_NB | portalocker.LOCK_EX)
+        hdf5.cleanup()
+        assert 1 == hdflist.hits
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Storage cache requires hdfstorageV2")
+    def testWritableNotCached(self, monkeypatch):
+        hdflist = HdfList()
+        monkeypatch.setattr(storage_module, 'HDFLIST', hdflist)
+        tmp = str(self.hdfpath())
+        hdf = hdflist.getOrCreate(tmp)
+        self.init(hdf, False)
+        hdf.cleanup()
+
+        hdf1 = hdflist.getOrCreate(tmp)
+        hdf1.incr(self)
+        hdf1.decr(self)
+        # The unmodified writable storage was closed with its lock
+        with open(tmp) as f:
+            portalocker.lock(f, portalocker.LOCK_NB | portalocker.LOCK_EX)
+            portalocker.unlock(f)
+        hdf2 = hdflist.getOrCreate(tmp)
+        assert hdf1 is not hdf2
+        assert 0 == hdflist.hits
+        hdf2.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Export requires hdfstorageV2")
+    def testExportNpy(self):
+        import numpy
+        import zipfile
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        self.init(hdf, False)
+        for i in range(10):
+            self.append(hdf, {"a": i, "b": 2 * i, "c": 3})
+        tmpdir = path(self.tmpdir())
+        target = str(tmpdir / "export.zip")
+        assert 4 == hdf.export(hdf._stamp, target, "npy", [0, 1], 2, 6)
+        hdf.cleanup()
+
+        zf = zipfile.ZipFile(target)
+        try:
+            assert ["a.npy", "b.npy"] == zf.namelist()
+            zf.extractall(tmpdir)
+        finally:
+            zf.close()
+        a = numpy.load(str(tmpdir / "a.npy"))
+        assert [2, 3, 4, 5] == a.tolist()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Export requires hdfstorageV2")
+    def testExportUnlocked(self, monkeypatch):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        self.init(hdf, False)
+        self.append(hdf, {"a": 1, "b": 2, "c": 3})
+        held = []
+
+        def export_columns(target, fmt, columns):
+            # The file is written without holding the HDF5 lock
+            t = threading.Thread(
+                target=lambda: held.append(not self.lock.acquire(False)))
+            t.start()
+            t.join()
+            assert [("a", [1])] == [(n, a.tolist()) for n, a in columns]
+        monkeypatch.setattr(storage_module, "export_columns", export_columns)
+        assert 1 == hdf.export(hdf._stamp, "unused", "npy", [0])
+        assert [False] == held
+        hdf.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Export requires hdfstorageV2")
+    def testExportBytes(self):
+        import numpy
+        import zipfile
+        tmpdir = path(self.tmpdir())
+        target = str(tmpdir / "export.zip")
+        values = [numpy.array(x, dtype=numpy.uint8)
+                  for x in ([0], [], [1, 2, 3])]
+        storage_module.export_columns(target, "npy", [("m/bytes", values)])
+        zf = zipfile.ZipFile(target)
+        try:
+            assert ["m/bytes_offsets.npy", "m/bytes.npy"] == zf.namelist()
+            zf.extractall(tmpdir)
+        finally:
+            zf.close()
+        offsets = numpy.load(str(tmpdir / "m" / "bytes_offsets.npy"))
+        data = numpy.load(str(tmpdir / "m" / "bytes.npy"))
+        assert [0, 1, 1, 4] == offsets.tolist()
+        assert [0, 1, 2, 3] == data.tolist()
+
     def testStringCol(self):
         hdf = HdfStorage(self.hdfpath(), self.lock)
         cols = [omero.columns.StringColumnI("name", "description", 16, None)]
@@ -250,6 +455,80 @@ class TestHdfStorage(TestCase):
         # Doesn't work yet.
         hdf.cleanup()
 
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Encoded strings require hdfstorageV2")
+    def testVlenStringCol(self):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        cols = [omero.columns.StringColumnI("name", "description", 0, None)]
+        hdf.initialize(cols, options={"vlen_columns": "name"})
+        cols[0].values = ["foo", "a much longer value", ""]
+        hdf.append(cols)
+        cols[0].values = ["bar"]
+        hdf.append(cols)
+        data = hdf.readCoordinates(time.time(), [0, 1, 2, 3], self.current)
+        assert ["foo", "a much longer value", "", "bar"] == \
+            data.columns[0].values
+        assert 0 == data.columns[0].size
+
+        data.rowNumbers = [1]
+        data.columns[0].values = ["baz"]
+        hdf.update(time.time(), data)
+        data = hdf.read(time.time(), [0], 0, 4, self.current)
+        assert ["foo", "baz", "", "bar"] == data.columns[0].values
+        hdf.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Encoded strings require hdfstorageV2")
+    def testDictionaryStringCol(self):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        cols = [omero.columns.StringColumnI("gene", "description", 0, None)]
+        hdf.initialize(cols, options={"dictionary_columns": "gene"})
+        cols[0].values = ["abc", "def", "abc"]
+        hdf.append(cols)
+        cols[0].values = ["def", "ghi"]
+        hdf.append(cols)
+
+        data = hdf.read(time.time(), [0], 0, 5, self.current)
+        assert ["abc", "def", "abc", "def", "ghi"] == data.columns[0].values
+        rows = hdf.getWhereList(time.time(), '(gene==g)', {"g": "def"},
+                                None, None, None, None)
+        assert [1, 3] == rows
+        rows = hdf.getWhereList(time.time(), '(gene==g)', {"g": "xyz"},
+                                None, None, None, None)
+        assert [] == rows
+        rows = hdf.getWhereList(time.time(), '(gene!="abc")', None,
+                                None, None, None, None)
+        assert [1, 3, 4] == rows
+        rows = hdf.getWhereList(time.time(), "('ghi'==gene) | (gene==g)",
+                                {"g": "abc"}, None, None, None, None)
+        assert [0, 2, 4] == rows
+        # The codes are not ordered like the strings
+        with pytest.raises(omero.ApiUsageException):
+            hdf.getWhereList(time.time(), '(gene<g)', {"g": "def"},
+                             None, None, None, None)
+        hdf.cleanup()
+
+    @pytest.mark.skipif(not hasattr(tables, "open_file"),
+                        reason="Encoded strings require hdfstorageV2")
+    def testStringColSize(self):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        cols = [omero.columns.StringColumnI("name", "description", 0, None)]
+        with pytest.raises(omero.ApiUsageException):
+            hdf.initialize(cols)
+        options = {"vlen_columns": "name", "dictionary_columns": "name"}
+        with pytest.raises(omero.ApiUsageException):
+            hdf.initialize(cols, options=options)
+        hdf.cleanup()
+
+    def testStringColTooLong(self):
+        hdf = HdfStorage(self.hdfpath(), self.lock)
+        cols = [omero.columns.StringColumnI("name", "description", 4, None)]
+        hdf.initialize(cols)
+        cols[0].values = ["foo", "too long"]
+        with pytest.raises(omero.ValidationException):
+            hdf.append(cols)
+        hdf.cleanup()
+
     #
     # ROIs
     #
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Test of the client-side helpers for the Tables API.
+
+   Copyright 2026 University of Dundee & Open Microscopy Environment.
+   All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import pytest
+
+import omero
+import omero.grid
+
+from omero.util.table_utils import read_table, row_bytes, write_dataframe
+
+
+class mock_table(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+        self.initialized = None
+        self.added = []
+
+    def getHeaders(self):
+        return [omero.grid.LongColumn("a", "", []),
+                omero.grid.StringColumn("s", "", 8, []),
+                omero.grid.DoubleArrayColumn("d", "", 3, [])]
+
+    def getNumberOfRows(self):
+        return self.rows
+
+    def read(self, colNumbers, start, stop):
+        self.calls += 1
+        cols = self.getHeaders()
+        cols[0].values = range(start, stop)
+        cols[1].values = ["row%s" % i for i in range(start, stop)]
+        cols[2].values = [[i, i + 1.0, i + 2.0] for i in range(start, stop)]
+        data = omero.grid.Data()
+        data.columns = [cols[i] for i in colNumbers]
+        return data
+
+    def initialize(self, cols):
+        self.initialized = cols
+
+    def addData(self, cols):
+        self.added.append([list(col.values) for col in cols])
+
+
+class TestReadTable(object):
+
+    def testReadAll(self):
+        table = mock_table(1000)
+        columns = read_table(table, chunk_bytes=1024)
+        assert ["a", "s", "d"] == columns.keys()
+        assert range(1000) == columns["a"].tolist()
+        assert "row10" == columns["s"][10]
+        assert (1000, 3) == columns["d"].shape
+        assert [7.0, 8.0, 9.0] == columns["d"][7].tolist()
+        assert table.calls > 1
+
+    def testReadParallel(self):
+        table = mock_table(1000)
+        others = [mock_table(1000), mock_table(1000)]
+        columns = read_table(table, [2, 0], 10, 500, chunk_bytes=1024,
+                             tables=others)
+        assert ["d", "a"] == columns.keys()
+        assert range(10, 500) == columns["a"].tolist()
+        assert sum(t.calls for t in others) > 0
+
+
+class TestWriteDataFrame(object):
+
+    def testWrite(self):
+        pandas = pytest.importorskip("pandas")
+        df = pandas.DataFrame({
+            "a": range(25),
+            "x": [i / 2.0 for i in range(25)],
+            "b": [bool(i % 2) for i in range(25)],
+            "s": ["row%s" % i for i in range(25)],
+        }, columns=["a", "x", "b", "s"])
+        table = mock_table(0)
+        assert 25 == write_dataframe(table, df, chunk_bytes=100)
+
+        cols = table.initialized
+        assert [omero.grid.LongColumn, omero.grid.DoubleColumn,
+                omero.grid.BoolColumn, omero.grid.StringColumn] == [
+            col.__class__ for col in cols]
+        assert ["a", "x", "b", "s"] == [col.name for col in cols]
+        assert 5 == cols[3].size
+
+        # Rows are sent in blocks of about chunk_bytes
+        sizes = [len(values[0]) for values in table.added]
+        assert 1 < len(sizes)
+        assert [100 // row_bytes(cols)] * (len(sizes) - 1) == sizes[:-1]
+        assert range(25) == sum((values[0] for values in table.added), [])
+        assert [i / 2.0 for i in range(25)] == sum(
+            (values[1] for values in table.added), [])
+        assert [False, True] == table.added[0][2][:2]
+        assert "row24" == table.added[-1][3][-1]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests for the reconciliation of omero.util.cleanse
+
+   Copyright 2026 University of Dundee & Open Microscopy Environment.
+   All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import json
+import os
+
+import pytest
+
+from omero.util.cleanse import Cleanser
+
+
+class MockCleanser(Cleanser):
+
+    RANGE_SIZE = 10
+
+    def __init__(self, existing):
+        super(MockCleanser, self).__init__(None, "OriginalFile")
+        self.existing = set(existing)
+        self.queries = []
+
+    def existing_ids(self, start, stop):
+        self.queries.append((start, stop))
+        return set(i for i in self.existing if start <= i < stop)
+
+
+def make_files(root, names):
+    for name in names:
+        path = root.join(name)
+        path.dirpath().ensure(dir=True)
+        path.write("x" * 10)
+
+
+class TestCleanser(object):
+
+    @pytest.mark.parametrize("name,expected", [
+        ("123", 123),
+        ("123_pyramid", 123),
+        (".123_pyramid.pyr_lock", 123),
+        ("123_pyramid3456.tmp", 123),
+        ("abc", -1),
+        ("abc_pyramid", -1),
+        ("123.txt", -1),
+        ("", -1),
+    ])
+    def testParseId(self, name, expected):
+        assert expected == MockCleanser([]).parse_id(name)
+
+    def testWindows(self, tmpdir):
+        # 9 and 10 lie on either side of a window boundary
+        make_files(tmpdir, ["1", "9", "10", "19", "20", "35", "notes"])
+        cleanser = MockCleanser([9, 10, 20])
+        cleanser.cleanse(str(tmpdir))
+        # Windows end after the largest id of the directory
+        assert [(1, 11), (19, 29), (35, 36)] == cleanser.queries
+        assert ["1", "19", "35"] == sorted(
+            os.path.basename(p) for p in cleanser.cleansed)
+        assert ["10", "20", "9", "notes"] == sorted(
+            p.basename for p in tmpdir.listdir())
+        assert 30 == cleanser.bytes_cleansed
+
+    def testSubdirectories(self, tmpdir):
+        make_files(tmpdir, ["5", "Dir-001/1005", "Dir-001/1006",
+                            "Dir-001/Dir-002/1002005", "Dir-003/3005"])
+        cleanser = MockCleanser([1006])
+        cleanser.cleanse(str(tmpdir))
+        assert [tmpdir.join("Dir-001", "1006")] == list(
+            tmpdir.visit(lambda p: p.check(file=1)))
+        assert 5 == cleanser.files_checked
+        assert 4 == cleanser.dirs_checked
+
+    def testCheckpoint(self, tmpdir):
+        repo = tmpdir.join("repo")
+        make_files(repo, ["5", "Dir-001/1005", "Dir-002/2005"])
+        checkpoint = tmpdir.join("checkpoint")
+        checkpoint.write(
+            json.dumps({"type": "OriginalFile",
+                        "dir": str(repo.join("Dir-001"))}) + "\n" +
+            json.dumps({"type": "Pixels", "dir": str(repo)}) + "\n" +
+            '{"type": "Orig')
+        cleanser = MockCleanser([])
+        cleanser.checkpoint = str(checkpoint)
+        cleanser.cleanse(str(repo))
+        # Dir-001 was done by the previous run
+        assert repo.join("Dir-001", "1005").check()
+        assert not repo.join("5").check()
+        assert not repo.join("Dir-002", "2005").check()
+        assert [(5, 6), (2005, 2006)] == sorted(cleanser.queries)
+        done = MockCleanser([])
+        done.checkpoint = str(checkpoint)
+        assert set([str(repo), str(repo.join("Dir-001")),
+                    str(repo.join("Dir-002"))]) == done.load_checkpoint()
+
+    def testDryRun(self, tmpdir, capsys):
+        make_files(tmpdir, ["1", "2", "Dir-001/1005", "notes"])
+        checkpoint = tmpdir.join("checkpoint")
+        cleanser = MockCleanser([2])
+        cleanser.dry_run = True
+        cleanser.checkpoint = str(checkpoint)
+        cleanser.cleanse(str(tmpdir))
+        assert 2 == len(cleanser.cleansed)
+        assert 20 == cleanser.bytes_cleansed
+        assert 4 == len(list(tmpdir.visit(lambda p: p.check(file=1))))
+        assert not checkpoint.check()
+        out = capsys.readouterr()[0]
+        assert "1 (remove)" in out
+        assert "2 (keep)" in out
+        assert "notes (ignored/keep)" in out
+
+    def testProgress(self, tmpdir, capsys):
+        make_files(tmpdir, ["1", "Dir-001/1005", "Dir-002/2005"])
+        cleanser = MockCleanser([1])
+        cleanser.progress = True
+        cleanser.PROGRESS_INTERVAL = 0
+        cleanser.cleanse(str(tmpdir))
+        assert 3 == cleanser.dirs_found == cleanser.dirs_checked
+        err = capsys.readouterr()[1].splitlines()
+        assert 3 == len(err)
+        assert "1 files in 1/3 directories" in err[0]
+        assert "3 files in 3/3 directories" in err[-1]
+        assert "ETA 0:00:00" in err[-1]
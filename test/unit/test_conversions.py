@@ -25,6 +25,10 @@ Simple tests of the new conversions used for units.
 
 from pytest import assertAlmostEqual
 from omero.conversions import Add
+from omero.conversions import Compiled
+from omero.conversions import ConversionTable
+from omero.conversions import Evaluated
+from omero.conversions import compile_conversion
 from omero.conversions import Int
 from omero.conversions import Mul
 from omero.conversions import Pow
@@ -92,3 +96,36 @@ class TestConversions(object):
         self.assertEquals(0.0, ftoc(32.0))
         self.assertEquals(100.0, ftoc(212.0))
         self.assertEquals(-40.0, ftoc(-40.0))
+
+    def testCompiledLinear(self):
+        ftoc = Add(Mul(Rat(Int(5), Int(9)), Sym("f")), Rat(Int(-160), Int(9)))
+        c = compile_conversion(ftoc)
+        assert isinstance(c, Compiled)
+        self.assertEquals(100.0, c(212.0))
+        values = c.array([32.0, -40.0, 212.0])
+        assert [0.0, -40.0, 100.0] == [round(x, 6) for x in values]
+
+    def testCompiledBigInt(self):
+        big = "1" + "0" * 30
+        c = compile_conversion(Mul(Rat(Int(1), Int(big)), Sym("x")))
+        self.assertEquals(1.0, c(1e30))
+
+    def testNonLinearIsEvaluated(self):
+        square = Mul(Sym("x"), Sym("x"))
+        c = compile_conversion(square)
+        assert isinstance(c, Evaluated)
+        self.assertEquals(9.0, c(3.0))
+
+    def testConversionTableIsLazy(self):
+        built = []
+
+        def builder():
+            built.append(True)
+            return {"A": {"B": Mul(Int(2), Sym("a"))}}
+
+        table = ConversionTable(builder)
+        assert not built
+        self.assertEquals(4.0, table.compiled("A", "B")(2.0))
+        assert table.compiled("B", "A") is None
+        assert table.compiled("A", "B") is table.compiled("A", "B")
+        assert 1 == len(built)
@@ -27,7 +27,7 @@ Test of various things under omero.gateway
 import Ice
 import pytest
 
-from omero.gateway import BlitzGateway, ImageWrapper
+from omero.gateway import BlitzGateway, ImageWrapper, unpackRGB
 from omero.model import ImageI, PixelsI, ExperimenterI, EventI
 from omero.rtypes import rstring, rtime, rlong, rint
 
@@ -52,6 +52,74 @@ class MockConnection(object):
         return (64, 64)
 
 
+class MockRenderingEngine(object):
+    """
+    Renders each pixel as ARGB (0xFF, z, t, bitmask of active channels).
+    """
+
+    def __init__(self, sizeX, sizeY, sizeC):
+        self.size = (sizeX, sizeY)
+        self.active = [True] * sizeC
+        self.setActiveCalls = 0
+        self.closed = False
+
+    def getRenderingDefId(self, ctx=None):
+        return 1L
+
+    def getModel(self, ctx=None):
+        return None
+
+    def isActive(self, c, ctx=None):
+        return self.active[c]
+
+    def setActive(self, c, active, ctx=None):
+        self.setActiveCalls += 1
+        self.active[c] = active
+
+    def getCodomainMapContext(self, c, ctx=None):
+        return []
+
+    def getChannelWindowStart(self, c, ctx=None):
+        return 0.0
+
+    def getChannelWindowEnd(self, c, ctx=None):
+        return 255.0
+
+    def getRGBA(self, c, ctx=None):
+        return [255, 255, 255, 255]
+
+    def getChannelLookupTable(self, c, ctx=None):
+        return None
+
+    def setModel(self, *args):
+        pass
+
+    def setChannelWindow(self, *args):
+        pass
+
+    def setRGBA(self, *args):
+        pass
+
+    def setChannelLookupTable(self, *args):
+        pass
+
+    def removeCodomainMapFromChannel(self, *args):
+        pass
+
+    def renderAsPackedInt(self, pd, ctx=None):
+        mask = sum(1 << c for c, a in enumerate(self.active) if a)
+        value = (0xFF << 24) | (pd.z << 16) | (pd.t << 8) | mask
+        if pd.region is None:
+            width, height = self.size
+        else:
+            width, height = pd.region.width, pd.region.height
+        # Java ints are signed
+        return [value - (1 << 32)] * (width * height)
+
+    def close(self):
+        self.closed = True
+
+
 @pytest.fixture(scope='function')
 def wrapped_image():
     image = ImageI()
@@ -118,3 +186,82 @@ class TestBlitzGatewayImageWrapper(object):
         data = wrapped_image.simpleMarshal(xtra={'tiled': True})
         self.assert_data(data)
         assert data['tiled'] is False
+
+
+class TestBlitzGatewayRenderBatch(object):
+    """Tests for `ImageWrapper.renderBatch` against a mock engine."""
+
+    @pytest.fixture
+    def image(self, wrapped_image):
+        pytest.importorskip("numpy")
+        pixels = PixelsI()
+        pixels.sizeX = rint(5)
+        pixels.sizeY = rint(4)
+        pixels.sizeC = rint(3)
+        wrapped_image._obj.addPixels(pixels)
+        wrapped_image._re = MockRenderingEngine(5, 4, 3)
+        wrapped_image._prepareRenderingEngine = lambda: True
+        self.engines = []
+
+        def prepare(rdid=None):
+            re = MockRenderingEngine(5, 4, 3)
+            self.engines.append(re)
+            return re
+        wrapped_image._prepareRE = prepare
+        return wrapped_image
+
+    def test_unpack_rgb(self):
+        numpy = pytest.importorskip("numpy")
+        rgb = unpackRGB([-16711423, 0x00FFFFFF, 0x0000FF00, 7], 2, 2)
+        assert (2, 2, 3) == rgb.shape
+        assert numpy.uint8 == rgb.dtype
+        assert [[[1, 1, 1], [255, 255, 255]], [[0, 255, 0], [0, 0, 7]]] \
+            == rgb.tolist()
+
+    @pytest.mark.parametrize("workers", [1, 2, 3])
+    def test_render_batch(self, image, workers):
+        requests = [(z, t, channels, None)
+                    for z in range(2) for t in range(2)
+                    for channels in ((1,), (2, 3), (-1, 3))]
+        requests.append((1, 0, None, (1, 1, 2, 2)))
+        requests.append((0, 1, [1], (3, 2, 4, 4)))
+        rv = image.renderBatch(requests, workers=workers)
+        assert len(requests) == len(rv)
+        for (z, t, channels, region), rgb in zip(requests, rv):
+            if channels is None:
+                mask = 7
+            else:
+                mask = sum(1 << (c - 1) for c in channels if c > 0)
+            assert (rgb[..., 0] == z).all()
+            assert (rgb[..., 1] == t).all()
+            assert (rgb[..., 2] == mask).all()
+        assert (4, 5, 3) == rv[0].shape
+        assert (2, 2, 3) == rv[-2].shape
+        assert (2, 2, 3) == rv[-1].shape  # truncated at the plane edge
+        # Extra engines are closed and the current one is left unchanged
+        assert workers - 1 == len(self.engines)
+        assert all(re.closed for re in self.engines)
+        assert [True] * 3 == image._re.active
+        assert not image._re.closed
+
+    def test_render_batch_groups_channels(self, image):
+        requests = [(z, 0, [1 + z % 2], None) for z in range(6)]
+        image.renderBatch(requests)
+        # Two switches into each channel set, two when restoring
+        assert 2 + 2 + 2 == image._re.setActiveCalls
+
+    @pytest.mark.parametrize("projection", ["normal", "intmax"])
+    def test_split_panels_projection(self, image, projection):
+        rendered = []
+        image.setProjection(projection)
+        image.setActiveChannels = lambda channels: rendered.append(channels)
+        image.renderImage = lambda z, t, compression: "jpeg"
+        panels = image._renderSplit_panels(0, 0, [1, 0, 3], 0.9)
+        assert [0, 2] == sorted(panels)
+        if projection == "normal":
+            assert [] == rendered
+            assert (5, 4) == panels[0].size
+        else:
+            # Projections are not supported by renderBatch
+            assert [(1,), (3,)] == rendered
+            assert "jpeg" == panels[2]
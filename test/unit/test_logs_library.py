@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2026 University of Dundee & Open Microscopy Environment.
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Test of the parallel log analysis in omero.install.logs_library
+"""
+
+import pytest
+
+from omero.install.logs_library import allthreads_watcher
+from omero.install.logs_library import analyze
+from omero.install.logs_library import read_range
+from omero.install.logs_library import split_ranges
+
+
+PREFIX = "INFO  [        ome.services.util.ServiceHandler]"
+
+
+def line(second, millis, thread, message):
+    date = "2009-04-09 15:11:%02d,%03d" % (second, millis)
+    return "%s %s %-12s%s\n" % (date, PREFIX, thread, message)
+
+
+def write_log(tmpdir, name, calls):
+    """
+    calls is a list of (thread, method, start, stop) with start and stop
+    given as (second, millis). Entries and exits are interleaved.
+    """
+    events = []
+    for thread, method, start, stop in calls:
+        events.append((start, line(start[0], start[1], thread,
+                       "  Meth:    interface %s" % method)))
+        events.append((stop, line(stop[0], stop[1], thread,
+                       "  Rslt:    null")))
+        events.append((stop, line(stop[0], stop[1], thread,
+                       "  Noise:   unrelated message")))
+    events.sort(key=lambda x: x[0])
+    p = tmpdir.join(name)
+    p.write("".join(x[1] for x in events))
+    return str(p)
+
+
+CALLS = [
+    ("(l.Srv-1)", "ome.api.IQuery.find", (1, 0), (1, 500)),
+    ("(l.Srv-2)", "ome.api.IQuery.find", (1, 100), (3, 100)),
+    ("(l.Srv-3)", "ome.api.IUpdate.save", (2, 0), (2, 10)),
+    ("(l.Srv-1)", "ome.api.IUpdate.save", (4, 0), (9, 0)),
+    ("(l.Srv-2)", "ome.api.IQuery.find", (5, 0), (5, 250)),
+]
+
+
+class TestLogsLibrary(object):
+
+    def testReadRangeCoversAllLines(self, tmpdir):
+        f = write_log(tmpdir, "Blitz-0.log", CALLS)
+        expected = open(f).read().splitlines()
+        for chunk in (1, 7, 100, 1000000):
+            lines = []
+            for name, start, end in split_ranges([f], chunk):
+                lines.extend(read_range(name, start, end))
+            assert lines == expected
+
+    @pytest.mark.parametrize("chunk", [50, 333, 100000])
+    @pytest.mark.parametrize("processes", [1, 2])
+    def testAnalyzeMatchesWatcher(self, tmpdir, chunk, processes):
+        f = write_log(tmpdir, "Blitz-0.log", CALLS)
+        stats = analyze([f], processes=processes, chunk_size=chunk, top=2)
+
+        expected = {}
+        for ll in allthreads_watcher([f]).gen():
+            expected.setdefault(ll.method, []).append(ll.took)
+        for method, values in expected.items():
+            assert sorted(stats.durations[method]) == \
+                pytest.approx(sorted(values))
+        assert set(stats.durations) == set(expected)
+        assert stats.unmatched == 0
+
+        slowest = stats.slowest_calls()
+        assert [x[0] for x in slowest] == pytest.approx([5.0, 2.0])
+        assert slowest[0][3] == "interface ome.api.IUpdate.save"
+
+    def testSummary(self, tmpdir):
+        f = write_log(tmpdir, "Blitz-0.log", CALLS)
+        summary = analyze([f], processes=1).summary((50,))
+        assert [x[0] for x in summary] == [
+            "interface ome.api.IUpdate.save", "interface ome.api.IQuery.find"]
+        method, count, total, mean, p50, maximum = summary[1]
+        assert count == 3
+        assert total == pytest.approx(2.75)
+        assert p50 == pytest.approx(0.5)
+        assert maximum == pytest.approx(2.0)
+
+    def testCallsAcrossFiles(self, tmpdir):
+        first = tmpdir.join("Blitz-0.log.1")
+        first.write(line(1, 0, "(l.Srv-1)", "  Meth:    interface a.b"))
+        second = tmpdir.join("Blitz-0.log")
+        second.write(line(2, 0, "(l.Srv-1)", "  Rslt:    null") +
+                     line(2, 0, "(l.Srv-2)", "  Rslt:    null"))
+        stats = analyze([str(first), str(second)], processes=1)
+        assert list(stats.durations["interface a.b"]) == [1.0]
+        assert stats.unmatched == 1
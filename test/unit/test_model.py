@@ -388,6 +388,14 @@ class TestModel(object):
 
     CONV_IDS = ["%s_%s_%s_%s" % tuple(x[1:]) for x in CONV_DATA]
 
+    @pytest.mark.parametrize("data", CONV_DATA, ids=CONV_IDS)
+    def testConvertArray(self, data):
+        Type, v_from, u_from, v_to, u_to = data
+        rv = Type.convertArray([v_from, v_from * 2], u_from, u_to)
+        q_to = Type(Type(v_from * 2, u_from), u_to)
+        pytest.assertAlmostEqual(v_to, rv[0], places=4)
+        pytest.assertAlmostEqual(q_to.getValue(), rv[1], places=4)
+
     @pytest.mark.parametrize("data", CONV_DATA, ids=CONV_IDS)
     def testConversionData(self, data):
         Type, v_from, u_from, v_to, u_to = data
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests for the block-wise parsing and batch writing of
+   omero.util.populate_metadata
+
+   Copyright 2026 University of Dundee & Open Microscopy Environment.
+   All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import copy
+import threading
+import time
+
+from collections import defaultdict
+
+import pytest
+
+from omero.constants.namespaces import NSBULKANNOTATIONS
+from omero.grid import BoolColumn, DoubleColumn, LongColumn, PlateColumn
+from omero.grid import StringColumn, WellColumn
+from omero.rtypes import unwrap
+from omero.util.metadata_mapannotations import MapAnnotationManager
+from omero.util.populate_metadata import BatchWriter, MetadataError
+from omero.util.populate_metadata import BulkToMapAnnotationContext
+from omero.util.populate_metadata import DeleteMapAnnotationContext
+from omero.util.populate_metadata import ParsingContext, Skip, ValueResolver
+
+
+class Saver(object):
+
+    def __init__(self, delay=0, fail=None):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if self.fail is not None and self.fail in batch:
+                raise Exception("save failed")
+            with self.lock:
+                self.batches.append(list(batch))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def write(writer, items):
+    pos = 0
+    while pos < len(items):
+        batch = items[pos:pos + writer.batch_size]
+        writer.submit(batch, nbytes=len(batch) * 10)
+        pos += len(batch)
+    return writer.close()
+
+
+class TestBatchWriter(object):
+
+    def testOrdered(self):
+        saver = Saver()
+        writer = BatchWriter(saver, 10, max_batch_size=80)
+        assert 1000 == write(writer, range(1000))
+        assert range(1000) == sum(saver.batches, [])
+        # Fast saves grow the batch size up to the maximum
+        sizes = [len(b) for b in saver.batches[:-1]]
+        assert 10 == sizes[0]
+        assert sorted(sizes) == sizes
+        assert 80 == sizes[-1] == writer.batch_size
+
+    def testMaxBytes(self):
+        writer = BatchWriter(Saver(), 10, max_bytes=250)
+        write(writer, range(100))
+        assert 25 == writer.batch_size
+
+    def testSlowSaves(self):
+        writer = BatchWriter(Saver(delay=0.05), 40, min_batch_size=10)
+        writer.TARGET_LATENCY = 0.01
+        write(writer, range(100))
+        assert 10 == writer.batch_size
+
+    def testStreams(self):
+        saver = Saver(delay=0.02)
+        writer = BatchWriter(saver, 5, streams=3, max_batch_size=5)
+        assert 100 == write(writer, range(100))
+        assert range(100) == sorted(sum(saver.batches, []))
+        assert 3 == saver.max_active
+
+    def testFailure(self):
+        writer = BatchWriter(Saver(fail=15), 10, streams=2, max_batch_size=10)
+        with pytest.raises(Exception):
+            write(writer, range(100))
+
+    def testAbort(self):
+        saver = Saver(delay=0.02)
+        writer = BatchWriter(saver, 10, streams=2)
+        for pos in range(0, 100, 10):
+            writer.submit(range(pos, pos + 10))
+        writer.abort()
+        assert len(saver.batches) < 10
+        with pytest.raises(MetadataError):
+            writer.submit([1])
+
+
+class MockValueResolver(ValueResolver):
+
+    def __init__(self, plates):
+        self.plates = plates
+        self.calls = []
+
+    def resolve(self, column, value, row):
+        self.calls.append((column.name, value))
+        if PlateColumn is column.__class__:
+            return self.plates.get(value, Skip())
+        if WellColumn is column.__class__:
+            assert PlateColumn is row[0][0].__class__
+            return "%s/%s" % (self.plates[row[0][1]], value)
+        return super(MockValueResolver, self).resolve(column, value, row)
+
+
+class TestPopulateBlock(object):
+
+    def ctx(self, columns, plates=None):
+        ctx = ParsingContext.__new__(ParsingContext)
+        ctx.value_resolver = MockValueResolver(plates or {})
+        ctx.columns = columns
+        return ctx
+
+    def testColumnTypes(self):
+        ctx = self.ctx([
+            StringColumn(name="s", size=1, values=[]),
+            DoubleColumn(name="d", values=[]),
+            LongColumn(name="l", values=[]),
+            BoolColumn(name="b", values=[]),
+        ])
+        ctx.populate_block([["a", "1.5", "3", "yes"],
+                            ["abcdef", "2", "4", "no"]])
+        assert [["a", "abcdef"], [1.5, 2.0], [3, 4], [True, False]] == [
+            c.values for c in ctx.columns]
+        # Bulk conversions do not go through resolve()
+        assert [] == ctx.value_resolver.calls
+
+    @pytest.mark.parametrize("values,size", [
+        ([], 1),
+        (["ab", "abcdef", ""], 6),
+        (["abcdefghij"], 10),
+    ])
+    def testStringColumnSize(self, values, size):
+        ctx = self.ctx([StringColumn(name="s", size=1, values=[])])
+        ctx.populate_block([[v] for v in values])
+        assert size == ctx.columns[0].size
+        assert values == ctx.columns[0].values
+
+    @pytest.mark.parametrize("name", ["Row", "Column"])
+    def testRowColumn(self, name):
+        ctx = self.ctx([LongColumn(name=name, values=[])])
+        ctx.populate_block([["1"], ["a"], ["B"], ["12"], ["ab"], ["b"]])
+        # Numbers are 1-based, letters are 0-based
+        assert [0, 0, 1, 11, 27, 1] == ctx.columns[0].values
+        # Each distinct value is resolved once
+        assert 6 == len(ctx.value_resolver.calls)
+
+    def testPlateNotFirst(self):
+        ctx = self.ctx([
+            WellColumn(name="Well", values=[]),
+            StringColumn(name="s", size=1, values=[]),
+            PlateColumn(name="Plate", values=[]),
+        ], plates={"p1": 1, "p2": 2})
+        ctx.populate_block([["A1", "x", "p1"],
+                            ["A1", "y", "p2"],
+                            ["A1", "z", "p1"],
+                            ["B2", "w", "p2"]])
+        assert ["1/A1", "2/A1", "1/A1", "2/B2"] == ctx.columns[0].values
+        assert ["x", "y", "z", "w"] == ctx.columns[1].values
+        assert [1, 2, 1, 2] == ctx.columns[2].values
+        # Wells are resolved once per (well, plate)
+        wells = [c for c in ctx.value_resolver.calls if c[0] == "Well"]
+        assert 3 == len(wells)
+
+    def testUnknownPlateDropped(self):
+        ctx = self.ctx([
+            StringColumn(name="s", size=1, values=[]),
+            PlateColumn(name="Plate", values=[]),
+            WellColumn(name="Well", values=[]),
+        ], plates={"p1": 1})
+        ctx.populate_block([["abcdef", "unknown", "A1"],
+                            ["x", "p1", "A1"],
+                            ["y", "unknown", "B1"],
+                            ["z", "p1", "B1"]])
+        assert [["x", "z"], [1, 1], ["1/A1", "1/B1"]] == [
+            c.values for c in ctx.columns]
+        # The size only counts the rows that were kept
+        assert 1 == ctx.columns[0].size
+        # Wells of dropped rows are never resolved
+        assert [("Well", "A1"), ("Well", "B1")] == [
+            c for c in ctx.value_resolver.calls if c[0] == "Well"]
+
+    def testShortRows(self):
+        ctx = self.ctx([
+            StringColumn(name="s", size=1, values=[]),
+            LongColumn(name="l", values=[]),
+            StringColumn(name="Plate Name", size=1, values=[]),
+        ])
+        ctx.populate_block([["a", "1", "p"], ["b", "2"], ["c", "3"],
+                            ["d", "4", "q"]])
+        assert [["a", "b", "c", "d"], [1, 2, 3, 4], ["p", "q"]] == [
+            c.values for c in ctx.columns]
+
+    @pytest.mark.parametrize("row", [["a"], ["a", "1", "p", "extra"]])
+    def testBadRowLength(self, row):
+        ctx = self.ctx([
+            StringColumn(name="s", size=1, values=[]),
+            LongColumn(name="l", values=[]),
+            StringColumn(name="Plate Name", size=1, values=[]),
+        ])
+        with pytest.raises(IndexError):
+            ctx.populate_block([row])
+
+
+class MockData(object):
+
+    def __init__(self, columns):
+        self.columns = columns
+
+
+class MockTable(object):
+
+    def __init__(self, columns, fail=None):
+        self.columns = columns
+        self.fail = fail
+        self.reads = []
+        self.closed = False
+
+    def getNumberOfRows(self):
+        return len(self.columns[0].values)
+
+    def getHeaders(self):
+        return self.columns
+
+    def read(self, colnumbers, start, stop):
+        if start == self.fail:
+            raise Exception("read failed")
+        self.reads.append((start, stop))
+        columns = []
+        for n in colnumbers:
+            column = copy.copy(self.columns[n])
+            column.values = self.columns[n].values[start:stop]
+            columns.append(column)
+        return MockData(columns)
+
+    def close(self):
+        self.closed = True
+
+
+class TestBulkToMapAnnotationContext(object):
+
+    def ctx(self, fail=None):
+        ctx = BulkToMapAnnotationContext.__new__(BulkToMapAnnotationContext)
+        ctx.BLOCK_SIZE = 2
+        ctx.options = {}
+        # Gene is in a keyed namespace, Well and Value in the default one
+        ctx.default_cfg = {}
+        ctx.column_cfgs = [{"group": {
+            "namespace": "gene", "columns": [{"name": "Gene"}]}}]
+        ctx.advanced_cfgs = {"well_to_images": True}
+        ctx.pkmap = {"gene": ["Gene"]}
+        ctx.mapannotations = MapAnnotationManager()
+        ctx.nokey_count = 0
+        # Well n contains Image 10 * n
+        ctx.projection = lambda q, wellid: [10 * wellid]
+        ctx.tables = []
+
+        def open_table():
+            table = MockTable([
+                WellColumn(name="Well", values=[1, 2, 3, 4, 0]),
+                StringColumn(name="Gene", size=2,
+                             values=["g1", "g2", "g1", "g2", "g1"]),
+                StringColumn(name="Value", size=1,
+                             values=["a", "b", "c", "d", "e"]),
+            ], fail=fail)
+            ctx.tables.append(table)
+            return table
+        ctx._open_table = open_table
+        return ctx
+
+    def testParse(self):
+        ctx = self.ctx()
+        ctx.parse()
+        assert [(0, 2), (2, 4), (4, 5)] == ctx.tables[0].reads
+        assert ctx.tables[0].closed
+        # Keyed annotations are merged across rows and blocks
+        cmas = dict((dict(c.kvpairs)["Gene"], c)
+                    for c in ctx.mapannotations.get_map_annotations())
+        assert ["g1", "g2"] == sorted(cmas)
+        assert set([("Well", 1), ("Image", 10), ("Well", 3),
+                    ("Image", 30)]) == cmas["g1"].get_parents()
+        # Unkeyed annotations are only counted, the row with an invalid
+        # Well is skipped
+        assert 4 == ctx.nokey_count
+        assert [] == ctx.mapannotations.nokey
+
+    def testNoKeyMapAnnotations(self):
+        ctx = self.ctx()
+        ctx.parse()
+        cmas = list(ctx._nokey_map_annotations())
+        assert 2 == len(ctx.tables)
+        assert ctx.tables[1].closed
+        assert [NSBULKANNOTATIONS] * 4 == [c.ns for c in cmas]
+        assert [None] * 4 == [c.primary for c in cmas]
+        assert ["a", "b", "c", "d"] == [
+            dict(c.kvpairs)["Value"] for c in cmas]
+        assert set([("Well", 2), ("Image", 20)]) == cmas[1].get_parents()
+
+    def testNoKeyMapAnnotationsNotRead(self):
+        ctx = self.ctx()
+        assert [] == list(ctx._nokey_map_annotations())
+        assert [] == ctx.tables
+
+    def testWriteToOmero(self):
+        ctx = self.ctx()
+        ctx.parse()
+        saved = []
+        ctx._save_annotation_links = saved.extend
+        ctx.write_to_omero()
+        links = set((unwrap(link.getChild().getNs()),
+                     link.getParent().__class__.__name__,
+                     unwrap(link.getParent().getId())) for link in saved)
+        assert 16 == len(saved) == len(links)
+        for wellid in range(1, 5):
+            for ns in ("gene", NSBULKANNOTATIONS):
+                assert (ns, "WellI", wellid) in links
+                assert (ns, "ImageI", 10 * wellid) in links
+
+    def testPrefetchFailure(self):
+        ctx = self.ctx(fail=2)
+        ctx.nokey_count = 4
+        with pytest.raises(Exception) as exc_info:
+            list(ctx._nokey_map_annotations())
+        assert "read failed" == str(exc_info.value)
+        assert ctx.tables[0].closed
+
+    def testWriteToOmeroFailure(self):
+        ctx = self.ctx(fail=2)
+        ctx.nokey_count = 4
+        ctx._save_annotation_links = lambda links: None
+        with pytest.raises(Exception) as exc_info:
+            ctx.write_to_omero()
+        assert "read failed" == str(exc_info.value)
+
+
+class TestDeleteMapAnnotationContext(object):
+
+    def ctx(self):
+        ctx = DeleteMapAnnotationContext.__new__(DeleteMapAnnotationContext)
+        ctx.mapannlinks = defaultdict(list)
+        # MapAnnotation 1 is linked to a Well and two Images
+        ctx.mapannlinks[1] = [("Well", 10), ("Image", 20), ("Image", 21)]
+        for annid in range(2, 6):
+            ctx.mapannlinks[annid] = [("Image", 20 + annid)]
+        ctx.fileannids = set([7, 8, 9])
+        return ctx
+
+    def testPlanBatches(self):
+        batches = self.ctx()._plan_batches(3)
+        assert 4 == len(batches)
+        # All links to MapAnnotation 1 are in the same batch
+        wells = [b for b in batches if "WellAnnotationLink" in b]
+        assert [10] == wells[0]["WellAnnotationLink"]
+        assert set([20, 21]) <= set(wells[0]["ImageAnnotationLink"])
+        links = sorted(sum((b.get("ImageAnnotationLink", [])
+                            for b in batches), []))
+        assert [20, 21, 22, 23, 24, 25] == links
+        assert [7, 8, 9] == sorted(batches[-1]["FileAnnotation"])
+
+    def testWriteToOmero(self):
+        ctx = self.ctx()
+        deleted = []
+        ctx._write_to_omero_batch = lambda to_delete, loops, ms: \
+            deleted.append(to_delete)
+        ctx.write_to_omero(batch_size=2)
+        ids = sorted(i for to_delete in deleted
+                     for v in to_delete.values() for i in v)
+        assert [7, 8, 9, 10, 20, 21, 22, 23, 24, 25] == ids
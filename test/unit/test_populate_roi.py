@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests for the original file providers of omero.util.populate_roi
+
+   Copyright 2026 University of Dundee & Open Microscopy Environment.
+   All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import csv
+import hashlib
+
+import pytest
+
+from xml.etree.cElementTree import iterparse
+
+from omero.rtypes import rlong, rstring
+from omero.model import ChecksumAlgorithmI, OriginalFileI
+from omero.util.populate_roi import AbstractMeasurementCtx
+from omero.util.populate_roi import MeasurementError, ThreadPool
+from omero.util.populate_roi import OriginalFileCache
+from omero.util.populate_roi import StreamingOriginalFileProvider
+from omero.util.populate_roi import parse_mias_detail
+
+
+class MockRawFileStore(object):
+
+    def __init__(self, files, fail_at=None):
+        self.files = files
+        self.fail_at = fail_at
+        self.reads = 0
+        self.closed = False
+
+    def setFileId(self, id):
+        self.data = self.files[id]
+
+    def read(self, position, length):
+        if position == self.fail_at:
+            raise Exception("read failed")
+        self.reads += 1
+        return self.data[position:position + length]
+
+    def close(self):
+        self.closed = True
+
+
+class MockServiceFactory(object):
+
+    def __init__(self, files, fail_at=None):
+        self.files = files
+        self.fail_at = fail_at
+        self.stores = []
+
+    def createRawFileStore(self):
+        store = MockRawFileStore(self.files, self.fail_at)
+        self.stores.append(store)
+        return store
+
+
+def original_file(id, data, hash=True, hasher="SHA1-160"):
+    f = OriginalFileI(id, True)
+    f.size = rlong(len(data))
+    if hash:
+        f.hash = rstring(hashlib.sha1(data).hexdigest())
+        f.hasher = ChecksumAlgorithmI()
+        f.hasher.value = rstring(hasher)
+    return f
+
+
+class TestStreamingOriginalFileProvider(object):
+
+    TSV = "".join("%d\t%d.5\tcell %d\n" % (i, i, i) for i in range(1000))
+
+    XML = "<Results>%s</Results>" % "".join(
+        '<Measure key="k%d" value="%d"/>' % (i, i) for i in range(500))
+
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return OriginalFileCache(directory=tmpdir)
+
+    def provider(self, sf, cache):
+        provider = StreamingOriginalFileProvider(sf, cache, readahead=2)
+        provider.BUFFER_SIZE = 1000
+        return provider
+
+    def testCsv(self, cache):
+        sf = MockServiceFactory({1: self.TSV})
+        data = self.provider(sf, cache).get_original_file_data(
+            original_file(1, self.TSV))
+        try:
+            rows = list(csv.reader(data, delimiter='\t'))
+        finally:
+            data.close()
+        assert 1000 == len(rows)
+        assert ['999', '999.5', 'cell 999'] == rows[-1]
+        assert sf.stores[0].closed
+
+    def testIterparse(self, cache):
+        sf = MockServiceFactory({1: self.XML})
+        data = self.provider(sf, cache).get_original_file_data(
+            original_file(1, self.XML))
+        try:
+            values = [element.get('value')
+                      for event, element in iterparse(data)
+                      if element.tag == 'Measure']
+        finally:
+            data.close()
+        assert [str(i) for i in range(500)] == values
+
+    def testRead(self, cache):
+        sf = MockServiceFactory({1: self.TSV})
+        data = self.provider(sf, cache).get_original_file_data(
+            original_file(1, self.TSV))
+        end = self.TSV.index("\n", 1500) + 1
+        try:
+            assert self.TSV[:1500] == data.read(1500)
+            assert self.TSV[1500:end] == data.readline()
+            assert self.TSV[end:] == data.read()
+            assert "" == data.read()
+        finally:
+            data.close()
+
+    def testCached(self, cache):
+        sf = MockServiceFactory({1: self.TSV, 2: self.TSV})
+        provider = self.provider(sf, cache)
+        for id in (1, 2):
+            data = provider.get_original_file_data(original_file(id, self.TSV))
+            try:
+                assert self.TSV == data.read()
+            finally:
+                data.close()
+        # The second file has the same content and is read from the cache
+        assert 1 == len(sf.stores)
+
+    def testNotCached(self, cache):
+        sf = MockServiceFactory({1: self.TSV})
+        provider = self.provider(sf, cache)
+        for hash in (False, True):
+            f = original_file(1, self.TSV, hash)
+            if hash:
+                f.hash = rstring(hashlib.sha1("other").hexdigest())
+            data = provider.get_original_file_data(f)
+            try:
+                assert self.TSV == data.read()
+            finally:
+                data.close()
+        assert not cache.dir.listdir()
+        assert 2 == len(sf.stores)
+
+    def testEarlyClose(self, cache):
+        sf = MockServiceFactory({1: self.TSV})
+        data = self.provider(sf, cache).get_original_file_data(
+            original_file(1, self.TSV))
+        data.readline()
+        data.close()
+        assert sf.stores[0].closed
+        assert not cache.dir.listdir()
+
+    def testFailure(self, cache):
+        sf = MockServiceFactory({1: self.TSV}, fail_at=5000)
+        data = self.provider(sf, cache).get_original_file_data(
+            original_file(1, self.TSV))
+        try:
+            with pytest.raises(IOError):
+                data.read()
+        finally:
+            data.close()
+        assert not cache.dir.listdir()
+
+    def testEviction(self, tmpdir):
+        cache = OriginalFileCache(len(self.TSV) + 1, tmpdir)
+        sf = MockServiceFactory({1: self.TSV, 2: self.TSV + "x"})
+        provider = self.provider(sf, cache)
+        for id, content in sf.files.items():
+            data = provider.get_original_file_data(
+                original_file(id, content))
+            data.read()
+            data.close()
+        assert ["sha1-160-" + hashlib.sha1(self.TSV + "x").hexdigest()] == \
+            [f.basename for f in tmpdir.listdir()]
+
+    @pytest.mark.parametrize("hasher", ["File-Size-64", "Murmur3-128"])
+    def testUnsupportedHasher(self, cache, hasher):
+        sf = MockServiceFactory({1: self.TSV})
+        provider = self.provider(sf, cache)
+        for i in range(2):
+            data = provider.get_original_file_data(
+                original_file(1, self.TSV, hasher=hasher))
+            try:
+                assert self.TSV == data.read()
+            finally:
+                data.close()
+        assert not cache.dir.listdir()
+        assert 2 == len(sf.stores)
+
+    def testHasherInKey(self, cache):
+        sha1 = original_file(1, self.TSV)
+        other = original_file(2, self.TSV, hasher="MD5-128")
+        assert cache._entry(sha1) != cache._entry(other)
+
+
+class MockUpdateService(object):
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.batches = []
+
+    def saveAndReturnIds(self, rois):
+        self.batches.append(len(rois))
+        if self.fail in rois:
+            raise Exception("save failed")
+        return [roi * 10 for roi in rois]
+
+
+class MockTable(object):
+
+    def __init__(self):
+        self.blocks = []
+
+    def initialize(self, columns):
+        pass
+
+    def addData(self, columns):
+        self.blocks.append([list(column.values) for column in columns])
+
+    def close(self):
+        pass
+
+
+class Column(object):
+
+    def __init__(self, values):
+        self.name = "c"
+        self.values = values
+
+
+class TestMeasurementCtx(object):
+
+    def ctx(self, update_service=None):
+        ctx = AbstractMeasurementCtx.__new__(AbstractMeasurementCtx)
+        ctx.thread_pool = ThreadPool(3)
+        ctx.update_service = update_service
+        ctx.ROI_UPDATE_LIMIT = 7
+        ctx.TABLE_UPDATE_LIMIT = 4
+        return ctx
+
+    def testParseMiasDetail(self):
+        text = "Parameter\tvalue\nImage\tROI\tArea\n1\t2\t3.5\n4\t5\t6\n"
+        width, headers, rows = parse_mias_detail(text)
+        assert 3 == width
+        assert ["Image", "ROI", "Area"] == headers
+        assert [[4.0, 5.0, 6.0], [1.0, 2.0, 3.5]] == rows
+        assert (0, None, []) == parse_mias_detail("")
+
+    def testSaveRois(self):
+        update_service = MockUpdateService()
+        ids = self.ctx(update_service).save_rois(iter(range(50)))
+        assert [roi * 10 for roi in range(50)] == ids
+        assert [7] * 7 + [1] == sorted(update_service.batches, reverse=True)
+
+    def testSaveRoisFails(self):
+        with pytest.raises(MeasurementError):
+            self.ctx(MockUpdateService(fail=20)).save_rois(range(50))
+
+    def testWriteTable(self):
+        ctx = self.ctx()
+        ctx.table = MockTable()
+        columns = [Column(range(10)), Column(range(10, 20))]
+        ctx.write_table(columns)
+        assert [[range(0, 4), range(10, 14)],
+                [range(4, 8), range(14, 18)],
+                [range(8, 10), range(18, 20)]] == ctx.table.blocks
+        assert range(10) == columns[0].values
@@ -23,8 +23,17 @@
 Simple tests of various ROI utilities
 """
 
+import pytest
+
+from numpy import array, array_equal
+
 from omero.util.ROI_utils import pointsStringToXYlist, xyListToBbox
 from omero.util.roi_handling_utils import points_string_to_xy_list
+from omero.util.roi_handling_utils import array_to_points_string
+from omero.util.roi_handling_utils import arrays_to_shapes, shapes_to_arrays
+from omero.util.roi_handling_utils import pack_arrays, points_string_to_array
+from omero.util.roi_handling_utils import bounding_boxes, polygon_areas
+from omero.util.roi_handling_utils import polygon_centroids
 
 
 class TestRoiUtils(object):
@@ -59,3 +68,60 @@ class TestRoiUtils(object):
             "1,2 3,4 5,6"
         ))
         assert xy_list == [(1, 2), (3, 4), (5, 6)]
+
+
+class Shape(object):
+
+    def setPoints(self, points):
+        self.points = points
+
+    def getPoints(self):
+        return self.points
+
+
+class TestRoiArrays(object):
+
+    SQUARE = array([[0, 0], [2, 0], [2, 2], [0, 2]])
+    TRIANGLE = array([[1, 1], [4, 1], [1, 4]])
+    LINE = array([[0, 0], [2, 2]])
+
+    def test_string_to_array(self):
+        expected = [[1, 2], [3, 4], [5.5, 6]]
+        for string in ("1,2 3,4 5.5,6", "points[1,2, 3,4, 5.5,6] "):
+            points = points_string_to_array(string)
+            assert (3, 2) == points.shape
+            assert expected == points.tolist()
+
+    @pytest.mark.parametrize("string", ["", "1,2 3", "1,2 a,4"])
+    def test_string_to_array_invalid(self, string):
+        with pytest.raises(ValueError):
+            points_string_to_array(string)
+
+    def test_array_to_string(self):
+        assert "1,2 3,4" == array_to_points_string(array([[1, 2], [3, 4]]))
+        assert "1.5,2.0" == array_to_points_string(array([[1.5, 2]]))
+        for dtype in ("uint64", "int64", "int32", "uint8"):
+            assert "1,2 3,4" == array_to_points_string(
+                array([[1, 2], [3, 4]], dtype=dtype))
+        assert "1.5,2.0" == array_to_points_string(
+            array([[1.5, 2]], dtype="float32"))
+        points = points_string_to_array("0.1,2 3,4.25")
+        assert array_equal(
+            points, points_string_to_array(array_to_points_string(points)))
+
+    def test_shapes(self):
+        arrays = [self.SQUARE, self.TRIANGLE]
+        shapes = arrays_to_shapes(arrays, Shape)
+        assert "0,0 2,0 2,2 0,2" == shapes[0].getPoints().getValue()
+        for a, b in zip(arrays, shapes_to_arrays(shapes)):
+            assert array_equal(a, b)
+
+    def test_geometry(self):
+        points, offsets = pack_arrays(
+            [self.SQUARE, self.TRIANGLE, self.LINE[:0], self.LINE])
+        assert [0, 4, 7, 7, 9] == offsets.tolist()
+        assert [4, 4.5, 0, 0] == polygon_areas(points, offsets).tolist()
+        assert [[1, 1], [2, 2], [0, 0], [1, 1]] == \
+            polygon_centroids(points, offsets).tolist()
+        assert [[0, 0, 2, 2], [1, 1, 3, 3], [0, 0, 0, 0], [0, 0, 2, 2]] == \
+            bounding_boxes(points, offsets).tolist()
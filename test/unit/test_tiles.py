@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests for the tile utilities in omero.util.tiles
+
+   Copyright 2026 University of Dundee & Open Microscopy Environment.
+   All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+
+"""
+
+import random
+import time
+
+import pytest
+
+from omero.util.tiles import PixelsWriter, big_endian
+from omero.util.tiles import ParallelTileLoop, TileLoop, TileData
+from omero.util.tiles import TileLoopIteration, tile_index
+
+numpy = pytest.importorskip("numpy")
+
+
+class MockRPS(object):
+
+    def __init__(self, shape, dtype, fail=False):
+        self.data = numpy.zeros(shape, dtype=dtype)
+        self.calls = []
+        self.fail = fail
+
+    def getTileSize(self):
+        return 3, 2
+
+    def setTile(self, buf, z, c, t, x, y, w, h):
+        if self.fail:
+            raise Exception("setTile failed")
+        self.calls.append((z, c, t, x, y, w, h))
+        dtype = self.data.dtype.newbyteorder(">")
+        tile = numpy.frombuffer(buf, dtype=dtype).reshape(h, w)
+        self.data[z, c, t, y:y+h, x:x+w] = tile
+
+
+class TestPixelsWriter(object):
+
+    def testBigEndian(self):
+        a = numpy.array([1, 256], dtype="<u2")
+        assert "\x00\x01\x01\x00" == big_endian(a)
+        assert "\x00\x00\x00\x01\x00\x00\x01\x00" == big_endian(a, "int32")
+
+    def testWrite(self):
+        shape = (2, 3, 1, 5, 7)
+        data = numpy.arange(numpy.prod(shape), dtype="uint16").reshape(shape)
+        rps = MockRPS(shape, "uint16")
+        writer = PixelsWriter(rps, 7, 5, 2, 3, 1, data.dtype, queueSize=2)
+        # 3 rows x 3 columns of tiles per plane
+        assert 6 * 9 == writer.write(data)
+        assert (rps.data == data).all()
+        assert (0, 0, 0, 6, 4, 1, 1) == rps.calls[8]
+        for c, (lo, hi) in enumerate(writer.minmax()):
+            assert data[:, c].min() == lo
+            assert data[:, c].max() == hi
+
+    def testTileOrder(self):
+        # Several Z and T so that the plane order matters
+        shape = (3, 2, 2, 5, 7)
+        rps = MockRPS(shape, "uint8")
+        writer = PixelsWriter(rps, 7, 5, 3, 2, 2, "uint8")
+        writer.write(numpy.zeros(shape, dtype="uint8"))
+        serial = Recorder()
+        MockLoop().forEachTile(7, 5, 3, 2, 2, 3, 2, serial)
+        assert serial.calls == rps.calls
+        assert [(1, 0, 0), (2, 0, 0), (0, 1, 0)] == \
+            [call[:3] for call in rps.calls[9:28:9]]
+
+    def testConvert(self):
+        shape = (1, 1, 1, 4, 4)
+        data = numpy.linspace(0, 10, 16).reshape(shape)
+        rps = MockRPS(shape, "int8")
+        writer = PixelsWriter(rps, 4, 4, 1, 1, 1, "int8", 4, 4)
+        writer.write(data)
+        assert (rps.data == data.astype("int8")).all()
+        assert [(0, 10)] == writer.minmax()
+
+    def testBadShape(self):
+        rps = MockRPS((1, 1, 1, 2, 2), "uint8")
+        writer = PixelsWriter(rps, 2, 2, 1, 1, 1, "uint8")
+        with pytest.raises(ValueError):
+            writer.write(numpy.zeros((2, 2), dtype="uint8"))
+
+    def testSetTileFails(self):
+        shape = (1, 1, 1, 8, 8)
+        rps = MockRPS(shape, "uint8", fail=True)
+        writer = PixelsWriter(rps, 8, 8, 1, 1, 1, "uint8", 2, 2, queueSize=1)
+        with pytest.raises(Exception):
+            writer.write(numpy.zeros(shape, dtype="uint8"))
+
+
+class MockData(TileData):
+
+    def __init__(self):
+        self.closed = False
+
+    def getTile(self, z, c, t, x, y, w, h):
+        time.sleep(random.random() / 1000)
+        return (z, c, t, x, y, w, h)
+
+    def close(self):
+        self.closed = True
+
+
+class MockLoop(TileLoop):
+
+    def __init__(self):
+        self.datas = []
+
+    def createData(self):
+        data = MockData()
+        self.datas.append(data)
+        return data
+
+
+class Recorder(TileLoopIteration):
+
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = fail
+
+    def run(self, data, z, c, t, x, y, w, h, tileCount):
+        if tileCount == self.fail:
+            raise ValueError("tile %s" % tileCount)
+        self.calls.append((z, c, t, x, y, w, h))
+        return data.getTile(z, c, t, x, y, w, h)
+
+
+class TestParallelTileLoop(object):
+
+    SIZES = (10, 7, 2, 3, 2, 4, 3)  # X, Y, Z, C, T, tile width, height
+
+    def testTileIndex(self):
+        serial = Recorder()
+        count = MockLoop().forEachTile(*(self.SIZES + (serial,)))
+        index = tile_index(*self.SIZES)
+        assert (count, 7) == index.shape
+        assert serial.calls == [tuple(row) for row in index.tolist()]
+
+    def testOrdered(self):
+        loop = MockLoop()
+        parallel = ParallelTileLoop(loop, workers=3, maxInFlight=4)
+        seen = []
+        count = parallel.forEachTile(*(self.SIZES + (
+            Recorder(), lambda tile, rv: seen.append(rv))))
+        assert count == len(seen)
+        assert [tuple(r) for r in tile_index(*self.SIZES).tolist()] == seen
+        assert 3 == len(loop.datas)
+        assert all(data.closed for data in loop.datas)
+        assert parallel.tilesPerSecond() > 0
+
+    def testUnordered(self):
+        parallel = ParallelTileLoop(MockLoop(), workers=4)
+        seen = []
+        count = parallel.forEachTile(*(self.SIZES + (
+            Recorder(), lambda tile, rv: seen.append(tuple(tile)))),
+            ordered=False)
+        assert count == len(seen)
+        expected = [tuple(r) for r in tile_index(*self.SIZES).tolist()]
+        assert sorted(expected) == sorted(seen)
+
+    @pytest.mark.parametrize("ordered", [True, False])
+    def testFailure(self, ordered):
+        loop = MockLoop()
+        parallel = ParallelTileLoop(loop, workers=2)
+        with pytest.raises(ValueError):
+            parallel.forEachTile(*(self.SIZES + (Recorder(fail=5), None)),
+                                 ordered=ordered)
+        assert all(data.closed for data in loop.datas)